@@ -1,20 +1,148 @@
+import shutil
+import tempfile
+
+from django.conf import settings
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.db.models import F, Max
+from django.http import FileResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
 from .models import Post, Comment, Profile, Escalation
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 from .models import ImageUpload
+from . import events, export, search
+
+
+def estimated_count(queryset):
+    """Row count of the whole table from the database's statistics (or the
+    highest id on SQLite) instead of a COUNT(*) over every row."""
+    connection = connections[queryset.db]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 (or 0) until the table has been analyzed.
+        return row[0] if row and row[0] > 0 else None
+    return queryset.model._default_manager.using(queryset.db).aggregate(last=Max("pk"))["last"]
+
+
+class EstimatedCountPaginator(Paginator):
+    """Counts at most ADMIN_EXACT_COUNT_LIMIT rows. Past that, unfiltered
+    changelists show estimated_count and filtered ones the limit, so a
+    broad search does not count every match."""
+
+    @cached_property
+    def count(self):
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        if not self.object_list.query.where:
+            estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate > limit:
+                return estimate
+            return super().count
+        return self.object_list[:limit].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows.
+
+    Search is ``search_fields`` of the form ``=<relation>__<field>`` (an
+    exact, case-insensitive match on a related row, run as an id subquery)
+    or'ed with ``full_text_fields`` matched through their full-text index
+    (api/search.py), so no search scans the table. A full-text field may
+    be ``<relation>__<column>`` to match the related row's column."""
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) behind "N of M selected".
+    show_full_result_count = False
+    full_text_fields = ()
+
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        model = queryset.model._default_manager.using(queryset.db)
+        # One id list per index, unioned: with an OR instead, SQLite gathers
+        # and sorts every match before returning the first page.
+        matching_ids = []
+        for field in self.search_fields:
+            relation, _, lookup = field.lstrip("=").partition("__")
+            related = queryset.model._meta.get_field(relation).related_model._default_manager
+            rows = related.filter(**{f"{lookup}__iexact": term}).values("pk")
+            matching_ids.append(model.filter(**{f"{relation}__in": rows}).values("pk"))
+        for field in self.full_text_fields:
+            relation, _, column = field.rpartition("__")
+            if relation:
+                related = queryset.model._meta.get_field(relation).related_model._default_manager.using(queryset.db)
+                rows = related.filter(search.matches(related.all(), column, term)).values("pk")
+                matching_ids.append(model.filter(**{f"{relation}__in": rows}).values("pk"))
+            else:
+                matching_ids.append(model.filter(search.matches(queryset, column, term)).values("pk"))
+        first, *rest = matching_ids
+        return queryset.filter(pk__in=first.union(*rest, all=True) if rest else first), False
+
+
+def export_selected(table_name):
+    """Admin action downloading the selected rows as one dataset file, in
+    the format of the export_dataset command."""
+    @admin.action(description="Export selected as a dataset file")
+    def action(modeladmin, request, queryset):
+        file_format = export.default_format()
+        directory = tempfile.mkdtemp(prefix="export-")
+        try:
+            _, paths = export.export_table(
+                export.TABLES[table_name](queryset), directory, file_format, partitioned=False
+            )
+            # The open file outlives the directory removal below.
+            handle = open(paths[0], "rb")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+        filename = f"{table_name}{export.WRITERS[file_format].extension}"
+        return FileResponse(handle, as_attachment=True, filename=filename)
+    action.__name__ = f"export_{table_name}"
+    return action
+
+
+def set_escalation_status(status):
+    """Admin action changing the status of the selected escalations with one
+    UPDATE. It does what Escalation's save signals would: stamps labeled_at
+    and notifies the patients and doctors."""
+    label = dict(Escalation._meta.get_field("status").choices)[status]
+
+    @admin.action(description=f"Mark selected as {label}")
+    def action(modeladmin, request, queryset):
+        changed = queryset.exclude(status=status)
+        rows = list(changed.values_list("id", "image_id", "patient_id"))
+        labeled_at = timezone.now() if status in Escalation.LABELED_STATUSES else F("labeled_at")
+        with transaction.atomic():
+            updated = changed.update(status=status, labeled_at=labeled_at)
+
+            def notify():
+                for escalation_id, image_id, patient_id in rows:
+                    escalation = Escalation(id=escalation_id, image_id=image_id, patient_id=patient_id, status=status)
+                    events.publish_escalation(escalation, created=False)
+            transaction.on_commit(notify)
+        modeladmin.message_user(request, f"{updated} escalation(s) marked as {label}.")
+    action.__name__ = f"mark_{status.replace(' ', '_')}"
+    return action
 
 
 @admin.register(Post)
-class PostAdmin(admin.ModelAdmin):
+class PostAdmin(LargeTableAdmin):
     list_display = ("id", "user", "content", "created_at")
-    search_fields = ("content", "user__username")
+    list_select_related = ("user",)
+    search_fields = ("=user__username",)
+    full_text_fields = ("content",)
     list_filter = ("created_at",)
 
 @admin.register(Comment)
-class CommentAdmin(admin.ModelAdmin):
-    list_display = ("id", "post", "user", "comment", "created_at") 
-    search_fields = ("comment", "user__username", "post__content")
+class CommentAdmin(LargeTableAdmin):
+    list_display = ("id", "post", "user", "comment", "created_at")
+    list_select_related = ("user", "post__user")
+    search_fields = ("=user__username",)
+    full_text_fields = ("comment", "post__content")
     list_filter = ("created_at",)
 
 
@@ -26,24 +154,42 @@ class ProfileInline(admin.StackedInline):
 class UserAdmin(BaseUserAdmin):
     inlines = (ProfileInline,)
     list_display = ('username','email', 'first_name', 'last_name', 'is_staff', 'get_role')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(role=F('profile__role'))
 
     def get_role(self, obj):
-        return obj.profile.role
+        return obj.role
     get_role.short_description = 'Role'
+    get_role.admin_order_field = 'profile__role'
 
 
 @admin.register(ImageUpload)
-class ImageUploadAdmin(admin.ModelAdmin):
+class ImageUploadAdmin(LargeTableAdmin):
     list_display = ('user', 'image', 'uploaded_at')
-    search_fields = ('user__username',)
+    list_select_related = ('user',)
+    search_fields = ('=user__username',)
+    # The model's -uploaded_at has no index; ids follow upload time.
+    ordering = ('-id',)
+    actions = [export_selected("uploads")]
 
 
 @admin.register(Escalation)
-class EscalationAdmin(admin.ModelAdmin):
+class EscalationAdmin(LargeTableAdmin):
     list_display = ('id', 'patient', 'image', 'status', 'submitted_at')
+    list_select_related = ('patient', 'image')
     list_filter = ('status', 'submitted_at')
-    search_fields = ('patient__username', 'reason')
+    search_fields = ('=patient__username',)
+    full_text_fields = ('reason',)
     readonly_fields = ('submitted_at',)
+    actions = [
+        set_escalation_status('cancer positive'),
+        set_escalation_status('cancer negative'),
+        set_escalation_status('unsure'),
+        export_selected("escalations"),
+    ]
 
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
\ No newline at end of file
@@ -0,0 +1,300 @@
+"""
+Async versions of the I/O-bound endpoints (upload, chat, escalate), and the
+server-sent event stream (api/events.py), which is async only.
+
+They spend most of their time waiting on the model service and Gemini, so
+under ASGI (uvicorn multimodal_project.asgi:application) one worker can keep
+hundreds of them in flight. DRF's @api_view is sync-only, so these are plain
+Django async views: JWT authentication, request parsing and responses mirror
+the DRF views in views.py.
+"""
+import asyncio
+import json
+import logging
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import events
+from .authentication import ROLE_CLAIM, CachedJWTAuthentication, StatelessJWTAuthentication, role_of
+from .chat import ChatReply, aforget_conversation, wants_stream
+from .dedupe import ImageHashes, duplicate_report, open_escalations, reused_prediction
+from .gemini_api import get_gemini_response_async
+from .models import Escalation, ImageUpload
+from .serializers import ImageUploadSerializer
+from .timeline import record_features
+
+logger = logging.getLogger(__name__)
+
+# One pooled client per event loop; under WSGI each request gets a fresh loop.
+_clients = weakref.WeakKeyDictionary()
+
+
+def model_api_client():
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            base_url=settings.MODEL_API_URL,
+            timeout=60,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=50),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def authenticate(request):
+    """Return the JWT user for ``request``, or None."""
+    try:
+        result = await sync_to_async(CachedJWTAuthentication().authenticate)(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def token_user(request):
+    """The TokenUser for ``request``'s access token, or None. Needs no
+    query, so no thread either."""
+    try:
+        result = StatelessJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+def raw_token_user(raw_token):
+    """The TokenUser for a raw access token, or None. EventSource cannot
+    send headers, so /api/events/ also takes the token as ?token=."""
+    auth = StatelessJWTAuthentication()
+    try:
+        return auth.get_user(auth.get_validated_token(raw_token))
+    except AuthenticationFailed:
+        return None
+
+
+def unauthorized():
+    return JsonResponse({"detail": "Authentication credentials were not provided or are invalid."}, status=401)
+
+
+def method_not_allowed(request):
+    return JsonResponse({"detail": f'Method "{request.method}" not allowed.'}, status=405)
+
+
+def request_data(request):
+    """Form fields or a JSON body, like DRF's request.data."""
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except ValueError:
+            return {}
+    return request.POST
+
+
+@csrf_exempt
+async def upload_image(request):
+    if request.method != "POST":
+        return method_not_allowed(request)
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+
+    try:
+        logger.info(f"Upload request from user: {user.username}")
+
+        data = {**request.POST.dict(), **request.FILES.dict()}
+        serializer = ImageUploadSerializer(data=data, context={'request': request})
+        if not serializer.is_valid():
+            logger.error(f"Validation errors: {serializer.errors}")
+            return JsonResponse(serializer.errors, status=400)
+
+        upload = request.FILES["image"]
+        image_bytes = upload.read()
+        upload.seek(0)
+
+        # Hash before saving so a duplicate is linked on insert.
+        hashes = ImageHashes.from_bytes(image_bytes)
+        duplicate, duplicates = await sync_to_async(duplicate_report)(user, hashes, ImageUpload.objects.all())
+
+        # Save uploaded image
+        instance = await sync_to_async(serializer.save)(
+            user=user, duplicate_of_id=duplicates["duplicate_of"], **hashes.fields()
+        )
+        logger.info(f"Upload successful: {instance.image.name}")
+
+        # Parse metadata
+        metadata_raw = request.POST.get("metadata")
+        try:
+            metadata = json.loads(metadata_raw) if metadata_raw else {}
+        except Exception:
+            logger.warning("Invalid metadata format; using empty dict.")
+            metadata = {}
+
+        # The user's own byte-identical upload already has a prediction.
+        response_data = None
+        if duplicate and duplicate.exact and duplicate.user_id == user.id:
+            response_data = reused_prediction(await ImageUpload.objects.aget(id=duplicate.upload_id), metadata)
+
+        # Send image + metadata to model API
+        if response_data is None:
+            try:
+                response = await model_api_client().post(
+                    "/predict",
+                    files={"image": (upload.name, image_bytes, upload.content_type)},
+                    data={"metadata": json.dumps(metadata), "case_id": instance.id, "features": "true"},
+                )
+                response_data = response.json() if response.status_code == 200 else {"error": response.text}
+            except Exception as e:
+                logger.error(f"Prediction API call failed: {e}")
+                response_data = {"error": f"Prediction API call failed: {str(e)}"}
+
+        instance.metadata = metadata
+        update_fields = ["metadata"]
+        if response_data.get("success"):
+            instance.logit = response_data.get("logit")
+            instance.probability = response_data.get("probability")
+            instance.prediction = response_data.get("prediction")
+            instance.confidence_level = response_data.get("confidence_level")
+            instance.model_version = response_data.get("model_version")
+            update_fields += ["logit", "probability", "prediction", "confidence_level", "model_version"]
+        await instance.asave(update_fields=update_fields)
+        if response_data.get("success"):
+            events.publish_prediction(instance)
+            try:
+                await sync_to_async(record_features)(instance, metadata, response_data)
+            except Exception as e:
+                logger.error(f"Lesion feature tracking failed: {e}")
+
+        # Try to get simplified explanation via Gemini
+        xai_response = ""
+        try:
+            prompt = (
+                f"Explain this in very simple terms for a layperson in just one line and dont address as computer or system just start with 'The Results indicate that': {response_data}"
+            )
+            if settings.GEMINI_EXPLANATIONS:
+                xai_response = await get_gemini_response_async(prompt)
+        except Exception as e:
+            logger.error(f"Gemini explanation failed: {e}")
+            xai_response = ""
+
+        return JsonResponse({
+            "message": "Image uploaded successfully",
+            "image": serializer.data,
+            "metadata": metadata,
+            "prediction": response_data,
+            "duplicates": duplicates,
+            "xai": xai_response or ""
+        }, status=201)
+
+    except Exception as e:
+        logger.error(f"Upload exception: {str(e)}")
+        return JsonResponse({
+            "error": "Upload failed",
+            "detail": str(e)
+        }, status=500)
+
+
+@csrf_exempt
+async def chat(request):
+    if request.method not in ("POST", "DELETE"):
+        return method_not_allowed(request)
+    # Anonymous chat is allowed; it just has no memory.
+    user = token_user(request)
+    user_id = user.id if user else None
+    if request.method == "DELETE":
+        await aforget_conversation(user_id)
+        return HttpResponse(status=204)
+
+    message = str(request_data(request).get("message", "")).strip()
+    if not message:
+        return JsonResponse({"error": "message is required"}, status=400)
+    reply = await ChatReply.astart(user_id, message)
+    if wants_stream(request):
+        return events.sse_response(reply.asse())
+    return JsonResponse({"message": await reply.atext()})
+
+
+@csrf_exempt
+async def escalate_image(request):
+    if request.method != "POST":
+        return method_not_allowed(request)
+    user = await authenticate(request)
+    if user is None:
+        return unauthorized()
+
+    data = request_data(request)
+    image_id = data.get("image_id")
+    reason = data.get("reason")
+
+    try:
+        image = await ImageUpload.objects.aget(id=image_id, user=user)
+    except (ImageUpload.DoesNotExist, ValueError):
+        return JsonResponse({"error": "Image not found or unauthorized."}, status=404)
+
+    if not reason:
+        try:
+            metadata = json.loads(image.metadata)
+            reason = metadata.get("notes", "No notes provided")
+        except Exception:
+            reason = "No notes provided"
+
+    existing = await open_escalations(user, image).afirst()
+    if existing is not None:
+        return JsonResponse({
+            "message": "This image is already escalated.",
+            "id": existing.id,
+            "reason": existing.reason,
+        }, status=200)
+
+    escalation = await Escalation.objects.acreate(
+        patient=user,
+        image=image,
+        reason=reason,
+        status="pending"
+    )
+
+    return JsonResponse({
+        "message": "Escalation created successfully.",
+        "id": escalation.id,
+        "reason": escalation.reason,
+    }, status=201)
+
+
+@csrf_exempt
+async def event_stream(request):
+    """
+    Server-sent events for the current user: ``prediction`` when an upload
+    is scored, ``escalation`` when one of their escalations is created or
+    changes status (doctors receive these for every patient).
+    """
+    if request.method != "GET":
+        return method_not_allowed(request)
+    user = token_user(request)
+    if user is None and request.GET.get("token"):
+        user = raw_token_user(request.GET["token"])
+    if user is None:
+        return unauthorized()
+
+    role = user.token.get(ROLE_CLAIM) or await sync_to_async(role_of)(user)
+    channels = [events.user_channel(user.id)]
+    if role == 'doctor':
+        channels.append(events.DOCTORS_CHANNEL)
+
+    try:
+        last_event_id = int(request.headers.get("Last-Event-ID") or request.GET.get("last_event_id") or 0) or None
+    except ValueError:
+        last_event_id = None
+
+    events.start_relay()
+    try:
+        subscription, replay = events.broker.subscribe(user.id, channels, last_event_id)
+    except events.TooManyConnections as e:
+        response = JsonResponse({"error": str(e)}, status=e.status)
+        response["Retry-After"] = str(settings.EVENT_RETRY_MS // 1000)
+        return response
+
+    return events.sse_response(events.stream(subscription, replay))
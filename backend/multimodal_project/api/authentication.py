@@ -0,0 +1,143 @@
+"""
+Token authentication without a query per request.
+
+An access token already says who the user is and, through the ``role``
+claim CustomTokenObtainPairSerializer adds, whether they are a doctor, so:
+
+- CachedJWTAuthentication (the DRF default) rebuilds the User, with a
+  Profile holding its role, from an entry in the "auth" cache; a miss
+  loads both in one query. The entry keeps only what authentication and
+  permission checks read (id, username, is_active, is_staff, role and the
+  token-revocation digest of the password hash, never the hash itself),
+  since AUTH_CACHE_BACKEND may be a shared cache. The rebuilt User has no
+  other fields and must not be saved; views that show or change the
+  account load it. Saving or deleting a User or Profile drops the entry
+  (models.py); in other worker processes a stale copy lives at most
+  AUTH_CACHE_TTL seconds, unless the cache is shared.
+- StatelessJWTAuthentication, for public reads (posts, chat) that only
+  need the user's id, builds a TokenUser from the token and touches
+  neither the cache nor the database. A deactivated user keeps access
+  there until their access token expires, so endpoints that expose
+  patient data keep CachedJWTAuthentication.
+- is_doctor() reads the role from the (cached) profile, so a demotion
+  applies like a deactivation. For a TokenUser it trusts the role claim,
+  falling back to the profile for tokens issued before the claim existed;
+  a role change reaches the claim at the next login or token refresh.
+- ProfileModelBackend loads the profile with the user at login, so the
+  role claim costs no extra query.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+ROLE_CLAIM = "role"
+
+
+def user_key(user_id):
+    return f"user-entry:{user_id}"
+
+
+def user_entry(user_id):
+    """The cached fields of the User with ``user_id``, or None."""
+    cache = caches["auth"]
+    entry = cache.get(user_key(user_id))
+    if entry is None:
+        user = User.objects.select_related("profile").filter(pk=user_id).first()
+        if user is None:
+            return None
+        profile = getattr(user, "profile", None)
+        entry = {
+            "id": user.pk,
+            "username": user.username,
+            "is_active": user.is_active,
+            "is_staff": user.is_staff,
+            "role": getattr(profile, "role", None),
+            "password_digest": get_md5_hash_password(user.password),
+        }
+        cache.set(user_key(user_id), entry, settings.AUTH_CACHE_TTL)
+    return entry
+
+
+def user_from_entry(entry):
+    user = User(id=entry["id"], username=entry["username"], is_active=entry["is_active"], is_staff=entry["is_staff"])
+    user._state.adding = False
+    user.profile = apps.get_model("api", "Profile")(role=entry["role"])
+    return user
+
+
+def cached_user(user_id):
+    """The User with ``user_id`` and its profile's role, or None."""
+    entry = user_entry(user_id)
+    return user_from_entry(entry) if entry is not None else None
+
+
+def forget_user(user_id):
+    caches["auth"].delete(user_key(user_id))
+
+
+def role_of(user, token=None):
+    """The role on ``user``'s profile; for a TokenUser, the ``role`` claim
+    of ``token`` if it has one."""
+    if isinstance(user, TokenUser):
+        if token is not None and token.get(ROLE_CLAIM):
+            return token[ROLE_CLAIM]
+        user = cached_user(user.id)
+    profile = getattr(user, "profile", None)
+    return getattr(profile, "role", None)
+
+
+def is_doctor(request):
+    return role_of(request.user, request.auth) == 'doctor'
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        entry = user_entry(user_id)
+        if entry is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not entry["is_active"]:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if api_settings.CHECK_REVOKE_TOKEN and (
+            validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != entry["password_digest"]
+        ):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return user_from_entry(entry)
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """request.user is a TokenUser: ``id``, ``username`` and the token's
+    claims, no model instance. Filter on ``user_id=request.user.id``."""
+
+
+class ProfileModelBackend(ModelBackend):
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.select_related("profile").get(**{User.USERNAME_FIELD: username})
+        except User.DoesNotExist:
+            # Same timing for unknown users as ModelBackend (#20760).
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def get_user(self, user_id):
+        user = User._default_manager.select_related("profile").filter(pk=user_id).first()
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,246 @@
+"""
+The /api/chat/ conversation: per-user memory, streamed replies and an
+answer cache.
+
+Each signed-in user's recent turns live in the "chat" cache (bounded and
+evicting; CHAT_HISTORY_TTL after the last message). A conversation keeps
+at most CHAT_HISTORY_TURNS turns and CHAT_HISTORY_CHARS characters; older
+turns are folded into a short summary of what the user asked about, so
+the prompt stays bounded however long the conversation runs.
+
+The first question of a conversation has no context, so its answer is
+cached by normalized text for CHAT_ANSWER_TTL and frequent questions
+("what is melanoma?") skip the model entirely.
+
+With ``Accept: text/event-stream`` (or ``?stream=1``) the reply is sent as
+server-sent ``delta`` events as the model produces it, then ``done``.
+CHAT_BACKEND=fake swaps Gemini for a local deterministic stand-in.
+"""
+import asyncio
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.renderers import BaseRenderer
+
+from .events import sse_frame
+from .gemini_api import stream_gemini_chat, stream_gemini_chat_async
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are a chatbot. you dont show the user that you are a chatbot. Try to keep the convo crisp and minmized. If unrelated to medicine, respond generically. Else, give a medical response."
+
+
+class GeminiChatBackend:
+    name = "gemini"
+
+    def stream(self, history, message):
+        return stream_gemini_chat(history, message, SYSTEM_PROMPT, settings.CHAT_MAX_OUTPUT_TOKENS)
+
+    def astream(self, history, message):
+        return stream_gemini_chat_async(history, message, SYSTEM_PROMPT, settings.CHAT_MAX_OUTPUT_TOKENS)
+
+
+class FakeChatBackend:
+    """Echoes the message back word by word, CHAT_FAKE_DELAY seconds apart,
+    for local development and load tests without Gemini."""
+    name = "fake"
+
+    def words(self, history, message):
+        reply = f"You asked: {message.strip()} (after {len(history) // 2} earlier turns)."
+        return [word + " " for word in reply.split()]
+
+    def stream(self, history, message):
+        for word in self.words(history, message):
+            time.sleep(settings.CHAT_FAKE_DELAY)
+            yield word
+
+    async def astream(self, history, message):
+        for word in self.words(history, message):
+            await asyncio.sleep(settings.CHAT_FAKE_DELAY)
+            yield word
+
+
+BACKENDS = {"gemini": GeminiChatBackend, "fake": FakeChatBackend}
+
+
+def chat_backend():
+    try:
+        return BACKENDS[settings.CHAT_BACKEND]()
+    except KeyError:
+        raise ImproperlyConfigured(f"Unknown CHAT_BACKEND {settings.CHAT_BACKEND!r}; use one of {sorted(BACKENDS)}")
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets the DRF chat view accept ``Accept: text/event-stream``. Replies
+    are streamed past the renderer; it only formats error responses."""
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return sse_frame("error", data)
+
+
+def wants_stream(request):
+    return "text/event-stream" in request.headers.get("Accept", "") or request.GET.get("stream") in ("1", "true")
+
+
+def history_key(user_id):
+    return f"chat:history:{user_id}"
+
+
+def normalize_question(message):
+    return " ".join(message.lower().split()).rstrip("?!. ")
+
+
+def topic(question):
+    """A few words standing in for a turn dropped from the history."""
+    words = " ".join(question.split())
+    return words if len(words) <= 80 else words[:77] + "..."
+
+
+def empty_conversation():
+    return {"summary": "", "turns": []}
+
+
+def trimmed(conversation):
+    """Fold the oldest turns into the summary until the limits hold."""
+    summary, turns = conversation["summary"], list(conversation["turns"])
+
+    def size():
+        return sum(len(question) + len(answer) for question, answer in turns)
+
+    while len(turns) > settings.CHAT_HISTORY_TURNS or (len(turns) > 1 and size() > settings.CHAT_HISTORY_CHARS):
+        question, _ = turns.pop(0)
+        summary = f"{summary}; {topic(question)}" if summary else topic(question)
+    if len(summary) > settings.CHAT_SUMMARY_CHARS:
+        summary = "..." + summary[-settings.CHAT_SUMMARY_CHARS:]
+    return {"summary": summary, "turns": turns}
+
+
+class ChatReply:
+    """One answer to ``message``. Build it with ``start``/``astart``, then
+    consume ``chunks``/``achunks`` (or the sse/text helpers); the turn is
+    remembered and the answer cached only once it has been produced in
+    full, so a client that disconnects mid-reply leaves no half answer."""
+
+    def __init__(self, user_id, message, conversation):
+        self.user_id = user_id
+        self.message = message
+        self.conversation = conversation
+        self.backend = chat_backend()
+        fresh = not conversation["turns"] and not conversation["summary"]
+        self.answer_key = None
+        if fresh:
+            digest = hashlib.sha256(f"{self.backend.name}\0{normalize_question(message)}".encode()).hexdigest()
+            self.answer_key = f"chat:answer:{digest}"
+        self.cached = None
+
+    @classmethod
+    def start(cls, user_id, message):
+        cache = caches["chat"]
+        conversation = cache.get(history_key(user_id)) if user_id else None
+        reply = cls(user_id, message, conversation or empty_conversation())
+        if reply.answer_key:
+            reply.cached = cache.get(reply.answer_key)
+        return reply
+
+    @classmethod
+    async def astart(cls, user_id, message):
+        cache = caches["chat"]
+        conversation = await cache.aget(history_key(user_id)) if user_id else None
+        reply = cls(user_id, message, conversation or empty_conversation())
+        if reply.answer_key:
+            reply.cached = await cache.aget(reply.answer_key)
+        return reply
+
+    def prompt(self):
+        history = []
+        for question, answer in self.conversation["turns"]:
+            history.append({"role": "user", "parts": [question]})
+            history.append({"role": "model", "parts": [answer]})
+        message = self.message
+        if self.conversation["summary"]:
+            message = f"(Earlier in this conversation the user asked about: {self.conversation['summary']})\n\n{message}"
+        return history, message
+
+    def updates(self, answer):
+        """Cache writes for a finished answer, as (key, value, timeout)."""
+        writes = []
+        if self.user_id:
+            turns = self.conversation["turns"] + [[self.message, answer[:settings.CHAT_ANSWER_MEMORY_CHARS]]]
+            conversation = trimmed({"summary": self.conversation["summary"], "turns": turns})
+            writes.append((history_key(self.user_id), conversation, settings.CHAT_HISTORY_TTL))
+        if self.answer_key and self.cached is None:
+            writes.append((self.answer_key, answer, settings.CHAT_ANSWER_TTL))
+        return writes
+
+    def chunks(self):
+        if self.cached is not None:
+            answer = self.cached
+            yield answer
+        else:
+            parts = []
+            for text in self.backend.stream(*self.prompt()):
+                if text:
+                    parts.append(text)
+                    yield text
+            answer = "".join(parts)
+        if answer:
+            for key, value, timeout in self.updates(answer):
+                caches["chat"].set(key, value, timeout)
+
+    async def achunks(self):
+        if self.cached is not None:
+            answer = self.cached
+            yield answer
+        else:
+            parts = []
+            async for text in self.backend.astream(*self.prompt()):
+                if text:
+                    parts.append(text)
+                    yield text
+            answer = "".join(parts)
+        if answer:
+            for key, value, timeout in self.updates(answer):
+                await caches["chat"].aset(key, value, timeout)
+
+    def text(self):
+        return "".join(self.chunks())
+
+    async def atext(self):
+        return "".join([text async for text in self.achunks()])
+
+    def sse(self):
+        try:
+            for text in self.chunks():
+                yield sse_frame("delta", {"text": text})
+        except Exception as e:
+            logger.error(f"Chat stream failed: {e}")
+            yield sse_frame("error", {"error": "Chat failed"})
+            return
+        yield sse_frame("done", {"cached": self.cached is not None})
+
+    async def asse(self):
+        try:
+            async for text in self.achunks():
+                yield sse_frame("delta", {"text": text})
+        except Exception as e:
+            logger.error(f"Chat stream failed: {e}")
+            yield sse_frame("error", {"error": "Chat failed"})
+            return
+        yield sse_frame("done", {"cached": self.cached is not None})
+
+
+def forget_conversation(user_id):
+    if user_id:
+        caches["chat"].delete(history_key(user_id))
+
+
+async def aforget_conversation(user_id):
+    if user_id:
+        await caches["chat"].adelete(history_key(user_id))
@@ -0,0 +1,283 @@
+"""
+Resumable chunked image upload.
+
+    POST /api/uploads/                       {filename, size, sha256, metadata}
+    PUT  /api/uploads/<id>/chunk/?offset=N   raw bytes (Content-Type: application/octet-stream)
+    GET  /api/uploads/<id>/                  current offset, to resume after a dropped connection
+    POST /api/uploads/<id>/finalize/         verify sha256, create the ImageUpload, queue prediction
+                                             (skipped for a re-upload of an image already scored)
+                                             409 for a retry while another finalize is running
+
+Chunks are streamed from the request to ``uploads/<username>/.<id>.part`` in
+CHUNKED_UPLOAD_READ_SIZE pieces, so memory per upload stays constant
+whatever the file size, and a client that loses its connection resumes
+from the last acknowledged offset instead of re-sending the whole image.
+Prediction runs on a small worker pool after finalize; the client gets a
+``prediction`` event on /api/events/ (or polls the session until
+``image.prediction`` is filled in).
+"""
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from . import events
+from .dedupe import ImageHashes, duplicate_report, reused_prediction
+from .models import ImageUpload, UploadSession, sharded_image_path
+from .serializers import ImageUploadSerializer
+from .storage import move_into
+from .timeline import record_features
+
+logger = logging.getLogger(__name__)
+
+_prediction_pool = ThreadPoolExecutor(max_workers=settings.PREDICTION_WORKERS, thread_name_prefix="predict")
+
+
+def session_data(session, request):
+    data = {
+        "id": str(session.id),
+        "filename": session.filename,
+        "size": session.size,
+        "offset": session.received,
+        "status": session.status,
+        "chunk_size": settings.CHUNKED_UPLOAD_CHUNK_SIZE,
+    }
+    if session.upload_id:
+        data["image"] = ImageUploadSerializer(session.upload, context={'request': request}).data
+    return data
+
+
+def get_session(request, session_id):
+    try:
+        return UploadSession.objects.select_related('user', 'upload').get(id=session_id, user=request.user)
+    except UploadSession.DoesNotExist:
+        return None
+
+
+def not_found():
+    return Response({"error": "Upload not found or unauthorized."}, status=404)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(settings.CHUNKED_UPLOAD_READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def run_prediction(upload_id, metadata):
+    """Send a finished upload to the model API and store the result."""
+    close_old_connections()
+    try:
+        upload = ImageUpload.objects.get(id=upload_id)
+        with upload.image.open("rb") as f:
+            response = requests.post(
+                f"{settings.MODEL_API_URL}/predict",
+                files={"image": f},
+                data={"metadata": json.dumps(metadata), "case_id": upload.id, "features": "true"},
+                timeout=60
+            )
+        response_data = response.json() if response.status_code == 200 else {"error": response.text}
+        if not response_data.get("success"):
+            logger.error(f"Prediction failed for upload {upload_id}: {response_data}")
+            events.publish_prediction(upload, error="Prediction failed")
+            return
+        upload.logit = response_data.get("logit")
+        upload.probability = response_data.get("probability")
+        upload.prediction = response_data.get("prediction")
+        upload.confidence_level = response_data.get("confidence_level")
+        upload.model_version = response_data.get("model_version")
+        upload.save(update_fields=["logit", "probability", "prediction", "confidence_level", "model_version"])
+        events.publish_prediction(upload)
+        record_features(upload, metadata, response_data)
+    except Exception as e:
+        logger.error(f"Prediction API call failed for upload {upload_id}: {e}")
+    finally:
+        close_old_connections()
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def init_upload(request):
+    filename = os.path.basename(str(request.data.get("filename", "")))
+    sha256 = str(request.data.get("sha256", "")).lower()
+    try:
+        size = int(request.data.get("size"))
+    except (TypeError, ValueError):
+        return Response({"error": "size must be an integer"}, status=400)
+
+    if not filename or "." not in filename:
+        return Response({"error": "filename with an extension is required"}, status=400)
+    if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+        return Response({"error": "sha256 must be a hex digest"}, status=400)
+    if not 0 < size <= settings.CHUNKED_UPLOAD_MAX_SIZE:
+        return Response({"error": f"size must be between 1 and {settings.CHUNKED_UPLOAD_MAX_SIZE} bytes"},
+                        status=400)
+
+    metadata = request.data.get("metadata") or {}
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            metadata = {"notes": metadata}
+
+    session = UploadSession.objects.create(
+        user=request.user, filename=filename, size=size, sha256=sha256, metadata=json.dumps(metadata)
+    )
+    path = os.path.join(settings.MEDIA_ROOT, session.partial_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, "wb").close()
+    return Response(session_data(session, request), status=201)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def upload_status(request, session_id):
+    session = get_session(request, session_id)
+    if session is None:
+        return not_found()
+    return Response(session_data(session, request))
+
+
+@api_view(['PUT'])
+@permission_classes([IsAuthenticated])
+def upload_chunk(request, session_id):
+    session = get_session(request, session_id)
+    if session is None:
+        return not_found()
+    if session.status != 'open':
+        return Response({"error": "Upload already finalized."}, status=409)
+
+    try:
+        offset = int(request.query_params.get("offset", request.headers.get("Upload-Offset", "")))
+    except ValueError:
+        return Response({"error": "offset is required"}, status=400)
+    # Only the next byte range is accepted; anything else means the client
+    # lost track, and it resumes from the offset we report.
+    if offset != session.received:
+        return Response({"error": "Offset mismatch.", "offset": session.received}, status=409)
+
+    length = int(request.META.get("CONTENT_LENGTH") or 0)
+    if length <= 0:
+        return Response({"error": "Empty chunk."}, status=400)
+    if offset + length > session.size:
+        return Response({"error": "Chunk exceeds the declared size.", "offset": session.received}, status=400)
+
+    path = os.path.join(settings.MEDIA_ROOT, session.partial_path)
+    stream = request.stream
+    written = 0
+    with open(path, "r+b") as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(settings.CHUNKED_UPLOAD_READ_SIZE, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+        # Drop bytes past the acknowledged offset left by an earlier,
+        # interrupted attempt at this chunk.
+        f.truncate(offset + written)
+
+    # A concurrent PUT for the same offset loses here and gets a 409.
+    updated = UploadSession.objects.filter(id=session.id, received=offset).update(received=offset + written)
+    if not updated:
+        session.refresh_from_db(fields=["received"])
+        return Response({"error": "Offset mismatch.", "offset": session.received}, status=409)
+    if written < length:
+        return Response({"error": "Connection closed mid-chunk.", "offset": offset + written}, status=400)
+    return Response({"offset": offset + written, "size": session.size})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload(request, session_id):
+    session = get_session(request, session_id)
+    if session is None:
+        return not_found()
+    if session.status == 'complete':
+        return Response(session_data(session, request))
+    if session.received != session.size:
+        return Response({"error": "Upload incomplete.", "offset": session.received}, status=409)
+
+    # Claim the session, so a client retrying while the first call is
+    # still running does not read a partial file that is being moved.
+    claimed = UploadSession.objects.filter(id=session.id, status='open', received=session.size).update(
+        status='finalizing', updated_at=timezone.now()
+    )
+    if not claimed:
+        session.refresh_from_db(fields=["status", "received", "upload"])
+        if session.status == 'complete':
+            return Response(session_data(session, request))
+        if session.status == 'failed':
+            return Response({"error": "Upload is not a valid image.", "status": session.status}, status=400)
+        return Response({"error": "Upload is already being finalized.", "status": session.status}, status=409)
+
+    try:
+        return finalize_claimed(request, session)
+    except Exception:
+        # Reopen the session, so the client can finalize again.
+        UploadSession.objects.filter(id=session.id, status='finalizing').update(status='open')
+        raise
+
+
+def finalize_claimed(request, session):
+    partial = os.path.join(settings.MEDIA_ROOT, session.partial_path)
+    if file_sha256(partial) != session.sha256:
+        # Start over rather than keep bytes we cannot trust.
+        open(partial, "wb").close()
+        UploadSession.objects.filter(id=session.id).update(received=0, status='open', updated_at=timezone.now())
+        return Response({"error": "Checksum mismatch; upload restarted.", "offset": 0}, status=422)
+
+    try:
+        with Image.open(partial) as image:
+            image.verify()
+    except Exception:
+        # The bytes are what the client meant to send, so a retry cannot help.
+        os.remove(partial)
+        UploadSession.objects.filter(id=session.id).update(status='failed', updated_at=timezone.now())
+        return Response({"error": "Upload is not a valid image."}, status=400)
+
+    hashes = ImageHashes.from_path(partial, session.sha256)
+    duplicate, duplicates = duplicate_report(request.user, hashes, ImageUpload.objects.all())
+
+    with transaction.atomic():
+        upload = ImageUpload(user=request.user, metadata=session.metadata,
+                             duplicate_of_id=duplicates["duplicate_of"], **hashes.fields())
+        # Row first: if the insert fails the partial file is still in place.
+        name = sharded_image_path(upload, session.filename)
+        upload.image.name = name
+        upload.save()
+        stored = move_into(default_storage, partial, name)
+        if stored != name:
+            upload.image.name = name = stored
+            upload.save(update_fields=["image"])
+        session.upload = upload
+        session.status = 'complete'
+        session.save(update_fields=["upload", "status", "updated_at"])
+    logger.info(f"Chunked upload complete: {name}")
+
+    metadata = json.loads(session.metadata or "{}")
+    reused = None
+    if duplicate and duplicate.exact and duplicate.user_id == request.user.id:
+        reused = reused_prediction(ImageUpload.objects.get(id=duplicate.upload_id), metadata)
+    if reused is not None:
+        for field in ("logit", "probability", "prediction", "confidence_level", "model_version"):
+            setattr(upload, field, reused[field])
+        upload.save(update_fields=["logit", "probability", "prediction", "confidence_level", "model_version"])
+        events.publish_prediction(upload)
+        record_features(upload, metadata, reused)
+    else:
+        transaction.on_commit(lambda: _prediction_pool.submit(run_prediction, upload.id, metadata))
+    return Response({**session_data(session, request), "duplicates": duplicates}, status=201)
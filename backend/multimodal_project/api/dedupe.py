@@ -0,0 +1,201 @@
+"""
+Duplicate and near-duplicate detection for uploaded images.
+
+Every ImageUpload stores the SHA-256 of its bytes (exact duplicates) and a
+64-bit DCT perceptual hash (near duplicates: re-encoded, resized or
+lightly cropped copies of the same photo). Near-duplicate lookup uses
+multi-index hashing: the hash is split into four indexed 16-bit bands, and
+two hashes within Hamming distance r share at least one band within
+distance r // 4 of each other (pigeonhole). A query therefore probes each
+band index for a handful of values and ranks the few candidates by full
+Hamming distance, instead of scanning every upload.
+"""
+import ast
+import hashlib
+import io
+import json
+from dataclasses import dataclass
+from itertools import combinations
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from PIL import Image
+
+from .models import Escalation
+
+HASH_BITS = 64
+BANDS = 4
+BAND_BITS = HASH_BITS // BANDS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def perceptual_hash(image):
+    """64-bit pHash of a PIL image: sign of the low-frequency 8x8 DCT
+    coefficients of a 32x32 grayscale thumbnail relative to their median."""
+    # Lets the JPEG decoder downscale while decoding, which is most of the cost.
+    image.draft("L", (64, 64))
+    pixels = np.asarray(image.convert("L").resize((32, 32), Image.BILINEAR), dtype=np.float64)
+    low = (_DCT32 @ pixels @ _DCT32.T)[:8, :8].ravel()
+    # The DC term only encodes mean brightness.
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+@dataclass(frozen=True)
+class ImageHashes:
+    sha256: str
+    phash: int  # unsigned 64-bit
+
+    @classmethod
+    def from_bytes(cls, data):
+        with Image.open(io.BytesIO(data)) as image:
+            phash = perceptual_hash(image)
+        return cls(hashlib.sha256(data).hexdigest(), phash)
+
+    @classmethod
+    def from_path(cls, path, sha256):
+        """For a file already on disk whose digest is known, without reading
+        it into memory."""
+        with Image.open(path) as image:
+            return cls(sha256, perceptual_hash(image))
+
+    @classmethod
+    def from_file(cls, f):
+        f.seek(0)
+        data = f.read()
+        f.seek(0)
+        return cls.from_bytes(data)
+
+    def fields(self):
+        """Model field values; SQLite and PostgreSQL integers are signed."""
+        signed = self.phash - (1 << HASH_BITS) if self.phash >= 1 << (HASH_BITS - 1) else self.phash
+        values = {"content_sha256": self.sha256, "phash": signed}
+        for band, value in enumerate(bands(self.phash)):
+            values[f"phash_band{band}"] = value
+        return values
+
+
+def bands(phash):
+    return [(phash >> (BAND_BITS * band)) & BAND_MASK for band in range(BANDS)]
+
+
+def hamming(a, b):
+    return ((a ^ b) & ((1 << HASH_BITS) - 1)).bit_count()
+
+
+def band_probes(value, radius):
+    """All band values within Hamming distance ``radius`` of ``value``."""
+    probes = [value]
+    for flips in range(1, radius + 1):
+        for positions in combinations(range(BAND_BITS), flips):
+            probe = value
+            for position in positions:
+                probe ^= 1 << position
+            probes.append(probe)
+    return probes
+
+
+def candidate_filter(phash, max_distance):
+    query = Q()
+    radius = max_distance // BANDS
+    for band, value in enumerate(bands(phash)):
+        query |= Q(**{f"phash_band{band}__in": band_probes(value, radius)})
+    return query
+
+
+@dataclass
+class Match:
+    upload_id: int
+    user_id: int
+    root_id: int  # the upload this one is itself a duplicate of, or itself
+    distance: int
+    exact: bool
+
+
+def find_duplicates(hashes, queryset, max_distance=None, limit=10):
+    """Uploads in ``queryset`` that duplicate ``hashes``, closest first.
+
+    ``exact`` means byte-identical; otherwise ``distance`` is the pHash
+    Hamming distance (0 for a re-encode of the same pixels)."""
+    if max_distance is None:
+        max_distance = settings.DUPLICATE_MAX_DISTANCE
+    rows = (
+        queryset.filter(Q(content_sha256=hashes.sha256) | candidate_filter(hashes.phash, max_distance))
+        .order_by()
+        .values_list("id", "user_id", "duplicate_of_id", "content_sha256", "phash")
+    )
+    matches = []
+    for upload_id, user_id, duplicate_of_id, sha256, phash in rows.iterator():
+        exact = sha256 == hashes.sha256
+        distance = 0 if exact else hamming(phash, hashes.phash)
+        if exact or distance <= max_distance:
+            matches.append(Match(upload_id, user_id, duplicate_of_id or upload_id, distance, exact))
+    matches.sort(key=lambda m: (not m.exact, m.distance, m.upload_id))
+    return matches[:limit]
+
+
+def duplicate_report(user, hashes, queryset):
+    """Return (best match, summary). Own uploads win over other users', and
+    ``duplicate_of`` should point at ``best.root_id`` so copies of one photo
+    share a single original."""
+    matches = find_duplicates(hashes, queryset)
+    own = [m for m in matches if m.user_id == user.id]
+    best = (own or matches or [None])[0]
+    return best, {
+        "duplicate_of": best.root_id if best else None,
+        "own": [{"id": m.upload_id, "distance": m.distance, "exact": m.exact} for m in own],
+        "other_users": sum(m.user_id != user.id for m in matches),
+    }
+
+
+def parse_metadata(raw):
+    # Older uploads stored the repr of the metadata dict rather than JSON.
+    if isinstance(raw, dict):
+        return raw
+    try:
+        return json.loads(raw or "{}")
+    except ValueError:
+        try:
+            return ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            return {}
+
+
+def reused_prediction(upload, metadata):
+    """The stored model API result of ``upload`` if it was scored with the
+    same metadata, so a byte-identical re-upload skips inference; else None."""
+    if upload.prediction is None or parse_metadata(upload.metadata) != metadata:
+        return None
+    return {
+        "success": True,
+        "prediction": upload.prediction,
+        "probability": upload.probability,
+        "logit": upload.logit,
+        "confidence_level": upload.confidence_level,
+        "model_version": upload.model_version,
+        "duplicate_of": upload.id,
+    }
+
+
+def open_escalations(patient, image):
+    """The patient's undiagnosed escalations of ``image`` or any copy of it,
+    so re-uploads of one lesion photo reach the doctor queue once."""
+    root = image.duplicate_of_id or image.id
+    return (
+        Escalation.objects.filter(patient=patient)
+        .filter(Q(image_id=root) | Q(image__duplicate_of_id=root))
+        .exclude(status__in=Escalation.LABELED_STATUSES)
+        .order_by('submitted_at')
+    )
@@ -0,0 +1,298 @@
+"""
+Push notifications to the frontend as server-sent events.
+
+    GET /api/events/   (Authorization header, or ?token=<access token> for EventSource)
+
+Views and background threads publish small JSON events to per-user channels
+(``user:<id>``) and to ``doctors``; every open /api/events/ stream
+subscribed to the channel receives them, so the frontend stops polling for
+chunked-upload predictions and escalation status changes made in the admin.
+
+Each stream has a bounded buffer. A client that reads too slowly loses the
+oldest events and receives an ``overflow`` event telling it to refetch,
+rather than growing server memory. Each channel also keeps its last few
+events, so a reconnecting EventSource (Last-Event-ID) picks up what it
+missed.
+
+EVENT_BROKER=local delivers within the process, which is enough for one
+ASGI worker. With several workers, EVENT_BROKER=redis relays every event
+through Redis pub/sub to all of them; delivery to the streams is still the
+local fan-out below.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict, deque
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+DOCTORS_CHANNEL = "doctors"
+REDIS_CHANNEL_PREFIX = "skin-cancer:events:"
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+def sse_frame(event_type, data, event_id=None):
+    frame = f"event: {event_type}\ndata: {json.dumps(data, default=str)}\n\n"
+    if event_id is not None:
+        frame = f"id: {event_id}\n{frame}"
+    return frame.encode()
+
+
+def sse_response(frames):
+    response = StreamingHttpResponse(frames, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Tells nginx not to buffer the stream.
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@dataclass(frozen=True)
+class Event:
+    id: int
+    channel: str
+    frame: bytes  # encoded once, written to every subscriber as is
+
+
+class TooManyConnections(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class Subscription:
+    """One open stream. Only touched from the event loop that opened it."""
+
+    def __init__(self, user_id, channels, loop):
+        self.user_id = user_id
+        self.channels = channels
+        self.loop = loop
+        self.buffer = deque()
+        self.dropped = 0
+        self.ready = asyncio.Event()
+
+    def push(self, event):
+        if len(self.buffer) >= settings.EVENT_BUFFER_SIZE:
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append(event)
+        self.ready.set()
+
+
+def _deliver(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.push(event)
+
+
+class EventBroker:
+    """In-process pub/sub. ``dispatch`` may be called from any thread; the
+    event is handed to each subscriber's event loop with one callback per
+    loop, however many subscribers that loop serves."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self._per_user = Counter()
+        self.connections = 0
+        self._history = OrderedDict()  # channel -> recent events, least recently used first
+        self._last_id = 0
+
+    def next_id(self):
+        # Time-based so ids from different workers (EVENT_BROKER=redis) still
+        # order the events of a channel.
+        with self._lock:
+            self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+            return self._last_id
+
+    def subscribe(self, user_id, channels, last_event_id=None):
+        """Register a stream; returns it with the buffered events newer than
+        ``last_event_id`` (none if not given)."""
+        subscription = Subscription(user_id, tuple(channels), asyncio.get_running_loop())
+        with self._lock:
+            if self.connections >= settings.EVENT_MAX_CONNECTIONS:
+                raise TooManyConnections("Too many open event streams on this worker.", 503)
+            if self._per_user[user_id] >= settings.EVENT_MAX_CONNECTIONS_PER_USER:
+                raise TooManyConnections("Too many open event streams for this user.", 429)
+            for channel in subscription.channels:
+                self._subscribers[channel].add(subscription)
+            self._per_user[user_id] += 1
+            self.connections += 1
+            replay = []
+            if last_event_id is not None:
+                for channel in subscription.channels:
+                    replay.extend(e for e in self._history.get(channel, ()) if e.id > last_event_id)
+                replay.sort(key=lambda e: e.id)
+        return subscription, replay
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._subscribers.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[channel]
+            self._per_user[subscription.user_id] -= 1
+            self.connections -= 1
+            if self._per_user[subscription.user_id] <= 0:
+                del self._per_user[subscription.user_id]
+
+    def dispatch(self, event):
+        with self._lock:
+            history = self._history.get(event.channel)
+            if history is None:
+                history = self._history[event.channel] = deque(maxlen=settings.EVENT_HISTORY_SIZE)
+                if len(self._history) > settings.EVENT_HISTORY_CHANNELS:
+                    self._history.popitem(last=False)
+            else:
+                self._history.move_to_end(event.channel)
+            history.append(event)
+            subscribers = list(self._subscribers.get(event.channel, ()))
+
+        by_loop = defaultdict(list)
+        for subscription in subscribers:
+            by_loop[subscription.loop].append(subscription)
+        for loop, group in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, group, event)
+            except RuntimeError:
+                # The loop has shut down; its streams are gone.
+                for subscription in group:
+                    self.unsubscribe(subscription)
+
+
+class RedisRelay:
+    """Relays events between workers: ``publish`` sends to Redis, and a
+    listener thread per worker dispatches everything received locally."""
+
+    def __init__(self, broker, url):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImproperlyConfigured("EVENT_BROKER=redis requires the redis package") from e
+        self.broker = broker
+        self.client = redis.Redis.from_url(url)
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def publish(self, event):
+        payload = json.dumps({"id": event.id, "channel": event.channel, "frame": event.frame.decode()})
+        self.client.publish(REDIS_CHANNEL_PREFIX + event.channel, payload)
+
+    def ensure_listening(self):
+        with self._start_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="events-redis", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(REDIS_CHANNEL_PREFIX + "*")
+                for message in pubsub.listen():
+                    data = json.loads(message["data"])
+                    self.broker.dispatch(Event(data["id"], data["channel"], data["frame"].encode()))
+            except Exception as e:
+                logger.error(f"Event relay lost its Redis connection: {e}")
+                time.sleep(1)
+
+
+broker = EventBroker()
+_relay = None
+
+
+def relay():
+    global _relay
+    if settings.EVENT_BROKER == "local":
+        return None
+    if settings.EVENT_BROKER != "redis":
+        raise ImproperlyConfigured(f"Unknown EVENT_BROKER {settings.EVENT_BROKER!r}; use 'local' or 'redis'")
+    if _relay is None:
+        _relay = RedisRelay(broker, settings.EVENT_REDIS_URL)
+    return _relay
+
+
+def start_relay():
+    """Called when a stream opens, so every worker serving streams listens."""
+    bridge = relay()
+    if bridge is not None:
+        bridge.ensure_listening()
+
+
+def publish(channel, event_type, data):
+    """Send an event to every stream subscribed to ``channel``. Never raises:
+    a lost notification must not fail the request that caused it."""
+    try:
+        event_id = broker.next_id()
+        event = Event(event_id, channel, sse_frame(event_type, data, event_id))
+        bridge = relay()
+        if bridge is None:
+            broker.dispatch(event)
+        else:
+            bridge.publish(event)
+    except Exception as e:
+        logger.error(f"Publishing {event_type} event to {channel} failed: {e}")
+
+
+def publish_prediction(upload, error=None):
+    data = {"image_id": upload.id}
+    if error:
+        data["error"] = error
+    else:
+        data.update({
+            "prediction": upload.prediction,
+            "probability": upload.probability,
+            "confidence_level": upload.confidence_level,
+            "model_version": upload.model_version,
+        })
+    publish(user_channel(upload.user_id), "prediction", data)
+
+
+def publish_escalation(escalation, created):
+    data = {
+        "id": escalation.id,
+        "image_id": escalation.image_id,
+        "patient_id": escalation.patient_id,
+        "status": escalation.status,
+        "created": created,
+    }
+    publish(user_channel(escalation.patient_id), "escalation", data)
+    publish(DOCTORS_CHANNEL, "escalation", data)
+
+
+async def stream(subscription, replay):
+    """The body of an /api/events/ response."""
+    try:
+        yield f"retry: {settings.EVENT_RETRY_MS}\n\n".encode()
+        yield sse_frame("ready", {"worker": os.getpid(), "connections": broker.connections})
+        if replay:
+            yield b"".join(event.frame for event in replay)
+        while True:
+            if not subscription.buffer:
+                subscription.ready.clear()
+                try:
+                    await asyncio.wait_for(subscription.ready.wait(), settings.EVENT_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection.
+                    yield b": ping\n\n"
+                    continue
+            chunk = []
+            if subscription.dropped:
+                chunk.append(sse_frame("overflow", {"dropped": subscription.dropped}))
+                subscription.dropped = 0
+            while subscription.buffer:
+                chunk.append(subscription.buffer.popleft().frame)
+            yield b"".join(chunk)
+    finally:
+        broker.unsubscribe(subscription)
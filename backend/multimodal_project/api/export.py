@@ -0,0 +1,332 @@
+"""
+Columnar exports of uploads and escalations for research and audit.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` (no model
+instances), converted into column batches and appended to one file per
+month partition, Hive style:
+
+    <out>/uploads/month=2025-03/part-0000.parquet
+    <out>/escalations/month=2025-03/part-0000.parquet
+
+Only one batch and one open file are held at a time, so memory does not
+grow with the table. Upload metadata is exploded into typed ``meta_*``
+columns following the model's metadata schema (ml/featurizer.py), with
+anything else kept as JSON in ``meta_extra``. Uploads also carry the
+status of their latest escalation, so labels can be read without a join.
+Usernames and phone numbers are not exported.
+
+Parquet needs pyarrow; without it, or with format "csv", partitions are
+gzipped CSV files with the same columns.
+"""
+import base64
+import csv
+import gzip
+import io
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.db.models import OuterRef, Subquery
+from PIL import Image
+
+from .dedupe import parse_metadata
+from .models import Escalation, ImageUpload
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = ("parquet", "csv")
+
+# ml/featurizer.py METADATA_SCHEMA; booleans are the app's 1/0/-1 answers.
+METADATA_COLUMNS = (
+    ("smoke", "bool"),
+    ("drink", "bool"),
+    ("background_father", "bool"),
+    ("background_mother", "bool"),
+    ("age", "float64"),
+    ("gender", "string"),
+    ("skin_cancer_history", "bool"),
+    ("cancer_history", "bool"),
+    ("region", "string"),
+    ("itch", "bool"),
+    ("grew", "bool"),
+    ("hurt", "bool"),
+    ("changed", "bool"),
+    ("bleed", "bool"),
+    ("elevation", "bool"),
+    ("biopsed", "bool"),
+    ("fitzpatrick", "float64"),
+    ("notes", "string"),
+)
+METADATA_KEYS = {name for name, _ in METADATA_COLUMNS}
+# 1, 1.0 and True are equal dict keys, so numbers and booleans hit too.
+BOOLEAN_VALUES = {1: True, 0: False, "1": True, "0": False, "true": True, "false": False, "yes": True, "no": False}
+
+UPLOAD_COLUMNS = [
+    ("id", "int64"),
+    ("user_id", "int64"),
+    ("uploaded_at", "timestamp"),
+    ("image_path", "string"),
+    ("prediction", "string"),
+    ("probability", "float64"),
+    ("logit", "float64"),
+    ("confidence_level", "string"),
+    ("model_version", "string"),
+    ("content_sha256", "string"),
+    ("duplicate_of_id", "int64"),
+    ("escalation_status", "string"),
+    ("labeled_at", "timestamp"),
+] + [(f"meta_{name}", kind) for name, kind in METADATA_COLUMNS] + [("meta_extra", "string")]
+
+ESCALATION_COLUMNS = [
+    ("id", "int64"),
+    ("patient_id", "int64"),
+    ("image_id", "int64"),
+    ("status", "string"),
+    ("reason", "string"),
+    ("submitted_at", "timestamp"),
+    ("labeled_at", "timestamp"),
+]
+
+
+def default_format():
+    return "parquet" if pa is not None else "csv"
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return BOOLEAN_VALUES.get(value.strip().lower())
+    if isinstance(value, (int, float)):
+        return BOOLEAN_VALUES.get(value)
+    return None
+
+
+def to_float(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    # -1 is the app's "unknown".
+    return None if number == -1 else number
+
+
+def to_string(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text if text.lower() not in ("", "-1", "unknown", "none", "nan") else None
+
+
+def to_category(value):
+    value = to_string(value)
+    return value.upper() if value is not None else None
+
+
+CONVERTERS = {"bool": to_bool, "float64": to_float, "string": to_string}
+METADATA_CONVERTERS = [
+    (name, to_category if name in ("gender", "region") else CONVERTERS[kind])
+    for name, kind in METADATA_COLUMNS
+]
+
+
+def metadata_values(raw):
+    metadata = parse_metadata(raw)
+    values = [convert(metadata.get(name)) for name, convert in METADATA_CONVERTERS]
+    extra = {key: value for key, value in metadata.items() if key not in METADATA_KEYS}
+    values.append(json.dumps(extra, default=str) if extra else None)
+    return values
+
+
+def thumbnail(f, size):
+    """JPEG bytes of a ``size``-pixel thumbnail, or None if unreadable."""
+    try:
+        with Image.open(f) as image:
+            image.draft("RGB", (size * 2, size * 2))
+            image = image.convert("RGB")
+            image.thumbnail((size, size))
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=80)
+            return buffer.getvalue()
+    except OSError:
+        return None
+
+
+def thumbnail_of(name, size):
+    if not name:
+        return None
+    try:
+        with default_storage.open(name, "rb") as f:
+            return thumbnail(f, size)
+    except FileNotFoundError:
+        return None
+
+
+class Table:
+    """How to read one exported table: the queryset, the value_list fields
+    and the conversion of a value tuple into an output row."""
+
+    def __init__(self, name, columns, queryset, fields, convert, month_index):
+        self.name = name
+        self.columns = columns
+        self.queryset = queryset
+        self.fields = fields
+        self.convert = convert
+        self.month_index = month_index
+
+
+def uploads_table(queryset=None):
+    latest_escalation = Escalation.objects.filter(image=OuterRef("pk")).order_by("-submitted_at")
+    queryset = (queryset if queryset is not None else ImageUpload.objects.all()).annotate(
+        escalation_status=Subquery(latest_escalation.values("status")[:1]),
+        escalation_labeled_at=Subquery(latest_escalation.values("labeled_at")[:1]),
+    )
+    fields = ("id", "user_id", "uploaded_at", "image", "prediction", "probability", "logit",
+              "confidence_level", "model_version", "content_sha256", "duplicate_of_id",
+              "escalation_status", "escalation_labeled_at", "metadata")
+
+    def convert(values):
+        return list(values[:-1]) + metadata_values(values[-1])
+
+    return Table("uploads", UPLOAD_COLUMNS, queryset, fields, convert, fields.index("uploaded_at"))
+
+
+def escalations_table(queryset=None):
+    queryset = queryset if queryset is not None else Escalation.objects.all()
+    fields = ("id", "patient_id", "image_id", "status", "reason", "submitted_at", "labeled_at")
+    return Table("escalations", ESCALATION_COLUMNS, queryset, fields, list, fields.index("submitted_at"))
+
+
+TABLES = {"uploads": uploads_table, "escalations": escalations_table}
+
+
+class ParquetFile:
+    TYPES = {
+        "int64": lambda: pa.int64(),
+        "float64": lambda: pa.float64(),
+        "string": lambda: pa.string(),
+        "bool": lambda: pa.bool_(),
+        "timestamp": lambda: pa.timestamp("us", tz="UTC"),
+        "binary": lambda: pa.binary(),
+    }
+    extension = ".parquet"
+
+    def __init__(self, path, columns):
+        self.names = [name for name, _ in columns]
+        self.schema = pa.schema([(name, self.TYPES[kind]()) for name, kind in columns])
+        self.writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        # One row group per batch.
+        columns = {name: list(values) for name, values in zip(self.names, zip(*rows))}
+        self.writer.write_table(pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class CsvFile:
+    extension = ".csv.gz"
+
+    def __init__(self, path, columns):
+        self.file = gzip.open(path, "wt", newline="", compresslevel=6)
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, _ in columns])
+        self.binary = [i for i, (_, kind) in enumerate(columns) if kind == "binary"]
+
+    def write(self, rows):
+        for row in rows:
+            for i in self.binary:
+                if row[i] is not None:
+                    row[i] = base64.b64encode(row[i]).decode()
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+WRITERS = {"parquet": ParquetFile, "csv": CsvFile}
+
+
+class PartitionedWriter:
+    """Appends batches to ``<root>/<table>/month=YYYY-MM/part-NNNN``,
+    keeping only the current partition's file open. Rows arrive in primary
+    key order, which follows upload time; a month that comes round again
+    gets another part file."""
+
+    def __init__(self, root, table, columns, file_format, partitioned=True):
+        if file_format == "parquet" and pa is None:
+            raise ImproperlyConfigured("Parquet export needs pyarrow (pip install pyarrow); use the csv format instead")
+        self.root = os.path.join(root, table)
+        self.columns = columns
+        self.file_class = WRITERS[file_format]
+        self.partitioned = partitioned
+        self.month = None
+        self.current = None
+        self.parts = {}
+        self.paths = []
+
+    def write(self, month, rows):
+        if self.current is None or (self.partitioned and month != self.month):
+            self.close()
+            directory = os.path.join(self.root, f"month={month}") if self.partitioned else self.root
+            os.makedirs(directory, exist_ok=True)
+            part = self.parts.get(month, 0)
+            self.parts[month] = part + 1
+            path = os.path.join(directory, f"part-{part:04d}{self.file_class.extension}")
+            self.current = self.file_class(path, self.columns)
+            self.month = month
+            self.paths.append(path)
+        self.current.write(rows)
+
+    def close(self):
+        if self.current is not None:
+            self.current.close()
+            self.current = None
+
+
+def export_table(table, root, file_format, batch_size=10_000, chunk_size=2_000, thumbnail_size=None,
+                 partitioned=True):
+    """Stream ``table`` into ``root``; returns (rows written, file paths)."""
+    columns = list(table.columns)
+    if thumbnail_size and table.name == "uploads":
+        columns.append(("thumbnail", "binary"))
+    writer = PartitionedWriter(root, table.name, columns, file_format, partitioned)
+    image_index = table.fields.index("image") if "image" in table.fields else None
+    pool = ThreadPoolExecutor(max_workers=4) if thumbnail_size and image_index is not None else None
+    rows_written = 0
+    batch, batch_month, images = [], None, []
+
+    def flush():
+        nonlocal rows_written
+        if not batch:
+            return
+        if pool is not None:
+            for row, data in zip(batch, pool.map(lambda name: thumbnail_of(name, thumbnail_size), images)):
+                row.append(data)
+        writer.write(batch_month, batch)
+        rows_written += len(batch)
+        batch.clear()
+        images.clear()
+
+    queryset = table.queryset.order_by("pk").values_list(*table.fields)
+    try:
+        for values in queryset.iterator(chunk_size=chunk_size):
+            stamp = values[table.month_index]
+            month = stamp.strftime("%Y-%m") if stamp else "unknown"
+            if batch and (len(batch) >= batch_size or (partitioned and month != batch_month)):
+                flush()
+            batch_month = month
+            batch.append(table.convert(values))
+            if pool is not None:
+                images.append(values[image_index])
+        flush()
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown()
+    return rows_written, writer.paths
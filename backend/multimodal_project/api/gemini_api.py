@@ -8,7 +8,7 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
 genai.configure(api_key=os.getenv("GEMINI_API_KEY", ""))
 
-def get_gemini_response(input_text):
+def _start_chat():
     generation_config = {
         "temperature": 1,
         "top_p": 0.95,
@@ -22,7 +22,50 @@ def get_gemini_response(input_text):
         generation_config=generation_config,
     )
 
-    chat_session = model.start_chat(history=[])
+    return model.start_chat(history=[])
 
+def get_gemini_response(input_text):
+    chat_session = _start_chat()
     response = chat_session.send_message(input_text)
-    return response.text
\ No newline at end of file
+    return response.text
+
+async def get_gemini_response_async(input_text):
+    chat_session = _start_chat()
+    response = await chat_session.send_message_async(input_text)
+    return response.text
+
+def _chat_model(system_instruction, max_output_tokens):
+    return genai.GenerativeModel(
+        model_name="gemini-2.0-flash-exp",
+        generation_config={
+            "temperature": 1,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": max_output_tokens,
+            "response_mime_type": "text/plain",
+        },
+        system_instruction=system_instruction,
+    )
+
+
+def _chunk_text(chunk):
+    # A chunk stopped by a safety filter has no text parts.
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+
+def stream_gemini_chat(history, message, system_instruction, max_output_tokens):
+    """Yield the reply to ``message`` as it is generated. ``history`` is
+    a list of {"role": "user"|"model", "parts": [text]} turns."""
+    chat_session = _chat_model(system_instruction, max_output_tokens).start_chat(history=history)
+    for chunk in chat_session.send_message(message, stream=True):
+        yield _chunk_text(chunk)
+
+
+async def stream_gemini_chat_async(history, message, system_instruction, max_output_tokens):
+    chat_session = _chat_model(system_instruction, max_output_tokens).start_chat(history=history)
+    response = await chat_session.send_message_async(message, stream=True)
+    async for chunk in response:
+        yield _chunk_text(chunk)
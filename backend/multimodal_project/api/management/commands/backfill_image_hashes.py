@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand
+
+from api.dedupe import ImageHashes, duplicate_report
+from api.models import ImageUpload
+from api.storage import open_original
+
+HASH_FIELDS = ["content_sha256", "phash", "phash_band0", "phash_band1", "phash_band2", "phash_band3"]
+
+
+class Command(BaseCommand):
+    help = "Compute duplicate-detection hashes for uploads stored before they existed, then link duplicates."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, chunk_size, **options):
+        hashed = missing = 0
+        pending = []
+        # A cold upload's ``image`` is its preview; hash the original.
+        queryset = (
+            ImageUpload.objects.filter(content_sha256__isnull=True)
+            .only("id", "image", "tier", "original").order_by("id")
+        )
+        for upload in queryset.iterator(chunk_size=chunk_size):
+            try:
+                with open_original(upload) as f:
+                    hashes = ImageHashes.from_bytes(f.read())
+            except OSError:
+                missing += 1
+                continue
+            for field, value in hashes.fields().items():
+                setattr(upload, field, value)
+            pending.append(upload)
+            if len(pending) >= chunk_size:
+                ImageUpload.objects.bulk_update(pending, HASH_FIELDS)
+                hashed += len(pending)
+                pending.clear()
+        if pending:
+            ImageUpload.objects.bulk_update(pending, HASH_FIELDS)
+            hashed += len(pending)
+
+        # Oldest first, so each upload links to the earliest copy before it.
+        linked = 0
+        queryset = (
+            ImageUpload.objects.filter(duplicate_of__isnull=True, content_sha256__isnull=False)
+            .select_related("user").only("id", "user", "content_sha256", "phash").order_by("id")
+        )
+        for upload in queryset.iterator(chunk_size=chunk_size):
+            hashes = ImageHashes(upload.content_sha256, upload.phash & ((1 << 64) - 1))
+            earlier = ImageUpload.objects.filter(id__lt=upload.id)
+            best, duplicates = duplicate_report(upload.user, hashes, earlier)
+            if best is not None:
+                ImageUpload.objects.filter(id=upload.id).update(duplicate_of_id=duplicates["duplicate_of"])
+                linked += 1
+
+        self.stdout.write(f"hashed={hashed} missing_files={missing} linked_duplicates={linked}")
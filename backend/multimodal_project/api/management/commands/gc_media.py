@@ -0,0 +1,95 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import ImageUpload, UploadSession
+from api.storage import cold_storage, walk
+
+HOT_PREFIXES = ["uploads", "previews"]
+COLD_PREFIXES = ["uploads"]
+
+
+class Command(BaseCommand):
+    help = ("Find files in the hot and cold media storages that no upload refers to, and resumable "
+            "uploads abandoned mid-way; delete them with --delete.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--delete", action="store_true", help="Delete what is found (default: report only)")
+        parser.add_argument("--workers", type=int, default=8, help="Parallel listings, stats and deletes")
+        parser.add_argument("--min-age-hours", type=float, default=24,
+                            help="Leave newer files alone; their rows may not be committed yet")
+        parser.add_argument("--stale-upload-days", type=int, default=7,
+                            help="Open resumable uploads untouched this long are abandoned")
+
+    def handle(self, *args, delete, workers, min_age_hours, stale_upload_days, **options):
+        start = time.perf_counter()
+        now = timezone.now()
+
+        # List before reading the rows: a file saved after the listing is
+        # not looked at, and one saved just before it is younger than
+        # --min-age-hours.
+        tiers = [
+            (default_storage, walk(default_storage, HOT_PREFIXES, workers)),
+            (cold_storage(), walk(cold_storage(), COLD_PREFIXES, workers)),
+        ]
+        hot_names, cold_names = set(), set()
+        for image, original in ImageUpload.objects.values_list('image', 'original').iterator(chunk_size=10_000):
+            hot_names.add(image)
+            if original:
+                cold_names.add(original)
+
+        stale_cutoff = now - timedelta(days=stale_upload_days)
+        stale_sessions = []
+        for session in UploadSession.objects.filter(status__in=('open', 'finalizing')).select_related('user').iterator():
+            if session.updated_at < stale_cutoff:
+                stale_sessions.append(session)
+            else:
+                hot_names.add(session.partial_path)
+
+        min_modified = now - timedelta(hours=min_age_hours)
+        referenced = [hot_names, cold_names]
+        orphans, orphan_bytes, missing, scanned = [], 0, 0, 0
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for (storage, names), wanted in zip(tiers, referenced):
+                scanned += len(names)
+                present = set(names)
+                missing += sum(
+                    1 for name in wanted
+                    if name and name.split("/", 1)[0] in HOT_PREFIXES and name not in present
+                )
+                candidates = [name for name in names if name not in wanted]
+
+                def old_enough(name, storage=storage):
+                    try:
+                        if storage.get_modified_time(name) >= min_modified:
+                            return None
+                        return storage.size(name)
+                    except FileNotFoundError:
+                        return None
+
+                for name, size in zip(candidates, pool.map(old_enough, candidates)):
+                    if size is not None:
+                        orphans.append((storage, name))
+                        orphan_bytes += size
+
+            deleted = 0
+            if delete:
+                for _ in pool.map(lambda orphan: orphan[0].delete(orphan[1]), orphans):
+                    deleted += 1
+                for session in stale_sessions:
+                    path = os.path.join(settings.MEDIA_ROOT, session.partial_path)
+                    if os.path.exists(path):
+                        os.remove(path)
+                    session.delete()
+
+        self.stdout.write(
+            f"scanned_files={scanned} orphans={len(orphans)} orphan_mb={orphan_bytes / 1024 / 1024:.1f} "
+            f"missing_files={missing} stale_uploads={len(stale_sessions)} deleted={deleted} "
+            f"seconds={time.perf_counter() - start:.1f}"
+        )
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from itertools import islice
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.models import ImageUpload
+from api.storage import cold_storage, delete_quietly, freeze
+
+
+class Command(BaseCommand):
+    help = "Move originals of old uploads to the cold storage tier, gzipped, keeping a preview in the hot tier."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=180, metavar="DAYS")
+        parser.add_argument("--limit", type=int, help="Move at most this many uploads")
+        parser.add_argument("--workers", type=int, default=4, help="Uploads processed in parallel")
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, older_than, limit, workers, dry_run, **options):
+        cutoff = timezone.now() - timedelta(days=older_than)
+        queryset = (
+            ImageUpload.objects.filter(tier='hot', uploaded_at__lt=cutoff)
+            .exclude(image='').order_by('id').values_list('id', 'image')
+        )
+        if limit:
+            queryset = queryset[:limit]
+        if dry_run:
+            self.stdout.write(f"would_move={queryset.count()}")
+            return
+
+        moved = failed = original_bytes = cold_bytes = preview_bytes = 0
+
+        def attempt(name):
+            try:
+                return freeze(name)
+            except Exception as e:
+                self.stderr.write(f"{name}: {e}")
+                return None
+
+        rows = queryset.iterator(chunk_size=1000)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while batch := list(islice(rows, workers * 8)):
+                for (upload_id, name), frozen in zip(batch, pool.map(attempt, [name for _, name in batch])):
+                    if frozen is None:
+                        failed += 1
+                        continue
+                    # Only if the row still points at what was copied.
+                    updated = ImageUpload.objects.filter(id=upload_id, tier='hot', image=name).update(
+                        image=frozen.preview_name, original=frozen.cold_name, tier='cold'
+                    )
+                    if updated:
+                        delete_quietly(default_storage, name)
+                        moved += 1
+                        original_bytes += frozen.original_bytes
+                        cold_bytes += frozen.cold_bytes
+                        preview_bytes += frozen.preview_bytes
+                    else:
+                        delete_quietly(default_storage, frozen.preview_name)
+                        delete_quietly(cold_storage(), frozen.cold_name)
+
+        mb = 1024 * 1024
+        self.stdout.write(
+            f"moved={moved} failed={failed} original_mb={original_bytes / mb:.1f} "
+            f"cold_mb={cold_bytes / mb:.1f} hot_preview_mb={preview_bytes / mb:.1f}"
+        )
@@ -0,0 +1,181 @@
+"""
+Serving uploaded images.
+
+    GET /media/<name>?expires=...&signature=...   (URLs from ImageField.url)
+    GET /media/<name>                             (Authorization: Bearer <access token>)
+
+A signed URL is its own authorization: the API response that handed it out
+already checked that the user may see the image, so checking it costs one
+HMAC and no query. Without a signature the user must be the uploader, a
+doctor or staff.
+
+Once authorized, MEDIA_SERVE decides who sends the bytes:
+
+- ``django``: Python streams the file, with strong ETags, conditional GET
+  and single byte ranges. Under a WSGI server with ``wsgi.file_wrapper``
+  (gunicorn) whole-file responses go out with sendfile.
+- ``x-accel``: nginx sends it (sendfile, ranges, ETags) after an
+  ``X-Accel-Redirect`` to MEDIA_ACCEL_PREFIX, configured as::
+
+      location /protected-media/ {
+          internal;
+          alias /srv/app/media/;
+      }
+
+- ``x-sendfile``: Apache mod_xsendfile or lighttpd, given the file path.
+
+Sharded names (uploads/ab/cd/<random>.jpg, previews/...) never change
+content, so they are cached for a year; older per-user names are
+revalidated with their ETag. Responses are ``private`` in every case.
+"""
+import mimetypes
+import os
+from stat import S_ISREG
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import CachedJWTAuthentication, role_of
+from .models import ImageUpload
+from .storage import immutable, local_path, valid_signature
+
+IMMUTABLE_CACHE = "private, max-age=31536000, immutable"
+REVALIDATE_CACHE = "private, no-cache"
+READ_SIZE = 64 * 1024
+
+
+def requesting_user(request):
+    """(user, token) for a Bearer token, else the session user (admin)."""
+    try:
+        authenticated = CachedJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        authenticated = None
+    if authenticated is not None:
+        return authenticated
+    return (request.user if request.user.is_authenticated else None), None
+
+
+def may_view(user, token, name):
+    if user is None:
+        return False
+    if user.is_staff:
+        return True
+    if role_of(user, token) == 'doctor':
+        return ImageUpload.objects.filter(image=name).exists()
+    return ImageUpload.objects.filter(image=name, user=user).exists()
+
+
+def byte_range(header, size):
+    """(start, end) inclusive for a single ``bytes=`` range; None to send
+    the whole file (no header, several ranges, or one we do not parse);
+    ValueError if the range lies outside the file."""
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[6:].strip().partition("-")
+    try:
+        start = int(start) if start else None
+        end = int(end) if end else None
+    except ValueError:
+        return None
+    if start is None:
+        if end is None or end < 0:
+            return None
+        # A suffix of the last ``end`` bytes; "-0" asks for none of them.
+        if end == 0 or size == 0:
+            raise ValueError("range not satisfiable")
+        return max(size - end, 0), size - 1
+    end = min(end, size - 1) if end is not None else size - 1
+    if start >= size or start > end:
+        raise ValueError("range not satisfiable")
+    return start, end
+
+
+def file_part(path, start, length):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(READ_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+def send_file(request, name, path, stat):
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(stat.st_mtime),
+        "Cache-Control": IMMUTABLE_CACHE if immutable(name) else REVALIDATE_CACHE,
+        "Accept-Ranges": "bytes",
+    }
+    conditional = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if conditional is not None:
+        for header, value in headers.items():
+            conditional[header] = value
+        return conditional
+
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    if_range = request.headers.get("If-Range")
+    try:
+        requested = byte_range(request.headers.get("Range"), stat.st_size) if if_range in (None, etag) else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{stat.st_size}"
+        return response
+
+    if requested is None:
+        response = FileResponse(open(path, "rb"), content_type=content_type)
+    else:
+        start, end = requested
+        response = StreamingHttpResponse(file_part(path, start, end - start + 1), status=206,
+                                         content_type=content_type)
+        response["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+        response["Content-Length"] = str(end - start + 1)
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def offloaded(name, path):
+    """An empty response telling the web server in front to send the file."""
+    response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or "application/octet-stream")
+    if settings.MEDIA_SERVE == "x-accel":
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX.rstrip("/") + "/" + quote(name)
+    else:
+        response["X-Sendfile"] = path
+    response["Cache-Control"] = IMMUTABLE_CACHE if immutable(name) else REVALIDATE_CACHE
+    return response
+
+
+@require_safe
+def serve_media(request, name):
+    signed = valid_signature(name, request.GET.get("expires"), request.GET.get("signature"))
+    if not signed and not may_view(*requesting_user(request), name):
+        # Same answer as a missing file, so names cannot be probed.
+        raise Http404("Image not found.")
+
+    try:
+        path = local_path(default_storage, name)
+    except SuspiciousFileOperation:
+        raise Http404("Image not found.")
+    if path is None:
+        # Remote storage: the client fetches from the bucket directly.
+        return HttpResponseRedirect(default_storage.url(name))
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404("Image not found.")
+    if not S_ISREG(stat.st_mode):
+        raise Http404("Image not found.")
+
+    if settings.MEDIA_SERVE == "django":
+        return send_file(request, name, path, stat)
+    return offloaded(name, path)
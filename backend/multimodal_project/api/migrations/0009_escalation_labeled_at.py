@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_remove_escalation_negative_votes_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='escalation',
+            name='labeled_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
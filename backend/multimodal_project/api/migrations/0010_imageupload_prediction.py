@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_escalation_labeled_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='confidence_level',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='logit',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='model_version',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='prediction',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='probability',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_uploadsession'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='content_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='duplicates', to='api.imageupload'),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='phash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='phash_band0',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='phash_band1',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='phash_band2',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='phash_band3',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_imageupload_hashes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LesionFeatures',
+            fields=[
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='features', serialize=False, to='api.imageupload')),
+                ('region', models.CharField(blank=True, max_length=30, null=True)),
+                ('embedding', models.BinaryField()),
+                ('lesion_area', models.FloatField(blank=True, null=True)),
+                ('embedding_distance', models.FloatField(blank=True, null=True)),
+                ('area_change', models.FloatField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('previous', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.imageupload')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lesion_features', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'region'], name='api_lesionf_user_id_be053e_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:12
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_lesionfeatures'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='original',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='tier',
+            field=models.CharField(choices=[('hot', 'Hot'), ('cold', 'Cold')], default='hot', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='image',
+            field=models.ImageField(upload_to=api.models.sharded_image_path),
+        ),
+    ]
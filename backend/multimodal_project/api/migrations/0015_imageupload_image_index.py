@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:20
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_imageupload_tier'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imageupload',
+            name='image',
+            field=models.ImageField(db_index=True, upload_to=api.models.sharded_image_path),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from api import search
+
+
+def install(apps, schema_editor):
+    search.install(schema_editor.connection)
+
+
+def uninstall(apps, schema_editor):
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_imageupload_image_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(install, uninstall),
+    ]
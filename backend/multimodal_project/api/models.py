@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import connections, models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 import os
+import uuid
+
+from . import authentication, events, search, storage
 
 def user_image_path(instance, filename):
     # Get file extension
@@ -20,6 +24,12 @@ def user_image_path(instance, filename):
 
 
 
+def sharded_image_path(instance, filename):
+    """uploads/ab/cd/<random>.<ext> (api/storage.py)."""
+    ext = os.path.splitext(filename)[1].lower() or '.jpg'
+    return storage.sharded_name('uploads', ext)
+
+
 def image_upload_path(instance, filename):
     folder = 'images'
     os.makedirs(folder, exist_ok=True)
@@ -27,15 +37,44 @@ def image_upload_path(instance, filename):
 
 class ImageUpload(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='images')
-    image = models.ImageField(upload_to=user_image_path)  # Custom path function
+    image = models.ImageField(upload_to=sharded_image_path, db_index=True)
     metadata = models.TextField(blank=True, null=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    # Model API result. The raw logit lets calibration.py relabel stored
+    # predictions without re-running inference.
+    logit = models.FloatField(blank=True, null=True)
+    probability = models.FloatField(blank=True, null=True)
+    prediction = models.CharField(max_length=20, blank=True, null=True)
+    confidence_level = models.CharField(max_length=10, blank=True, null=True)
+    model_version = models.CharField(max_length=100, blank=True, null=True)
+    # Duplicate detection (api/dedupe.py): exact bytes, and a perceptual
+    # hash split into indexed 16-bit bands for near-duplicate lookup.
+    content_sha256 = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    phash = models.BigIntegerField(blank=True, null=True)
+    phash_band0 = models.IntegerField(blank=True, null=True, db_index=True)
+    phash_band1 = models.IntegerField(blank=True, null=True, db_index=True)
+    phash_band2 = models.IntegerField(blank=True, null=True, db_index=True)
+    phash_band3 = models.IntegerField(blank=True, null=True, db_index=True)
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True,
+                                     related_name='duplicates')
+    # Storage tier (api/storage.py). A cold upload's ``image`` is a preview
+    # and ``original`` names the gzipped original in the cold storage.
+    tier = models.CharField(
+        max_length=10,
+        choices=[
+            ('hot', 'Hot'),
+            ('cold', 'Cold'),
+        ],
+        default='hot'
+    )
+    original = models.CharField(max_length=255, blank=True, null=True)
     
     class Meta:
         ordering = ['-uploaded_at']  # Latest first
     
     def __str__(self):
-        return f"{self.user.username} - Image {self.id} - {self.uploaded_at.strftime('%Y-%m-%d %H:%M')}"
+        # No related fields: admin lists and FK widgets render many of these.
+        return f"Image {self.id} - {self.uploaded_at.strftime('%Y-%m-%d %H:%M')}"
     
     @property
     def image_name(self):
@@ -43,6 +82,69 @@ class ImageUpload(models.Model):
         return os.path.basename(self.image.name)
     
 
+@receiver(post_delete, sender=ImageUpload)
+def delete_upload_files(sender, instance, **kwargs):
+    # Rows deleted directly or by cascade take their files with them.
+    transaction.on_commit(lambda: storage.delete_upload_files(instance))
+
+
+class UploadSession(models.Model):
+    """A resumable upload in progress; chunks are appended to ``partial_path``
+    until ``received`` reaches ``size``."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    metadata = models.TextField(blank=True, null=True)
+    received = models.PositiveBigIntegerField(default=0)
+    status = models.CharField(
+        max_length=20,
+        choices=[
+            ('open', 'Open'),
+            # Claimed by one finalize call; concurrent retries get a 409.
+            ('finalizing', 'Finalizing'),
+            ('complete', 'Complete'),
+            # Not a valid image; the partial file is deleted.
+            ('failed', 'Failed'),
+        ],
+        default='open'
+    )
+    upload = models.OneToOneField(ImageUpload, on_delete=models.SET_NULL, blank=True, null=True,
+                                  related_name='upload_session')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def partial_path(self):
+        """Relative to MEDIA_ROOT, next to the user's finished uploads."""
+        return os.path.join('uploads', self.user.username, f".{self.id}.part")
+
+    def __str__(self):
+        return f"Upload {self.id} by {self.user.username} ({self.received}/{self.size})"
+
+
+class LesionFeatures(models.Model):
+    """Per-image features from the model API and the change versus the
+    closest earlier image of the same patient and body region."""
+    image = models.OneToOneField(ImageUpload, on_delete=models.CASCADE, primary_key=True, related_name='features')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='lesion_features')
+    region = models.CharField(max_length=30, blank=True, null=True)
+    # Normalized ResNet18 embedding, little-endian float16.
+    embedding = models.BinaryField()
+    lesion_area = models.FloatField(blank=True, null=True)
+    previous = models.ForeignKey(ImageUpload, on_delete=models.SET_NULL, blank=True, null=True, related_name='+')
+    embedding_distance = models.FloatField(blank=True, null=True)
+    area_change = models.FloatField(blank=True, null=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'region'])]
+
+    def __str__(self):
+        return f"Features of image {self.image_id} ({self.region or 'no region'})"
+
+
 class Post(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="posts")
     content = models.TextField()
@@ -59,7 +161,8 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Comment {self.id} on Post {self.post.id} by {self.user.username}"
+        # Ids only, as in ImageUpload.__str__.
+        return f"Comment {self.id} on Post {self.post_id} by user {self.user_id}"
 
 class Profile(models.Model):
     ROLE_CHOICES = [
@@ -78,11 +181,17 @@ class Profile(models.Model):
     
 
 @receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
+def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
-    else:
-        instance.profile.save()
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Profile)
+def forget_cached_user(sender, instance, **kwargs):
+    # After commit, so a request cannot cache the row as it was before.
+    user_id = instance.pk if sender is User else instance.user_id
+    transaction.on_commit(lambda: authentication.forget_user(user_id), using=kwargs.get('using'))
 
 
 class Escalation(models.Model):
@@ -100,7 +209,33 @@ class Escalation(models.Model):
         default='unsure'
     )
     submitted_at = models.DateTimeField(auto_now_add=True)
+    # Set whenever a doctor records a diagnosis; used to pick up new labels for fine-tuning.
+    labeled_at = models.DateTimeField(blank=True, null=True, db_index=True)
+
+    LABELED_STATUSES = ('cancer positive', 'cancer negative')
 
     def __str__(self):
-        return f"Escalation by {self.patient.username} for {self.image.image.name}"
+        return f"Escalation {self.id} by user {self.patient_id} for image {self.image_id}"
+
+
+@receiver(post_migrate)
+def repair_full_text_search(sender, using, **kwargs):
+    if sender.name == 'api':
+        search.repair(connections[using])
+
+
+@receiver(pre_save, sender=Escalation)
+def stamp_escalation_label(sender, instance, **kwargs):
+    if instance.status not in Escalation.LABELED_STATUSES:
+        return
+    previous_status = None
+    if instance.pk:
+        previous_status = sender.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+    if previous_status != instance.status:
+        instance.labeled_at = timezone.now()
+
 
+@receiver(post_save, sender=Escalation)
+def notify_escalation(sender, instance, created, **kwargs):
+    # Status changes made in the admin reach the patient's open event streams.
+    transaction.on_commit(lambda: events.publish_escalation(instance, created))
@@ -0,0 +1,102 @@
+"""
+Full-text search over the free-text columns the admin searches.
+
+LIKE '%term%' reads every row, so Post.content, Comment.comment and
+Escalation.reason are indexed instead:
+
+- PostgreSQL: a GIN index on ``to_tsvector('english', column)``, queried
+  with ``@@ plainto_tsquery``.
+- SQLite: an FTS5 table per column (external content, so the text is not
+  stored twice), kept in step with the table by triggers.
+
+Words match by stem ("itching" finds "itch") and every word must appear;
+on SQLite the last word also matches as a prefix. Other databases fall
+back to icontains.
+"""
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+CONFIG = "english"
+# (table, column) pairs with a full-text index; 0016_full_text_search.
+COLUMNS = (("api_post", "content"), ("api_comment", "comment"), ("api_escalation", "reason"))
+
+
+def fts_table(table, column):
+    return f"{table}_{column}_fts"
+
+
+def sqlite_statements(table, column):
+    fts = fts_table(table, column)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, content='{table}', "
+        f"content_rowid='id', tokenize='porter unicode61')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {column} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column}); "
+        f"INSERT INTO {fts}(rowid, {column}) VALUES (new.id, new.{column}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+def install(connection):
+    with connection.cursor() as cursor:
+        for table, column in COLUMNS:
+            if connection.vendor == "sqlite":
+                for statement in sqlite_statements(table, column):
+                    cursor.execute(statement)
+            elif connection.vendor == "postgresql":
+                cursor.execute(
+                    f"CREATE INDEX IF NOT EXISTS {fts_table(table, column)} ON {table} "
+                    f"USING gin (to_tsvector('{CONFIG}', {column}))"
+                )
+
+
+def uninstall(connection):
+    with connection.cursor() as cursor:
+        for table, column in COLUMNS:
+            if connection.vendor == "sqlite":
+                for suffix in ("_insert", "_delete", "_update"):
+                    cursor.execute(f"DROP TRIGGER IF EXISTS {fts_table(table, column)}{suffix}")
+                cursor.execute(f"DROP TABLE IF EXISTS {fts_table(table, column)}")
+            elif connection.vendor == "postgresql":
+                cursor.execute(f"DROP INDEX IF EXISTS {fts_table(table, column)}")
+
+
+def repair(connection):
+    """Re-create SQLite triggers lost when a migration rebuilt the table
+    (SQLite ALTERs copy the table and drop the original), then re-index."""
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {name for (name,) in cursor.fetchall()}
+        for table, column in COLUMNS:
+            fts = fts_table(table, column)
+            if fts in existing and f"{fts}_insert" not in existing:
+                for statement in sqlite_statements(table, column):
+                    cursor.execute(statement)
+
+
+def sqlite_query(term):
+    words = ['"' + word.replace('"', '""') + '"' for word in term.split()]
+    if words:
+        words[-1] += "*"
+    return " ".join(words)
+
+
+def matches(queryset, column, term):
+    """A filter() condition: ``column`` of ``queryset``'s rows matches ``term``."""
+    vendor = connections[queryset.db].vendor
+    table = queryset.model._meta.db_table
+    if (table, column) not in COLUMNS or vendor not in ("sqlite", "postgresql"):
+        return Q(**{f"{column}__icontains": term})
+    if vendor == "sqlite":
+        fts = fts_table(table, column)
+        return Q(pk__in=RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [sqlite_query(term)]))
+    return Q(pk__in=RawSQL(
+        f"SELECT id FROM {table} WHERE to_tsvector('{CONFIG}', {column}) @@ plainto_tsquery('{CONFIG}', %s)", [term]
+    ))
@@ -31,8 +31,10 @@ class ImageUploadSerializer(serializers.ModelSerializer):
     
     class Meta:
         model = ImageUpload
-        fields = ['id', 'image', 'image_url', 'image_name', 'metadata', 'uploaded_at', 'username']
-        read_only_fields = ['id', 'uploaded_at', 'image_url', 'image_name', 'username']
+        fields = ['id', 'image', 'image_url', 'image_name', 'metadata', 'uploaded_at', 'username',
+                  'probability', 'prediction', 'confidence_level', 'model_version', 'duplicate_of']
+        read_only_fields = ['id', 'uploaded_at', 'image_url', 'image_name', 'username',
+                            'probability', 'prediction', 'confidence_level', 'model_version', 'duplicate_of']
     
     def get_image_url(self, obj):
         """Return full URL of the image"""
@@ -0,0 +1,204 @@
+"""
+Where uploaded images live.
+
+Two Django storages are configured in settings.STORAGES: "default" (hot:
+what the app serves) and "cold" (gzipped originals of old uploads). Both
+are the local filesystem unless MEDIA_STORAGE=s3, which puts them in an
+S3-compatible bucket through django-storages. For a local stand-in of S3,
+run ``moto_server -p 9000`` (or MinIO) and set AWS_S3_ENDPOINT_URL.
+
+Code reads and writes files only through these storages (never
+``FieldFile.path``), so the same paths work on either backend.
+
+On the filesystem, ``storage.url(name)`` is a signed, expiring
+``/media/...`` URL served by api/media.py, so an ``<img src>`` needs no
+Authorization header; on S3 it is a presigned bucket URL.
+
+New uploads are named ``uploads/ab/cd/<random>.<ext>``, which spreads them
+over 65536 directories (or key prefixes) rather than one growing
+directory per user. ``manage.py tier_media`` moves old originals to the
+cold tier and leaves a preview in their place; ``manage.py gc_media``
+removes files no row refers to.
+"""
+import gzip
+import io
+import logging
+import os
+import re
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage, storages
+from django.core.signing import Signer
+from django.utils.crypto import constant_time_compare
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+COLD_SUFFIX = ".gz"
+# Names from sharded_name() are random and never reused, so what they
+# point at never changes.
+SHARDED_NAME = re.compile(r"^[a-z]+/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.\w+$")
+
+
+def cold_storage():
+    return storages["cold"]
+
+
+def sharded_name(prefix, extension):
+    key = uuid.uuid4().hex
+    return f"{prefix}/{key[:2]}/{key[2:4]}/{key}{extension}"
+
+
+def immutable(name):
+    return SHARDED_NAME.match(name) is not None
+
+
+def url_signature(name, expires):
+    return Signer(salt="api.media").signature(f"{name}:{expires}")
+
+
+def valid_signature(name, expires, signature):
+    try:
+        expires = int(expires)
+    except (TypeError, ValueError):
+        return False
+    return expires > time.time() and constant_time_compare(url_signature(name, expires), signature or "")
+
+
+class SignedFileSystemStorage(FileSystemStorage):
+    """Filesystem storage whose URLs carry an expiring signature. The
+    expiry is rounded up to a whole MEDIA_URL_TTL period, so the URL of a
+    file stays the same for a while and browsers can cache it; it is valid
+    for between one and two periods."""
+
+    def url(self, name):
+        ttl = settings.MEDIA_URL_TTL
+        expires = (int(time.time()) // ttl + 2) * ttl
+        return f"{super().url(name)}?expires={expires}&signature={url_signature(name, expires)}"
+
+
+def local_path(storage, name):
+    """Filesystem path of ``name``, or None for remote storages."""
+    try:
+        return storage.path(name)
+    except NotImplementedError:
+        return None
+
+
+def move_into(storage, source_path, name):
+    """Move a finished local file into ``storage`` as ``name``; a rename
+    when the storage is the local filesystem. Returns the stored name."""
+    path = local_path(storage, name)
+    if path is not None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(source_path, path)
+        return name
+    with open(source_path, "rb") as f:
+        name = storage.save(name, File(f, name=os.path.basename(name)))
+    os.remove(source_path)
+    return name
+
+
+def open_original(upload):
+    """The full-resolution original of ``upload``, from whichever tier it is on."""
+    if upload.tier == 'cold':
+        with cold_storage().open(upload.original, "rb") as f:
+            data = gzip.decompress(f.read())
+        return File(io.BytesIO(data), name=os.path.basename(upload.original[:-len(COLD_SUFFIX)]))
+    return upload.image.open("rb")
+
+
+def preview(data):
+    """JPEG derivative kept hot when an original goes cold."""
+    with Image.open(io.BytesIO(data)) as image:
+        size = settings.MEDIA_PREVIEW_SIZE
+        image.draft("RGB", (size, size))
+        image = image.convert("RGB")
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+
+@dataclass
+class Frozen:
+    preview_name: str
+    cold_name: str
+    original_bytes: int
+    cold_bytes: int
+    preview_bytes: int
+
+
+def freeze(name):
+    """Copy the hot file ``name`` to the cold tier, gzipped, and store its
+    preview in the hot tier. The caller switches the row over and deletes
+    the hot original."""
+    with default_storage.open(name, "rb") as f:
+        data = f.read()
+    compressed = gzip.compress(data, compresslevel=6)
+    derived = preview(data)
+    cold_name = cold_storage().save(name + COLD_SUFFIX, ContentFile(compressed))
+    preview_name = default_storage.save(sharded_name("previews", ".jpg"), ContentFile(derived))
+    return Frozen(preview_name, cold_name, len(data), len(compressed), len(derived))
+
+
+def delete_quietly(storage, name):
+    if not name:
+        return
+    try:
+        storage.delete(name)
+    except Exception as e:
+        logger.error(f"Could not delete {name}: {e}")
+
+
+def delete_upload_files(upload):
+    delete_quietly(default_storage, upload.image.name)
+    if upload.original:
+        delete_quietly(cold_storage(), upload.original)
+
+
+def listdir(storage, prefix):
+    try:
+        return storage.listdir(prefix)
+    except FileNotFoundError:
+        return [], []
+
+
+def list_keys(storage, prefix):
+    """Every file name under ``prefix`` in an S3 storage: one paginated
+    listing of up to 1000 keys per request, however deep the tree."""
+    root = f"{storage.location.strip('/')}/" if storage.location.strip("/") else ""
+    return [obj.key[len(root):] for obj in storage.bucket.objects.filter(Prefix=f"{root}{prefix}/")]
+
+
+def walk(storage, prefixes, workers):
+    """All file names under ``prefixes``, listed in parallel. Directories
+    are listed one by one; on S3 (object keys have no directories) each
+    first-level shard is listed flat instead, since a request per leaf
+    directory would mean ~65536 requests per prefix."""
+    names = []
+    flat = hasattr(storage, "bucket")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(listdir, storage, prefix): prefix for prefix in prefixes}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                prefix = pending.pop(future)
+                if prefix is None:
+                    names.extend(future.result())
+                    continue
+                directories, files = future.result()
+                names.extend(f"{prefix}/{name}" for name in files)
+                for directory in directories:
+                    path = f"{prefix}/{directory}"
+                    if flat:
+                        pending[pool.submit(list_keys, storage, path)] = None
+                    else:
+                        pending[pool.submit(listdir, storage, path)] = path
+    return names
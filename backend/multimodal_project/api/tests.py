@@ -1,3 +1,507 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from . import export, views
+from .authentication import cached_user, user_key
+from .chat import history_key
+from .dedupe import ImageHashes, duplicate_report, find_duplicates
+from .models import Comment, Escalation, ImageUpload, Post, UploadSession
+from .storage import freeze, url_signature
+
+
+def jpeg_bytes(color=(200, 80, 60)):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+class MediaRootMixin:
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+# Top bit set, so the stored (signed) phash is negative.
+PHASH = 0x8123_4567_89AB_CDEF
+
+
+@override_settings(DUPLICATE_MAX_DISTANCE=6, GEMINI_EXPLANATIONS=False)
+class DuplicateDetectionTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user(username="alice", password="pass12345")
+        self.bob = User.objects.create_user(username="bob", password="pass12345")
+
+    def stored(self, user, phash, sha256="0" * 64, **fields):
+        return ImageUpload.objects.create(user=user, image="uploads/x.jpg",
+                                          **ImageHashes(sha256, phash).fields(), **fields)
+
+    def distances(self, phash):
+        return {m.upload_id: m.distance for m in find_duplicates(ImageHashes("f" * 64, phash), ImageUpload.objects.all())}
+
+    def test_near_duplicates_across_bands(self):
+        upload = self.stored(self.alice, PHASH)
+        # One bit in each band: no band matches exactly.
+        self.assertEqual(self.distances(PHASH ^ (1 | 1 << 16 | 1 << 32 | 1 << 48)), {upload.id: 4})
+        # Four bits in one band: the other three match.
+        self.assertEqual(self.distances(PHASH ^ 0b1111 << 20), {upload.id: 4})
+        self.assertEqual(self.distances(PHASH ^ (0b11 | 0b11 << 16 | 1 << 32 | 1 << 48)), {upload.id: 6})
+        self.assertEqual(self.distances(PHASH ^ (0b11 | 0b11 << 16 | 0b11 << 32 | 1 << 48)), {})
+
+    def test_phash_round_trips_through_the_signed_column(self):
+        upload = self.stored(self.alice, PHASH)
+        upload.refresh_from_db()
+        self.assertLess(upload.phash, 0)
+        self.assertEqual(upload.phash % (1 << 64), PHASH)
+        self.assertEqual([getattr(upload, f"phash_band{band}") for band in range(4)],
+                         [0xCDEF, 0x89AB, 0x4567, 0x8123])
+        self.assertEqual(self.distances(PHASH), {upload.id: 0})
+        self.assertEqual(self.distances(PHASH ^ 1 << 63), {upload.id: 1})
+
+    def test_own_uploads_win(self):
+        original = self.stored(self.bob, 0x1234, sha256="a" * 64)
+        mine = self.stored(self.alice, 0x1234 ^ 0b111, duplicate_of=original)
+        best, summary = duplicate_report(self.alice, ImageHashes("a" * 64, 0x1234), ImageUpload.objects.all())
+        # Bob's copy is byte-identical, but Alice's near copy is preferred.
+        self.assertEqual((best.upload_id, best.exact, best.distance), (mine.id, False, 3))
+        self.assertEqual(summary, {"duplicate_of": original.id,
+                                   "own": [{"id": mine.id, "distance": 3, "exact": False}], "other_users": 1})
+
+    def test_identical_reupload_reuses_the_prediction(self):
+        data = jpeg_bytes()
+        hashes = ImageHashes.from_bytes(data)
+        first = self.stored(self.alice, hashes.phash, sha256=hashes.sha256, metadata=json.dumps({"age": 40}),
+                            prediction="benign", probability=0.1, logit=-2.2, model_version="v1")
+        access = views.CustomTokenObtainPairSerializer.get_token(self.alice).access_token
+        with mock.patch("requests.post") as post, mock.patch("api.async_views.model_api_client") as client:
+            response = self.client.post("/api/upload/", {
+                "image": ContentFile(data, name="again.jpg"), "metadata": json.dumps({"age": 40}),
+            }, HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(response.status_code, 201)
+        post.assert_not_called()
+        client.assert_not_called()
+        prediction = response.json()["prediction"]
+        self.assertEqual((prediction["prediction"], prediction["duplicate_of"]), ("benign", first.id))
+        self.assertEqual(ImageUpload.objects.latest("id").duplicate_of_id, first.id)
+
+
+    def test_backfill_hashes_cold_originals(self):
+        data = jpeg_bytes()
+        hot = ImageUpload.objects.create(user=self.alice, image=default_storage.save("uploads/a.jpg", ContentFile(data)))
+        cold_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cold_root, ignore_errors=True)
+        with mock.patch("api.storage.cold_storage", return_value=FileSystemStorage(location=cold_root)):
+            frozen = freeze(hot.image.name)
+            cold = ImageUpload.objects.create(user=self.bob, image=frozen.preview_name, tier="cold",
+                                              original=frozen.cold_name)
+            call_command("backfill_image_hashes", stdout=io.StringIO())
+        hot.refresh_from_db()
+        cold.refresh_from_db()
+        self.assertEqual(cold.content_sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual((cold.phash, cold.duplicate_of_id), (hot.phash, hot.id))
+
+
+class MediaTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.owner = User.objects.create_user(username="owner", password="pass12345")
+        self.other = User.objects.create_user(username="other", password="pass12345")
+        self.doctor = User.objects.create_user(username="drlee", password="pass12345")
+        self.doctor.profile.role = "doctor"
+        self.doctor.profile.save()
+        self.data = jpeg_bytes()
+        self.name = default_storage.save("uploads/mole.jpg", ContentFile(self.data))
+        ImageUpload.objects.create(user=self.owner, image=self.name)
+
+    def get(self, name, user=None, query=None, **headers):
+        if user is not None:
+            access = views.CustomTokenObtainPairSerializer.get_token(user).access_token
+            headers["HTTP_AUTHORIZATION"] = f"Bearer {access}"
+        return self.client.get(f"/media/{name}", query or {}, **headers)
+
+    def signed(self, name, expires):
+        return {"expires": expires, "signature": url_signature(name, expires)}
+
+    def body(self, response):
+        return b"".join(response.streaming_content)
+
+    def test_unsigned_access(self):
+        self.assertEqual(self.get(self.name).status_code, 404)
+        self.assertEqual(self.get(self.name, self.other).status_code, 404)
+        for user in (self.owner, self.doctor):
+            response = self.get(self.name, user)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.body(response), self.data)
+
+    def test_signatures(self):
+        url = default_storage.url(self.name)
+        self.assertEqual(self.body(self.client.get(url)), self.data)
+        expired = self.signed(self.name, int(time.time()) - 1)
+        self.assertEqual(self.get(self.name, query=expired).status_code, 404)
+        tampered = {**self.signed(self.name, int(time.time()) + 60), "expires": int(time.time()) + 3600}
+        self.assertEqual(self.get(self.name, query=tampered).status_code, 404)
+        # A signature is only good for the name it was made for.
+        other = default_storage.save("uploads/other.jpg", ContentFile(self.data))
+        self.assertEqual(self.get(other, query=self.signed(self.name, int(time.time()) + 60)).status_code, 404)
+
+    def test_names_outside_media_root(self):
+        with open(os.path.join(os.path.dirname(self.media_root), "secret.txt"), "w") as f:
+            self.addCleanup(os.remove, f.name)
+            f.write("secret")
+        staff = User.objects.create_user(username="staff", password="pass12345", is_staff=True)
+        for name in ("../secret.txt", "uploads/../../secret.txt"):
+            with self.subTest(name=name):
+                self.assertEqual(self.get(name, query=self.signed(name, int(time.time()) + 60)).status_code, 404)
+                self.assertEqual(self.get(name, staff).status_code, 404)
+
+    def test_ranges(self):
+        size = len(self.data)
+        response = self.get(self.name, self.owner, HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 0-9/{size}")
+        self.assertEqual(self.body(response), self.data[:10])
+
+        response = self.get(self.name, self.owner, HTTP_RANGE="bytes=-5")
+        self.assertEqual((response.status_code, response["Content-Range"]), (206, f"bytes {size - 5}-{size - 1}/{size}"))
+        self.assertEqual(self.body(response), self.data[-5:])
+
+        for header in (f"bytes={size}-", f"bytes={size + 10}-{size + 20}", "bytes=-0"):
+            with self.subTest(range=header):
+                response = self.get(self.name, self.owner, HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], f"bytes */{size}")
+
+        # Several ranges, or one we do not parse: the whole file.
+        for header in ("bytes=0-1,4-5", "bytes=a-b", "lines=1-2"):
+            with self.subTest(range=header):
+                self.assertEqual(self.get(self.name, self.owner, HTTP_RANGE=header).status_code, 200)
+
+
+class ChunkedUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username="patient", password="pass12345")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, data):
+        response = self.client.post("/api/uploads/", {
+            "filename": "mole.jpg", "size": len(data), "sha256": hashlib.sha256(data).hexdigest(),
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        session_id = response.json()["id"]
+        response = self.client.put(f"/api/uploads/{session_id}/chunk/?offset=0", data,
+                                   content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 200)
+        session = UploadSession.objects.get(id=session_id)
+        return session, os.path.join(self.media_root, session.partial_path)
+
+    def finalize(self, session):
+        return self.client.post(f"/api/uploads/{session.id}/finalize/")
+
+    def test_finalize_creates_upload_once(self):
+        session, partial = self.upload(jpeg_bytes())
+        response = self.finalize(session)
+        self.assertEqual(response.status_code, 201)
+        upload = ImageUpload.objects.get()
+        self.assertTrue(default_storage.exists(upload.image.name))
+        self.assertFalse(os.path.exists(partial))
+
+        # A retry after the first call finished gets the same image.
+        retry = self.finalize(session)
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json()["image"]["id"], upload.id)
+        self.assertEqual(ImageUpload.objects.count(), 1)
+
+    def test_concurrent_finalize_is_rejected(self):
+        session, partial = self.upload(jpeg_bytes())
+        # Another call has claimed the session and is still running.
+        UploadSession.objects.filter(id=session.id).update(status='finalizing')
+        response = self.finalize(session)
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(os.path.exists(partial))
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_invalid_image_fails_the_session(self):
+        session, partial = self.upload(b"not an image" * 100)
+        response = self.finalize(session)
+        self.assertEqual(response.status_code, 400)
+        session.refresh_from_db()
+        self.assertEqual(session.status, 'failed')
+        self.assertFalse(os.path.exists(partial))
+        self.assertEqual(self.finalize(session).status_code, 400)
+
+    def test_failed_save_reopens_the_session(self):
+        session, partial = self.upload(jpeg_bytes())
+        with mock.patch.object(ImageUpload, "save", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.finalize(session)
+        session.refresh_from_db()
+        self.assertEqual(session.status, 'open')
+        self.assertTrue(os.path.exists(partial))
+
+        self.assertEqual(self.finalize(session).status_code, 201)
+        self.assertEqual(ImageUpload.objects.count(), 1)
+
+
+@unittest.skipIf(export.pa is None, "pyarrow is not installed")
+class ExportDatasetTests(TestCase):
+    def setUp(self):
+        self.out = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.out, ignore_errors=True)
+        user = User.objects.create_user(username="patient", password="pass12345")
+        metadata = json.dumps({"age": 55, "gender": "male", "smoke": 1, "region": "FACE", "colour": "brown"})
+        months = [datetime(2025, 3, 5, tzinfo=timezone.utc)] * 2 + [datetime(2025, 4, 9, tzinfo=timezone.utc)]
+        for i, month in enumerate(months):
+            upload = ImageUpload.objects.create(user=user, image=f"uploads/{i}.jpg", metadata=metadata,
+                                                prediction="benign", probability=0.2, logit=-1.4)
+            ImageUpload.objects.filter(pk=upload.pk).update(uploaded_at=month)
+        Escalation.objects.create(patient=user, image=upload, reason="Itches")
+        Escalation.objects.filter(image=upload).update(submitted_at=months[-1])
+
+    def read(self, table):
+        import pyarrow.parquet as pq
+
+        parts = {}
+        for month in sorted(os.listdir(os.path.join(self.out, table))):
+            directory = os.path.join(self.out, table, month)
+            self.assertEqual(os.listdir(directory), ["part-0000.parquet"])
+            parts[month] = pq.read_table(os.path.join(directory, "part-0000.parquet"))
+        return parts
+
+    def test_parquet_partitions(self):
+        call_command("export_dataset", "--out", self.out, "--format", "parquet", "--batch-size", "1",
+                     stdout=io.StringIO())
+
+        uploads = self.read("uploads")
+        self.assertEqual({month: part.num_rows for month, part in uploads.items()},
+                         {"month=2025-03": 2, "month=2025-04": 1})
+        schema = uploads["month=2025-03"].schema
+        self.assertEqual(schema.names, [name for name, _ in export.UPLOAD_COLUMNS])
+        self.assertEqual(str(schema.field("uploaded_at").type), "timestamp[us, tz=UTC]")
+        self.assertEqual(str(schema.field("meta_smoke").type), "bool")
+        self.assertEqual(str(schema.field("meta_age").type), "double")
+        row = uploads["month=2025-04"].to_pylist()[0]
+        self.assertEqual((row["meta_age"], row["meta_smoke"], row["meta_region"]), (55.0, True, "FACE"))
+        self.assertEqual(json.loads(row["meta_extra"]), {"colour": "brown"})
+        self.assertEqual(row["escalation_status"], "unsure")
+
+        escalations = self.read("escalations")
+        self.assertEqual(list(escalations), ["month=2025-04"])
+        self.assertEqual(escalations["month=2025-04"].schema.names, [name for name, _ in export.ESCALATION_COLUMNS])
+        self.assertEqual(escalations["month=2025-04"].column("reason").to_pylist(), ["Itches"])
+
+
+class CommentAdminSearchTests(TestCase):
+    def setUp(self):
+        admin = User.objects.create_superuser(username="admin", password="pass12345")
+        self.client.force_login(admin)
+        author = User.objects.create_user(username="carol", password="pass12345")
+        self.sunscreen = Post.objects.create(user=author, content="Which sunscreen for freckles?")
+        other = Post.objects.create(user=author, content="Mole on my shoulder")
+        self.on_sunscreen = Comment.objects.create(post=self.sunscreen, user=author, comment="Thanks!")
+        self.mentions = Comment.objects.create(post=other, user=author, comment="Try a mineral sunscreen")
+        Comment.objects.create(post=other, user=author, comment="See a doctor")
+
+    def search(self, term):
+        response = self.client.get("/admin/api/comment/", {"q": term})
+        self.assertEqual(response.status_code, 200)
+        return {comment.id for comment in response.context["cl"].result_list}
+
+    def test_matches_comment_and_post_text(self):
+        self.assertEqual(self.search("sunscreen"), {self.on_sunscreen.id, self.mentions.id})
+        self.assertEqual(self.search("freckle"), {self.on_sunscreen.id})
+        self.assertEqual(self.search("carol"), set(Comment.objects.values_list("id", flat=True)))
+        self.assertEqual(self.search("tattoo"), set())
+
+    def test_str_reads_no_related_rows(self):
+        upload = ImageUpload.objects.create(user=self.sunscreen.user, image="uploads/x.jpg")
+        Escalation.objects.create(patient=self.sunscreen.user, image=upload)
+        comment, escalation = Comment.objects.get(id=self.mentions.id), Escalation.objects.get()
+        with self.assertNumQueries(0):
+            self.assertIn(f"by user {comment.user_id}", str(comment))
+            self.assertIn(f"by user {escalation.patient_id}", str(escalation))
+
+
+class EscalationAccessTests(TestCase):
+    def setUp(self):
+        caches["auth"].clear()
+        self.doctor = User.objects.create_user(username="drlee", password="pass12345")
+        self.doctor.profile.role = "doctor"
+        self.doctor.profile.save()
+        access = views.CustomTokenObtainPairSerializer.get_token(self.doctor).access_token
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+
+    def get(self, path):
+        return self.client.get(path, **self.headers).status_code
+
+    def test_demoted_doctor_loses_doctor_views(self):
+        # No such escalation: a doctor gets past the role check to the 404.
+        self.assertEqual(self.get("/api/escalations/999/heatmap/"), 404)
+        self.assertEqual(self.get("/api/escalations/999/similar/"), 404)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.profile.role = "patient"
+            self.doctor.profile.save()
+        # The token still says "doctor".
+        self.assertEqual(self.get("/api/escalations/999/heatmap/"), 403)
+        self.assertEqual(self.get("/api/escalations/999/similar/"), 403)
+
+    def test_heatmap_uses_the_scoring_version(self):
+        patient = User.objects.create_user(username="pat", password="pass12345")
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            name = default_storage.save("uploads/mole.jpg", io.BytesIO(jpeg_bytes()))
+            upload = ImageUpload.objects.create(user=patient, image=name, metadata=str({"age": 40}),
+                                                prediction="benign", probability=0.12, model_version="v3")
+            escalation = Escalation.objects.create(patient=patient, image=upload)
+            reply = mock.Mock(status_code=200)
+            reply.json.return_value = {"success": True, "heatmap": "data:image/png;base64,AA", "model_version": "v3"}
+            with mock.patch("requests.post", return_value=reply) as post:
+                response = self.client.get(f"/api/escalations/{escalation.id}/heatmap/", **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(post.call_args.args[0].rsplit("/", 1)[1], "explain")
+        self.assertEqual(post.call_args.kwargs["data"], {"metadata": '{"age": 40}', "model_version": "v3"})
+        self.assertEqual((response.json()["prediction"], response.json()["probability"]), ("benign", 0.12))
+
+    def test_auth_cache_holds_no_password_hash(self):
+        self.assertEqual(self.get("/api/escalations/"), 200)
+        entry = caches["auth"].get(user_key(self.doctor.id))
+        self.assertEqual(set(entry), {"id", "username", "is_active", "is_staff", "role", "password_digest"})
+        self.assertNotIn(self.doctor.password, entry.values())
+        self.assertEqual(entry["role"], "doctor")
+        with self.assertNumQueries(0):
+            user = cached_user(self.doctor.id)
+            self.assertEqual((user.id, user.username, user.profile.role), (self.doctor.id, "drlee", "doctor"))
+
+    # simplejwt's modules keep the api_settings object they imported.
+    @mock.patch.object(jwt_settings, "CHECK_REVOKE_TOKEN", True)
+    def test_password_change_revokes_tokens(self):
+        access = views.CustomTokenObtainPairSerializer.get_token(self.doctor).access_token
+        self.headers = {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+        self.assertEqual(self.get("/api/escalations/"), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.set_password("new-pass-456")
+            self.doctor.save()
+        self.assertEqual(self.get("/api/escalations/"), 401)
+
+    def test_deactivated_user_is_rejected(self):
+        self.assertEqual(self.get("/api/escalations/"), 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.is_active = False
+            self.doctor.save()
+        self.assertEqual(self.get("/api/escalations/"), 401)
+        self.assertEqual(self.get("/api/escalations/999/"), 401)
+
+
+async def read_async(chunks):
+    return b"".join([chunk async for chunk in chunks])
+
+
+def sse_events(response):
+    """(event, data) pairs of a server-sent event stream."""
+    if response.is_async:
+        # The async view (ASYNC_API_VIEWS) streams from an async generator.
+        content = async_to_sync(read_async)(response.streaming_content)
+    else:
+        content = b"".join(response.streaming_content)
+    events = []
+    for frame in content.decode().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines() if ": " in line)
+        if "event" in fields:
+            events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+
+@override_settings(CHAT_BACKEND="fake", CHAT_FAKE_DELAY=0, CHAT_HISTORY_TURNS=2, CHAT_HISTORY_CHARS=6000)
+class ChatTests(TestCase):
+    def setUp(self):
+        caches["chat"].clear()
+        self.alice = User.objects.create_user(username="alice", password="pass12345")
+        self.bob = User.objects.create_user(username="bob", password="pass12345")
+
+    def headers(self, user):
+        access = views.CustomTokenObtainPairSerializer.get_token(user).access_token
+        return {"HTTP_AUTHORIZATION": f"Bearer {access}"}
+
+    def stream(self, user, message):
+        response = self.client.post("/api/chat/", {"message": message}, content_type="application/json",
+                                    HTTP_ACCEPT="text/event-stream", **self.headers(user))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return sse_events(response)
+
+    def ask(self, user, message):
+        response = self.client.post("/api/chat/", {"message": message}, content_type="application/json",
+                                    **self.headers(user))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["message"]
+
+    def test_stream_sends_deltas_then_done(self):
+        events = self.stream(self.alice, "What is a mole?")
+        deltas = [data["text"] for event, data in events if event == "delta"]
+        self.assertGreater(len(deltas), 1)
+        self.assertEqual("".join(deltas), "You asked: What is a mole? (after 0 earlier turns). ")
+        self.assertEqual(events[-1], ("done", {"cached": False}))
+
+    def test_sync_view_streams_the_same_events(self):
+        request = APIRequestFactory().post("/api/chat/", {"message": "Hello"}, format="json",
+                                           HTTP_ACCEPT="text/event-stream")
+        force_authenticate(request, self.alice)
+        events = sse_events(views.chat(request))
+        self.assertEqual("".join(data["text"] for event, data in events if event == "delta"),
+                         "You asked: Hello (after 0 earlier turns). ")
+        self.assertEqual(events[-1][0], "done")
+
+    def test_old_turns_are_folded_into_the_summary(self):
+        for question in ("Is sunburn bad?", "What is SPF?", "How often to reapply?"):
+            self.ask(self.alice, question)
+        conversation = caches["chat"].get(history_key(self.alice.id))
+        self.assertEqual([question for question, _ in conversation["turns"]],
+                         ["What is SPF?", "How often to reapply?"])
+        self.assertEqual(conversation["summary"], "Is sunburn bad?")
+        # The summary goes into the next prompt, which the fake backend echoes.
+        answer = self.ask(self.alice, "Thanks")
+        self.assertIn("the user asked about: Is sunburn bad?", answer)
+        self.assertIn("(after 2 earlier turns)", answer)
+
+    def test_cached_answers_only_start_conversations(self):
+        first = self.ask(self.alice, "What is melanoma?")
+        events = self.stream(self.bob, "what is  MELANOMA")
+        self.assertEqual(events[-1], ("done", {"cached": True}))
+        self.assertEqual("".join(data["text"] for event, data in events if event == "delta"), first)
+
+        # Alice now has history, so the same question goes to the model.
+        events = self.stream(self.alice, "What is melanoma?")
+        self.assertEqual(events[-1], ("done", {"cached": False}))
+        self.assertIn("(after 1 earlier turns)", "".join(data["text"] for event, data in events if event == "delta"))
+
+    def test_delete_forgets_the_conversation(self):
+        self.ask(self.alice, "Is sunburn bad?")
+        self.ask(self.bob, "Is sunburn bad?")
+        response = self.client.delete("/api/chat/", **self.headers(self.alice))
+        self.assertEqual(response.status_code, 204)
+        self.assertIsNone(caches["chat"].get(history_key(self.alice.id)))
+        self.assertIsNotNone(caches["chat"].get(history_key(self.bob.id)))
+        self.assertIn("(after 0 earlier turns)", self.ask(self.alice, "Anything else?"))
@@ -0,0 +1,141 @@
+"""
+Lesion history: how each upload compares with the patient's earlier images
+of the same body region.
+
+With ``features`` set, /predict returns the upload's normalized backbone
+embedding and segmented lesion area. They are stored once in
+LesionFeatures together with the comparison against the closest earlier
+image of that region (by embedding), so a new upload costs one pass over
+the patient's cached embeddings and the timeline itself is a single query.
+"""
+import base64
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+
+from .authentication import is_doctor
+from .dedupe import parse_metadata
+from .models import ImageUpload, LesionFeatures
+
+UNKNOWN_REGIONS = ("", "-1", "none", "unknown", "nan")
+
+
+def region_of(metadata):
+    region = str(metadata.get("region", "")).strip().upper()
+    return None if region.lower() in UNKNOWN_REGIONS else region
+
+
+def decode_embedding(raw):
+    return np.frombuffer(raw, dtype="<f2").astype(np.float32)
+
+
+def record_features(upload, metadata, response_data):
+    """Store the model API's features for ``upload`` and compare them with the
+    patient's earlier images of the same region. Returns the LesionFeatures
+    row, or None if the response carried no features."""
+    encoded = response_data.get("embedding")
+    lesion_area = response_data.get("lesion_area")
+    if encoded:
+        embedding = base64.b64decode(encoded)
+    elif response_data.get("duplicate_of"):
+        # A re-upload answered from the stored prediction has the same pixels.
+        source = LesionFeatures.objects.filter(image_id=response_data["duplicate_of"]).first()
+        if source is None:
+            return None
+        embedding, lesion_area = bytes(source.embedding), source.lesion_area
+    else:
+        return None
+
+    region = region_of(metadata or {})
+    earlier = list(
+        LesionFeatures.objects.filter(user_id=upload.user_id, region=region, image_id__lt=upload.id)
+        .values_list("image_id", "embedding", "lesion_area")
+    )
+    previous_id = distance = area_change = None
+    if earlier:
+        history = np.stack([decode_embedding(raw) for _, raw, _ in earlier])
+        distances = 1.0 - history @ decode_embedding(embedding)
+        best = int(np.argmin(distances))
+        previous_id, distance = earlier[best][0], round(float(distances[best]), 4)
+        previous_area = earlier[best][2]
+        if previous_area and lesion_area is not None:
+            area_change = round((lesion_area - previous_area) / previous_area, 4)
+
+    features, _ = LesionFeatures.objects.update_or_create(
+        image=upload,
+        defaults={
+            "user_id": upload.user_id,
+            "region": region,
+            "embedding": embedding,
+            "lesion_area": lesion_area,
+            "previous_id": previous_id,
+            "embedding_distance": distance,
+            "area_change": area_change,
+        },
+    )
+    return features
+
+
+def detected_change(features):
+    if features is None or features.previous_id is None:
+        return None
+    if features.embedding_distance is not None and features.embedding_distance > settings.LESION_CHANGE_DISTANCE:
+        return True
+    return features.area_change is not None and abs(features.area_change) > settings.LESION_AREA_CHANGE
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def lesion_timeline(request):
+    """
+    The user's uploads grouped by body region, oldest first, each with its
+    change versus the closest earlier image of the region next to the
+    patient's own ``changed``/``grew`` answers. Doctors may pass
+    ``?patient=<user id>``; ``?region=`` limits the result to one region.
+    """
+    patient = request.user
+    if request.query_params.get("patient"):
+        if not is_doctor(request):
+            return Response({"error": "Only doctors can view other patients' timelines."}, status=403)
+        try:
+            patient = User.objects.get(id=request.query_params["patient"])
+        except (User.DoesNotExist, ValueError):
+            return Response({"error": "Patient not found"}, status=404)
+
+    wanted_region = request.query_params.get("region")
+    uploads = (
+        ImageUpload.objects.filter(user=patient)
+        .select_related('features')
+        .defer('features__embedding')
+        .order_by('uploaded_at', 'id')
+    )
+
+    regions = {}
+    for upload in uploads:
+        features = getattr(upload, 'features', None)
+        metadata = parse_metadata(upload.metadata)
+        region = features.region if features is not None else region_of(metadata)
+        if wanted_region and region != wanted_region.strip().upper():
+            continue
+        regions.setdefault(region, []).append({
+            "image_id": upload.id,
+            "image_url": request.build_absolute_uri(upload.image.url) if upload.image else None,
+            "uploaded_at": upload.uploaded_at,
+            "prediction": upload.prediction,
+            "probability": upload.probability,
+            "lesion_area": features.lesion_area if features else None,
+            "previous_image_id": features.previous_id if features else None,
+            "embedding_distance": features.embedding_distance if features else None,
+            "area_change": features.area_change if features else None,
+            "detected_change": detected_change(features),
+            "reported": {"changed": metadata.get("changed"), "grew": metadata.get("grew")},
+        })
+
+    return Response({
+        "patient": patient.username,
+        "regions": [{"region": region, "images": images} for region, images in regions.items()],
+    }, status=200)
@@ -1,19 +1,33 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, chunked_upload, timeline, views
+
+# Under ASGI the async views keep the worker free while they wait on the
+# model service and Gemini.
+io_views = async_views if settings.ASYNC_API_VIEWS else views
 
 urlpatterns = [
     path('signup/', views.signup_view),
     path('login/', views.login_view),
     path('logout/', views.logout_view),
-    path('chat/', views.chat),
+    path('chat/', io_views.chat),
     path('post/', views.create_post),
     path('comment/', views.add_comment),
-    path('upload/', views.upload_image),
-    path('escalate/', views.escalate_image),
+    path('upload/', io_views.upload_image),
+    path('uploads/', chunked_upload.init_upload),
+    path('uploads/<uuid:session_id>/', chunked_upload.upload_status),
+    path('uploads/<uuid:session_id>/chunk/', chunked_upload.upload_chunk),
+    path('uploads/<uuid:session_id>/finalize/', chunked_upload.finalize_upload),
+    path('escalate/', io_views.escalate_image),
     path('hello/', views.hello),
+    # Long-lived stream; needs ASGI, where it costs no thread while idle.
+    path('events/', async_views.event_stream),
     path("posts/", views.list_posts),
     path("posts/<int:post_id>/", views.get_post_details),
     path("user/",views.user_profile),
+    path('timeline/', timeline.lesion_timeline, name='lesion_timeline'),
     path('escalations/', views.list_escalations, name='list_escalations'),
     path('escalations/<int:escalation_id>/', views.get_escalation_detail, name='get_escalation_detail'),
+    path('escalations/<int:escalation_id>/heatmap/', views.get_escalation_heatmap, name='get_escalation_heatmap'),
+    path('escalations/<int:escalation_id>/similar/', views.get_similar_cases, name='get_similar_cases'),
 ]
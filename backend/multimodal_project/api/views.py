@@ -1,20 +1,28 @@
 import json
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, renderer_classes
 from rest_framework.response import Response
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework import status, permissions
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout
+from django.db.models import Q
 from .models import Post, ImageUpload
 from .serializers import EscalationDetailSerializer, PostSerializer, CommentSerializer, ImageUploadSerializer,UserSerializer
 from .gemini_api import get_gemini_response
+from .dedupe import ImageHashes, duplicate_report, open_escalations, parse_metadata, reused_prediction
+from .timeline import record_features
+from .storage import open_original
+from .authentication import ROLE_CLAIM, StatelessJWTAuthentication, cached_user, is_doctor
+from . import events
+from .chat import ChatReply, EventStreamRenderer, forget_conversation, wants_stream
 from rest_framework.permissions import IsAuthenticated
 from .models import Escalation
 from .serializers import EscalationSerializer
 from .serializers import PostSerializer, CommentSerializer
 import logging
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
 
 logger = logging.getLogger(__name__)
 
@@ -67,7 +75,7 @@ def login_view(request):
     user = authenticate(request, username=username, password=password)
     if user is not None:
         login(request, user)
-        refresh = RefreshToken.for_user(user)
+        refresh = CustomTokenObtainPairSerializer.get_token(user)
         role = user.profile.role
         print(role)
         return Response({
@@ -119,13 +127,14 @@ def upload_image(request):
             logger.error(f"Validation errors: {serializer.errors}")
             return Response(serializer.errors, status=400)
 
+        # Hash before saving so a duplicate is linked on insert.
+        hashes = ImageHashes.from_file(request.FILES["image"])
+        duplicate, duplicates = duplicate_report(request.user, hashes, ImageUpload.objects.all())
+
         # Save uploaded image
-        instance = serializer.save(user=request.user)
+        instance = serializer.save(user=request.user, duplicate_of_id=duplicates["duplicate_of"], **hashes.fields())
         logger.info(f"Upload successful: {instance.image.name}")
 
-        image_path = instance.image.path
-        logger.info(f"Local image path: {image_path}")
-
         # Parse metadata
         metadata_raw = request.data.get("metadata")
         try:
@@ -139,26 +148,49 @@ def upload_image(request):
             instance.metadata = metadata
             instance.save(update_fields=["metadata"])
 
+        # The user's own byte-identical upload already has a prediction.
+        response_data = None
+        if duplicate and duplicate.exact and duplicate.user_id == request.user.id:
+            response_data = reused_prediction(ImageUpload.objects.get(id=duplicate.upload_id), metadata)
+
         # Send image + metadata to model API
-        try:
-            with open(image_path, "rb") as f:
+        if response_data is None:
+            try:
+                # Send the request's copy rather than reading it back from storage.
+                image = request.FILES["image"]
+                image.seek(0)
                 response = requests.post(
-                    "http://127.0.0.1:8080/predict",
-                    files={"image": f},
-                    data={"metadata": json.dumps(metadata)},
+                    f"{settings.MODEL_API_URL}/predict",
+                    files={"image": (image.name, image, image.content_type)},
+                    data={"metadata": json.dumps(metadata), "case_id": instance.id, "features": "true"},
                     timeout=60
                 )
-            response_data = response.json() if response.status_code == 200 else {"error": response.text}
-        except Exception as e:
-            logger.error(f"Prediction API call failed: {e}")
-            response_data = {"error": f"Prediction API call failed: {str(e)}"}
+                response_data = response.json() if response.status_code == 200 else {"error": response.text}
+            except Exception as e:
+                logger.error(f"Prediction API call failed: {e}")
+                response_data = {"error": f"Prediction API call failed: {str(e)}"}
+
+        if response_data.get("success"):
+            instance.logit = response_data.get("logit")
+            instance.probability = response_data.get("probability")
+            instance.prediction = response_data.get("prediction")
+            instance.confidence_level = response_data.get("confidence_level")
+            instance.model_version = response_data.get("model_version")
+            instance.save(update_fields=["logit", "probability", "prediction", "confidence_level", "model_version"])
+            events.publish_prediction(instance)
+            try:
+                record_features(instance, metadata, response_data)
+            except Exception as e:
+                logger.error(f"Lesion feature tracking failed: {e}")
 
         # Try to get simplified explanation via Gemini
+        xai_response = ""
         try:
             prompt = (
                 f"Explain this in very simple terms for a layperson in just one line and dont address as computer or system just start with 'The Results indicate that': {response_data}"
             )
-            xai_response = get_gemini_response(prompt)
+            if settings.GEMINI_EXPLANATIONS:
+                xai_response = get_gemini_response(prompt)
         except Exception as e:
             logger.error(f"Gemini explanation failed: {e}")
             xai_response = ""
@@ -168,6 +200,7 @@ def upload_image(request):
             "image": serializer.data,
             "metadata": metadata,
             "prediction": response_data,
+            "duplicates": duplicates,
             "xai": xai_response or ""
         }, status=201)
 
@@ -188,14 +221,24 @@ def upload_image(request):
 
 
 
-@api_view(['POST'])
+@api_view(['POST', 'DELETE'])
+@authentication_classes([StatelessJWTAuthentication])
 @permission_classes([permissions.AllowAny])
+@renderer_classes([JSONRenderer, BrowsableAPIRenderer, EventStreamRenderer])
 def chat(request):
-    val = request.data.get("message", "")
-    response = get_gemini_response(
-        f"You are a chatbot. you dont show the user that you are a chatbot. Try to keep the convo crisp and minmized. If unrelated to medicine, respond generically. Else, give a medical response: {val}"
-    )
-    return Response({"message": response})
+    # Anonymous chat is allowed; it just has no memory.
+    user_id = request.user.id if request.user.is_authenticated else None
+    if request.method == 'DELETE':
+        forget_conversation(user_id)
+        return Response(status=204)
+
+    message = str(request.data.get("message", "")).strip()
+    if not message:
+        return Response({"error": "message is required"}, status=400)
+    reply = ChatReply.start(user_id, message)
+    if wants_stream(request):
+        return events.sse_response(reply.sse())
+    return Response({"message": reply.text()})
 
 
 @api_view(['POST'])
@@ -216,6 +259,14 @@ def escalate_image(request):
         except Exception:
             reason = "No notes provided"
 
+    existing = open_escalations(request.user, image).first()
+    if existing is not None:
+        return Response({
+            "message": "This image is already escalated.",
+            "id": existing.id,
+            "reason": existing.reason,
+        }, status=200)
+
     escalation = Escalation.objects.create(
         patient=request.user,
         image=image,
@@ -232,6 +283,7 @@ def escalate_image(request):
 
 
 @api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
 def list_posts(request):
     posts = Post.objects.all().order_by('-created_at')
     data = []
@@ -271,11 +323,13 @@ def post_detail(request, pk):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_profile(request):
-    serializer = UserSerializer(request.user)
+    # request.user only carries the fields authentication needs.
+    serializer = UserSerializer(User.objects.get(pk=request.user.pk))
     return Response(serializer.data)
 
 
 @api_view(['GET'])
+@authentication_classes([StatelessJWTAuthentication])
 @permission_classes([permissions.AllowAny])
 def get_post_details(request, post_id):
     try:
@@ -297,7 +351,9 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
-        token['role'] = user.profile.role
+        # Read by permission checks and TokenUser (api/authentication.py).
+        token[ROLE_CLAIM] = user.profile.role
+        token['username'] = user.username
         return token
 
     def validate(self, attrs):
@@ -310,6 +366,23 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        # The new access token copies the refresh token's claims; give it
+        # the current role instead, so role changes reach the claim here.
+        data = super().validate(attrs)
+        access = AccessToken(data['access'])
+        user = cached_user(access['user_id'])
+        if user is not None:
+            access[ROLE_CLAIM] = user.profile.role
+            data['access'] = str(access)
+        return data
+
+
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = CustomTokenRefreshSerializer
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_escalations(request):
@@ -334,3 +407,119 @@ def get_escalation_detail(request, escalation_id):
 
     serializer = EscalationDetailSerializer(escalation, context={'request': request})
     return Response(serializer.data, status=200)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_escalation_heatmap(request, escalation_id):
+    """
+    Grad-CAM heatmap for an escalated image, from the model version that
+    scored it. Doctors only; the model API's /explain caches heatmaps per
+    image and version, so repeated views do not run the model.
+    """
+    import requests
+    from django.conf import settings
+
+    if not is_doctor(request):
+        return Response({"error": "Only doctors can view heatmaps."}, status=403)
+
+    try:
+        escalation = Escalation.objects.select_related('image').get(id=escalation_id)
+    except Escalation.DoesNotExist:
+        return Response({"error": "Escalation not found"}, status=404)
+
+    image = escalation.image
+    try:
+        with open_original(image) as f:
+            response = requests.post(
+                f"{settings.MODEL_API_URL}/explain",
+                files={"image": f},
+                data={"metadata": json.dumps(parse_metadata(image.metadata)),
+                      "model_version": image.model_version or ""},
+                timeout=60
+            )
+        response_data = response.json() if response.status_code == 200 else {"error": response.text}
+    except Exception as e:
+        logger.error(f"Heatmap API call failed: {e}")
+        return Response({"error": f"Explain API call failed: {str(e)}"}, status=502)
+
+    if not response_data.get("heatmap"):
+        return Response({"error": response_data.get("error") or "Heatmaps are not enabled on the model API"},
+                        status=503)
+
+    return Response({
+        "escalation_id": escalation.id,
+        "heatmap": response_data["heatmap"],
+        "prediction": image.prediction,
+        "probability": image.probability,
+        "model_version": response_data.get("model_version")
+    }, status=200)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_similar_cases(request, escalation_id):
+    """
+    Diagnosed escalations whose images look most like this one, from the
+    model API's embedding index. Doctors only; ``?k=`` sets how many (max 20).
+    """
+    import requests
+    from django.conf import settings
+
+    if not is_doctor(request):
+        return Response({"error": "Only doctors can view similar cases."}, status=403)
+
+    try:
+        escalation = Escalation.objects.select_related('image').get(id=escalation_id)
+    except Escalation.DoesNotExist:
+        return Response({"error": "Escalation not found"}, status=404)
+
+    try:
+        k = min(max(int(request.query_params.get("k", 5)), 1), 20)
+    except ValueError:
+        k = 5
+
+    # Copies of the same photo would otherwise be the closest matches.
+    image = escalation.image
+    root = image.duplicate_of_id or image.id
+    copies = ImageUpload.objects.filter(Q(id=root) | Q(duplicate_of_id=root)).values_list("id", flat=True)
+
+    try:
+        with open_original(image) as f:
+            response = requests.post(
+                f"{settings.MODEL_API_URL}/similar",
+                files={"image": f},
+                # Most neighbours are undiagnosed uploads, so ask for more
+                # than k and keep the diagnosed ones.
+                data={"case_id": image.id, "k": k * 20, "exclude": ",".join(map(str, copies))},
+                timeout=60
+            )
+        response_data = response.json() if response.status_code == 200 else {"error": response.text}
+    except Exception as e:
+        logger.error(f"Similar-case API call failed: {e}")
+        return Response({"error": f"Similarity API call failed: {str(e)}"}, status=502)
+
+    if not response_data.get("success"):
+        return Response({"error": response_data.get("error", "Similar-case search failed")}, status=503)
+
+    similarity = {neighbor["case_id"]: neighbor["similarity"] for neighbor in response_data["neighbors"]}
+    diagnosed = {}
+    for case in (Escalation.objects.select_related('image')
+                 .filter(image_id__in=similarity, status__in=Escalation.LABELED_STATUSES)
+                 .order_by('labeled_at')):
+        diagnosed[case.image_id] = case  # latest diagnosis per image wins
+
+    cases = sorted(diagnosed.values(), key=lambda case: -similarity[case.image_id])[:k]
+    return Response({
+        "escalation_id": escalation.id,
+        "similar": [{
+            "escalation_id": case.id,
+            "image_id": case.image_id,
+            "image_url": request.build_absolute_uri(case.image.image.url),
+            "status": case.status,
+            "similarity": similarity[case.image_id],
+            "labeled_at": case.labeled_at,
+            "prediction": case.image.prediction,
+        } for case in cases],
+        "search_ms": response_data.get("search_ms")
+    }, status=200)
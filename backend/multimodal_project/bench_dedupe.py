@@ -0,0 +1,110 @@
+"""
+Duplicate lookup latency at scale.
+
+Fills a scratch database with ``--rows`` uploads carrying random perceptual
+hashes, plants near duplicates of the query hashes at known distances, then
+times api.dedupe.find_duplicates (the band-index query used at upload)
+against a brute-force Hamming scan over all hashes held in memory:
+
+    SQLITE_PATH=/tmp/dedupe-bench.sqlite3 python bench_dedupe.py --rows 1000000
+
+The database is created and migrated if needed and reused on later runs.
+Random hashes spread evenly over the bands; real pHashes cluster, so
+expect more candidates per query on production data.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "multimodal_project.settings")
+
+
+def percentiles(samples):
+    samples = np.sort(np.asarray(samples) * 1000)
+    return {"p50_ms": round(float(np.percentile(samples, 50)), 3),
+            "p99_ms": round(float(np.percentile(samples, 99)), 3)}
+
+
+def popcount64(values):
+    """Bit counts of a uint64 array."""
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate lookup")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--max-distance", type=int, default=6)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if "SQLITE_PATH" not in os.environ and os.getenv("DATABASE_ENGINE", "sqlite") == "sqlite":
+        parser.error("set SQLITE_PATH to a scratch database; the benchmark inserts --rows uploads")
+
+    import django
+    from django.core.management import call_command
+
+    django.setup()
+    call_command("migrate", verbosity=0)
+
+    from django.contrib.auth.models import User
+    from api.dedupe import ImageHashes, find_duplicates
+    from api.models import ImageUpload
+
+    rng = np.random.default_rng(args.seed)
+    user, _ = User.objects.get_or_create(username="dedupe-bench")
+    queries = rng.integers(0, 2**63, size=args.queries, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+    existing = ImageUpload.objects.filter(user=user).count()
+    if existing < args.rows:
+        start = time.perf_counter()
+        hashes = rng.integers(0, 2**63, size=args.rows - existing, dtype=np.uint64) * np.uint64(2)
+        # Every other query gets a planted copy 1..max_distance bits away.
+        for i in range(0, min(args.queries, len(hashes)), 2):
+            flips = rng.choice(64, size=rng.integers(1, args.max_distance + 1), replace=False)
+            hashes[i] = queries[i] ^ np.bitwise_or.reduce(np.uint64(1) << flips.astype(np.uint64))
+        for offset in range(0, len(hashes), args.batch_size):
+            batch = []
+            for value in hashes[offset:offset + args.batch_size]:
+                fields = ImageHashes(f"{int(value):064x}", int(value)).fields()
+                batch.append(ImageUpload(user=user, image="uploads/dedupe-bench/bench.jpg", **fields))
+            ImageUpload.objects.bulk_create(batch)
+        print(f"inserted {len(hashes)} rows in {time.perf_counter() - start:.1f}s")
+
+    # Uploads share one user here, so scoping the query to it would make the
+    # user_id index look selective; production queries span all users.
+    queryset = ImageUpload.objects.all()
+    in_memory = np.fromiter(
+        (value & (2**64 - 1) for value in queryset.values_list("phash", flat=True).iterator(chunk_size=50_000)),
+        dtype=np.uint64,
+    )
+
+    index_times, scan_times, found_index, found_scan = [], [], 0, 0
+    for query in queries:
+        hashes = ImageHashes("-", int(query))
+
+        start = time.perf_counter()
+        matches = find_duplicates(hashes, queryset, max_distance=args.max_distance)
+        index_times.append(time.perf_counter() - start)
+        found_index += bool(matches)
+
+        start = time.perf_counter()
+        hits = np.flatnonzero(popcount64(in_memory ^ query) <= args.max_distance)
+        scan_times.append(time.perf_counter() - start)
+        found_scan += bool(len(hits))
+
+    print(json.dumps({
+        "rows": len(in_memory),
+        "queries": len(queries),
+        "max_distance": args.max_distance,
+        "band_index": {**percentiles(index_times), "queries_with_match": found_index},
+        "brute_force_scan": {**percentiles(scan_times), "queries_with_match": found_scan},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
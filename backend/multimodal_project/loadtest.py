@@ -0,0 +1,281 @@
+"""
+Concurrent upload/feed load test for the Django API.
+
+Start a stand-in for the model service that answers /predict after a fixed
+delay, then the API in the deployment to measure, then the client:
+
+    python loadtest.py stub-model --port 8080 --latency 0.5
+    ASYNC_API_VIEWS=off GEMINI_EXPLANATIONS=off python manage.py runserver 8000            # WSGI, sync views
+    ASYNC_API_VIEWS=on GEMINI_EXPLANATIONS=off uvicorn multimodal_project.asgi:application --port 8000
+    python loadtest.py run --base-url http://127.0.0.1:8000 --username demo --password ... \\
+        --concurrency 200 --requests 1000 --feed-ratio 0.5
+
+With --feed-ratio a share of the requests read the community feed
+(GET /api/posts/) instead of uploading, so database reads run alongside
+the upload writes. Compare database settings (DATABASE_ENGINE, SQLite
+journal mode) with the same mix.
+
+Reports requests/sec, latency percentiles and errors, overall and per
+endpoint. Every upload creates an ImageUpload, so point it at a scratch
+database.
+
+The ``events`` command holds --connections server-sent event streams open
+(GET /api/events/) for one user, uploads --requests images, and reports how
+many streams each worker process accepted, how many prediction events
+reached every stream, and the spread between the first and last stream
+receiving each event:
+
+    EVENT_MAX_CONNECTIONS_PER_USER=5000 uvicorn multimodal_project.asgi:application --port 8000 --workers 2
+    python loadtest.py events --base-url http://127.0.0.1:8000 --username demo --password ... \
+        --connections 1000 --requests 50
+"""
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+from collections import Counter, defaultdict
+
+import httpx
+
+
+def stub_app(latency):
+    """Minimal ASGI app standing in for ml/inference_api.py /predict."""
+    body = json.dumps({
+        "success": True,
+        "prediction": "Benign",
+        "probability": 0.2,
+        "logit": -1.386294,
+        "confidence_level": "high",
+        "model_version": "stub",
+    }).encode()
+
+    async def app(scope, receive, send):
+        if scope["type"] != "http":
+            return
+        more_body = True
+        while more_body:
+            message = await receive()
+            more_body = message.get("more_body", False)
+        await asyncio.sleep(latency)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+
+def test_image():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (224, 224), (180, 120, 100)).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+async def access_token(client, args):
+    if args.token:
+        return args.token
+    response = await client.post("/api/token/", json={"username": args.username, "password": args.password})
+    response.raise_for_status()
+    return response.json()["access"]
+
+
+def percentile(samples, q):
+    samples = sorted(samples)
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 1) if samples else None
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        headers = {"Authorization": f"Bearer {await access_token(client, args)}"}
+        image = test_image()
+        metadata = json.dumps({"age": 45, "smoke": 0, "itch": 1})
+
+        async def upload():
+            response = await client.post(
+                "/api/upload/", headers=headers,
+                files={"image": ("load.jpg", image, "image/jpeg")}, data={"metadata": metadata},
+            )
+            return response.status_code == 201
+
+        async def feed():
+            response = await client.get("/api/posts/", headers=headers)
+            return response.status_code == 200
+
+        rng = random.Random(args.seed)
+        queue = asyncio.Queue()
+        for _ in range(args.requests):
+            queue.put_nowait("feed" if rng.random() < args.feed_ratio else "upload")
+        requests = {"upload": upload, "feed": feed}
+        latencies = {name: [] for name in requests}
+        errors = {name: 0 for name in requests}
+
+        async def worker():
+            while True:
+                try:
+                    name = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                try:
+                    ok = await requests[name]()
+                except httpx.HTTPError:
+                    ok = False
+                latencies[name].append(time.perf_counter() - start)
+                errors[name] += not ok
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    def stats(samples, error_count):
+        return {
+            "requests": len(samples),
+            "requests_per_sec": round(len(samples) / elapsed, 2),
+            "p50_ms": percentile(samples, 0.5),
+            "p99_ms": percentile(samples, 0.99),
+            "errors": error_count,
+        }
+
+    report = {
+        "concurrency": args.concurrency,
+        "seconds": round(elapsed, 2),
+        **stats([t for samples in latencies.values() for t in samples], sum(errors.values())),
+    }
+    for name in requests:
+        if latencies[name]:
+            report[name] = stats(latencies[name], errors[name])
+    return report
+
+
+async def run_events(args):
+    limits = httpx.Limits(max_connections=args.connections + args.concurrency)
+    timeout = httpx.Timeout(args.timeout, read=None)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=timeout, limits=limits) as client:
+        headers = {"Authorization": f"Bearer {await access_token(client, args)}"}
+        workers = Counter()
+        rejected = Counter()
+        received = defaultdict(list)  # image id -> receipt times, one per stream
+        settled = 0
+        all_settled = asyncio.Event()
+
+        def settle():
+            nonlocal settled
+            settled += 1
+            if settled == args.connections:
+                all_settled.set()
+
+        async def listen():
+            try:
+                async with client.stream("GET", "/api/events/", headers=headers) as response:
+                    if response.status_code != 200:
+                        rejected[response.status_code] += 1
+                        settle()
+                        return
+                    event = None
+                    async for line in response.aiter_lines():
+                        if line.startswith("event: "):
+                            event = line[7:]
+                        elif line.startswith("data: "):
+                            data = json.loads(line[6:])
+                            if event == "ready":
+                                workers[data["worker"]] += 1
+                                settle()
+                            elif event == "prediction":
+                                received[data["image_id"]].append(time.perf_counter())
+            except httpx.HTTPError as e:
+                rejected[type(e).__name__] += 1
+                settle()
+
+        start = time.perf_counter()
+        listeners = [asyncio.create_task(listen()) for _ in range(args.connections)]
+        await asyncio.wait_for(all_settled.wait(), args.timeout)
+        connect_seconds = time.perf_counter() - start
+
+        image = test_image()
+        image_ids, upload_times = [], []
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def upload(i):
+            async with semaphore:
+                begin = time.perf_counter()
+                # Distinct metadata per upload so none reuses a stored prediction.
+                response = await client.post(
+                    "/api/upload/", headers=headers,
+                    files={"image": ("load.jpg", image, "image/jpeg")}, data={"metadata": json.dumps({"age": i})},
+                )
+                upload_times.append(time.perf_counter() - begin)
+                if response.status_code == 201:
+                    image_ids.append(response.json()["image"]["id"])
+
+        await asyncio.gather(*(upload(i) for i in range(args.requests)))
+        streams = sum(workers.values())
+        deadline = time.perf_counter() + args.drain
+        while time.perf_counter() < deadline and any(len(received[i]) < streams for i in image_ids):
+            await asyncio.sleep(0.05)
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+
+    spreads = [max(received[i]) - min(received[i]) for i in image_ids if received[i]]
+    return {
+        "connections": args.connections,
+        "open_streams": streams,
+        "streams_per_worker": {str(pid): count for pid, count in sorted(workers.items())},
+        "rejected": dict(rejected),
+        "connect_seconds": round(connect_seconds, 2),
+        "uploads": len(image_ids),
+        "upload_p50_ms": percentile(upload_times, 0.5),
+        "events_expected": len(image_ids) * streams,
+        "events_delivered": sum(len(received[i]) for i in image_ids),
+        "fanout_spread_p50_ms": percentile(spreads, 0.5),
+        "fanout_spread_p99_ms": percentile(spreads, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the upload and event stream endpoints")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stub = subparsers.add_parser("stub-model", help="Serve a fixed-latency stand-in for the model API")
+    stub.add_argument("--port", type=int, default=8080)
+    stub.add_argument("--latency", type=float, default=0.5, help="Seconds per /predict")
+
+    client = subparsers.add_parser("run", help="Fire concurrent uploads and feed reads")
+    client.add_argument("--base-url", default="http://127.0.0.1:8000")
+    client.add_argument("--token", help="JWT access token; otherwise --username/--password")
+    client.add_argument("--username")
+    client.add_argument("--password")
+    client.add_argument("--concurrency", type=int, default=100)
+    client.add_argument("--requests", type=int, default=500)
+    client.add_argument("--timeout", type=float, default=120)
+    client.add_argument("--feed-ratio", type=float, default=0.0, help="Share of requests that read the feed")
+    client.add_argument("--seed", type=int, default=0)
+
+    streams = subparsers.add_parser("events", help="Hold event streams open while uploading")
+    streams.add_argument("--base-url", default="http://127.0.0.1:8000")
+    streams.add_argument("--token", help="JWT access token; otherwise --username/--password")
+    streams.add_argument("--username")
+    streams.add_argument("--password")
+    streams.add_argument("--connections", type=int, default=500)
+    streams.add_argument("--requests", type=int, default=20, help="Uploads, each published to every stream")
+    streams.add_argument("--concurrency", type=int, default=4, help="Uploads in flight")
+    streams.add_argument("--timeout", type=float, default=120)
+    streams.add_argument("--drain", type=float, default=10, help="Seconds to wait for late events")
+
+    args = parser.parse_args()
+    if args.command == "stub-model":
+        import uvicorn
+
+        uvicorn.run(stub_app(args.latency), host="127.0.0.1", port=args.port, log_level="warning")
+    elif args.command == "events":
+        print(json.dumps(asyncio.run(run_events(args)), indent=2))
+    else:
+        print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
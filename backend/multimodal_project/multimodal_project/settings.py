@@ -14,6 +14,8 @@ from pathlib import Path
 import os
 from datetime import timedelta
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -32,11 +34,147 @@ ALLOWED_HOSTS = ['*']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Media storage (api/storage.py): "default" is the hot tier the app serves,
+# "cold" holds gzipped originals moved there by `manage.py tier_media`.
+# MEDIA_STORAGE=s3 keeps both in an S3-compatible bucket (django-storages);
+# AWS_S3_ENDPOINT_URL points it at MinIO or moto_server locally.
+MEDIA_STORAGE = os.getenv("MEDIA_STORAGE", "local")
+COLD_MEDIA_ROOT = os.getenv("COLD_MEDIA_ROOT", os.path.join(BASE_DIR, 'media-cold'))
+# Long side in pixels of the preview kept hot for a cold original.
+MEDIA_PREVIEW_SIZE = int(os.getenv("MEDIA_PREVIEW_SIZE", "1024"))
+
+if MEDIA_STORAGE == "local":
+    MEDIA_STORAGES = {
+        "default": {"BACKEND": "api.storage.SignedFileSystemStorage"},
+        "cold": {
+            "BACKEND": "django.core.files.storage.FileSystemStorage",
+            "OPTIONS": {"location": COLD_MEDIA_ROOT, "base_url": None},
+        },
+    }
+elif MEDIA_STORAGE == "s3":
+    S3_OPTIONS = {
+        "bucket_name": os.getenv("MEDIA_S3_BUCKET", "skin-cancer-media"),
+        "endpoint_url": os.getenv("AWS_S3_ENDPOINT_URL") or None,
+        "region_name": os.getenv("AWS_S3_REGION_NAME") or None,
+        "access_key": os.getenv("AWS_ACCESS_KEY_ID"),
+        "secret_key": os.getenv("AWS_SECRET_ACCESS_KEY"),
+        "default_acl": None,
+        "file_overwrite": False,
+    }
+    MEDIA_STORAGES = {
+        "default": {"BACKEND": "storages.backends.s3.S3Storage", "OPTIONS": {**S3_OPTIONS, "location": "media"}},
+        "cold": {
+            "BACKEND": "storages.backends.s3.S3Storage",
+            "OPTIONS": {
+                **S3_OPTIONS,
+                "location": "cold",
+                "object_parameters": {"StorageClass": os.getenv("MEDIA_S3_COLD_CLASS", "STANDARD_IA")},
+            },
+        },
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown MEDIA_STORAGE {MEDIA_STORAGE!r}; use 'local' or 's3'")
+
+# Signed /media/ URLs (api/media.py) stay valid for one to two periods of
+# this many seconds.
+MEDIA_URL_TTL = int(os.getenv("MEDIA_URL_TTL", "21600"))
+# Who sends /media/ files once authorized: "django" (Python; sendfile under
+# gunicorn), "x-accel" (nginx, internal location MEDIA_ACCEL_PREFIX) or
+# "x-sendfile" (Apache/lighttpd).
+MEDIA_SERVE = os.getenv("MEDIA_SERVE", "django")
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-media/")
+if MEDIA_SERVE not in ("django", "x-accel", "x-sendfile"):
+    raise ImproperlyConfigured(f"Unknown MEDIA_SERVE {MEDIA_SERVE!r}; use 'django', 'x-accel' or 'x-sendfile'")
+
+STORAGES = {
+    **MEDIA_STORAGES,
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
+
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 
-# If using gunicorn/uwsgi, increase timeout
-CONN_MAX_AGE = 60
+# Resumable uploads (api/chunked_upload.py). Chunks are streamed to disk in
+# READ_SIZE pieces; CHUNK_SIZE is the size suggested to clients.
+CHUNKED_UPLOAD_MAX_SIZE = int(os.getenv("CHUNKED_UPLOAD_MAX_SIZE", str(50 * 1024 * 1024)))
+CHUNKED_UPLOAD_CHUNK_SIZE = int(os.getenv("CHUNKED_UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+CHUNKED_UPLOAD_READ_SIZE = 64 * 1024
+
+# Uploads whose perceptual hashes differ in at most this many of 64 bits are
+# flagged as near duplicates (api/dedupe.py).
+DUPLICATE_MAX_DISTANCE = int(os.getenv("DUPLICATE_MAX_DISTANCE", "6"))
+
+# Lesion timeline (api/timeline.py): an image counts as changed when its
+# embedding cosine distance to the previous image of the region, or the
+# relative change in segmented area, exceeds these.
+LESION_CHANGE_DISTANCE = float(os.getenv("LESION_CHANGE_DISTANCE", "0.15"))
+LESION_AREA_CHANGE = float(os.getenv("LESION_AREA_CHANGE", "0.2"))
+
+# Model inference service (ml/inference_api.py)
+MODEL_API_URL = os.getenv("MODEL_API_URL", "http://127.0.0.1:8080")
+# Background threads sending finalized chunked uploads to the model API.
+PREDICTION_WORKERS = int(os.getenv("PREDICTION_WORKERS", "4"))
+
+# One-line Gemini summary of each prediction in the upload response; costs a
+# Gemini round trip per upload.
+GEMINI_EXPLANATIONS = os.getenv("GEMINI_EXPLANATIONS", "on") == "on"
+
+# Serve upload/chat/escalate with the async views in api/async_views.py.
+# Deploy under ASGI to benefit: uvicorn multimodal_project.asgi:application
+ASYNC_API_VIEWS = os.getenv("ASYNC_API_VIEWS", "on") == "on"
+
+# Chat (api/chat.py). CHAT_BACKEND=fake answers locally without Gemini.
+CHAT_BACKEND = os.getenv("CHAT_BACKEND", "gemini")
+CHAT_MAX_OUTPUT_TOKENS = int(os.getenv("CHAT_MAX_OUTPUT_TOKENS", "1024"))
+CHAT_FAKE_DELAY = float(os.getenv("CHAT_FAKE_DELAY", "0.02"))  # seconds per word
+# Per-user history sent with each message: the last TURNS turns within
+# CHARS characters, answers cut to ANSWER_MEMORY_CHARS; older turns are
+# summarized in at most SUMMARY_CHARS.
+CHAT_HISTORY_TURNS = int(os.getenv("CHAT_HISTORY_TURNS", "10"))
+CHAT_HISTORY_CHARS = int(os.getenv("CHAT_HISTORY_CHARS", "6000"))
+CHAT_ANSWER_MEMORY_CHARS = 1000
+CHAT_SUMMARY_CHARS = 500
+CHAT_HISTORY_TTL = int(os.getenv("CHAT_HISTORY_TTL", "3600"))  # seconds since the last message
+CHAT_ANSWER_TTL = int(os.getenv("CHAT_ANSWER_TTL", "86400"))
+
+# The "chat" cache holds conversations and cached answers. Local memory is
+# per process; point CHAT_CACHE_BACKEND/LOCATION at Redis or memcached to
+# share conversations between workers.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "chat": {
+        "BACKEND": os.getenv("CHAT_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("CHAT_CACHE_LOCATION", "chat"),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "10000"))},
+    },
+    # Users with their profiles, for token authentication (api/authentication.py).
+    # A shared backend makes invalidation on save reach every worker.
+    "auth": {
+        "BACKEND": os.getenv("AUTH_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.getenv("AUTH_CACHE_LOCATION", "auth"),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))},
+    },
+}
+# Longest a worker keeps a user another worker has changed (local cache).
+AUTH_CACHE_TTL = int(os.getenv("AUTH_CACHE_TTL", "60"))
+
+# Server-sent events (api/events.py). "local" delivers within one worker
+# process; "redis" relays events between workers through EVENT_REDIS_URL.
+EVENT_BROKER = os.getenv("EVENT_BROKER", "local")
+EVENT_REDIS_URL = os.getenv("EVENT_REDIS_URL", "redis://127.0.0.1:6379/0")
+# Open streams allowed per worker process and per user.
+EVENT_MAX_CONNECTIONS = int(os.getenv("EVENT_MAX_CONNECTIONS", "2000"))
+EVENT_MAX_CONNECTIONS_PER_USER = int(os.getenv("EVENT_MAX_CONNECTIONS_PER_USER", "5"))
+# Undelivered events held per stream before the oldest are dropped.
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "64"))
+# Recent events kept per channel for Last-Event-ID replay, for at most
+# HISTORY_CHANNELS channels.
+EVENT_HISTORY_SIZE = 20
+EVENT_HISTORY_CHANNELS = 10000
+EVENT_HEARTBEAT = 15  # seconds
+EVENT_RETRY_MS = 3000
 
 # Application definition
 
@@ -54,10 +192,13 @@ INSTALLED_APPS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
 }
 
+# Loads the profile with the user, for the role claim in issued tokens.
+AUTHENTICATION_BACKENDS = ['api.authentication.ProfileModelBackend']
+
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -92,12 +233,63 @@ WSGI_APPLICATION = 'multimodal_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE=sqlite (default) is the single-node option: WAL lets reads
+# proceed during a write, and writers queue on busy_timeout instead of
+# failing with "database is locked". DATABASE_ENGINE=postgres needs
+# psycopg[pool] and uses Django's built-in connection pool.
+DATABASE_ENGINE = os.getenv("DATABASE_ENGINE", "sqlite")
+
+if DATABASE_ENGINE == "postgres":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("POSTGRES_DB", "multimodal"),
+            'USER': os.getenv("POSTGRES_USER", "postgres"),
+            'PASSWORD': os.getenv("POSTGRES_PASSWORD", ""),
+            'HOST': os.getenv("POSTGRES_HOST", "127.0.0.1"),
+            'PORT': os.getenv("POSTGRES_PORT", "5432"),
+            # The pool replaces persistent connections.
+            'CONN_MAX_AGE': 0,
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.getenv("POSTGRES_POOL_MIN", "2")),
+                    'max_size': int(os.getenv("POSTGRES_POOL_MAX", "20")),
+                    'timeout': float(os.getenv("POSTGRES_POOL_TIMEOUT", "10")),
+                },
+            },
+        }
     }
-}
+elif DATABASE_ENGINE == "sqlite":
+    SQLITE_TIMEOUT = int(os.getenv("SQLITE_TIMEOUT", "20"))
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv("SQLITE_PATH", BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': 60,
+            'OPTIONS': {
+                # Take the write lock when a transaction starts rather than on
+                # its first write, so busy_timeout applies instead of an
+                # immediate "database is locked" on lock upgrade.
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': SQLITE_TIMEOUT,
+                'init_command': (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    f"PRAGMA busy_timeout={SQLITE_TIMEOUT * 1000};"
+                    "PRAGMA mmap_size=134217728;"
+                    "PRAGMA cache_size=-20000;"
+                    "PRAGMA temp_store=MEMORY;"
+                ),
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unknown DATABASE_ENGINE: {DATABASE_ENGINE}")
+
+
+# Admin changelists of tables larger than this show an estimated row count
+# (api/admin.py) instead of running COUNT(*).
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv("ADMIN_EXACT_COUNT_LIMIT", "100000"))
 
 
 # Password validation
@@ -135,6 +327,8 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
+# collectstatic target, for the web server to serve admin assets from.
+STATIC_ROOT = os.getenv("STATIC_ROOT", os.path.join(BASE_DIR, 'staticfiles'))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
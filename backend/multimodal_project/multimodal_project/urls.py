@@ -15,11 +15,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path,include
-from django.conf.urls.static import static
+from django.urls import path,include,re_path
 from django.conf import settings
+from api.media import serve_media
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from api.views import CustomTokenObtainPairView
+from api.views import CustomTokenObtainPairView, CustomTokenRefreshView
 from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
@@ -29,9 +29,11 @@ urlpatterns = [
 
 urlpatterns += [
     path('api/token/', CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/refresh/', CustomTokenRefreshView.as_view(), name='token_refresh'),
 ]
 
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Uploaded images, in production too: api/media.py checks access and hands
+# the file to the web server (MEDIA_SERVE).
+urlpatterns += [
+    re_path(rf"^{settings.MEDIA_URL.lstrip('/')}(?P<name>.+)$", serve_media, name='media'),
+]
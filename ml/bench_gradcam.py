@@ -0,0 +1,74 @@
+"""CPU overhead of Grad-CAM over a plain MultimodalModel forward.
+
+    python bench_gradcam.py --batch-sizes 1 8 --iterations 20
+
+Times the plain inference forward, the Grad-CAM forward plus partial
+backward, and Grad-CAM including rendering the PNG overlay.
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from gradcam import gradcam, overlay_png
+from networks import MultimodalModel
+
+
+def timed(fn, iterations, warmup=2):
+    for _ in range(warmup):
+        fn()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Grad-CAM overhead on CPU")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--size", type=int, default=112, help="Overlay size in pixels")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = MultimodalModel(num_metadata_features=17, pretrained=False).eval()
+    results = []
+    for batch_size in args.batch_sizes:
+        images = torch.rand(batch_size, 3, 224, 224) * 2 - 1
+        metadata = torch.rand(batch_size, 17)
+
+        def plain():
+            with torch.inference_mode():
+                model(images, metadata)
+
+        def explained():
+            gradcam(model, images, metadata)
+
+        def rendered():
+            _, cams = gradcam(model, images, metadata)
+            for image, cam in zip(images, cams):
+                overlay_png(image, cam, args.size)
+
+        plain_s = timed(plain, args.iterations)
+        gradcam_s = timed(explained, args.iterations)
+        rendered_s = timed(rendered, args.iterations)
+        result = {
+            "batch_size": batch_size,
+            "plain_ms": round(plain_s * 1000, 1),
+            "gradcam_ms": round(gradcam_s * 1000, 1),
+            "gradcam_png_ms": round(rendered_s * 1000, 1),
+            "overhead": round(rendered_s / plain_s, 2),
+        }
+        print(f"batch={batch_size:<2} plain {result['plain_ms']} ms | grad-cam {result['gradcam_ms']} ms | "
+              f"with png {result['gradcam_png_ms']} ms ({result['overhead']}x)")
+        results.append(result)
+
+    print(json.dumps({"threads": torch.get_num_threads(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
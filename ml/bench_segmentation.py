@@ -0,0 +1,69 @@
+"""CPU throughput of the segmentation UNet.
+
+Compares the notebook UNet (1024-channel bottleneck) with a lighter variant
+at several batch sizes, in default and channels-last memory layouts:
+
+    python bench_segmentation.py --batch-sizes 1 4 8 --base-channels 64 16
+"""
+import argparse
+import json
+import time
+
+import torch
+
+from networks import UNet
+from segmentation import SIZE
+
+
+def benchmark(model, batch_size, channels_last, iterations, warmup=2):
+    images = torch.rand(batch_size, 3, SIZE, SIZE)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+        images = images.contiguous(memory_format=torch.channels_last)
+
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(images)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(images)
+        elapsed = time.perf_counter() - start
+
+    return {
+        "batch_size": batch_size,
+        "channels_last": channels_last,
+        "ms_per_batch": round(elapsed / iterations * 1000, 1),
+        "images_per_sec": round(batch_size * iterations / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark UNet segmentation throughput on CPU")
+    parser.add_argument("--base-channels", type=int, nargs="+", default=[64, 16])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    results = []
+    for base_channels in args.base_channels:
+        model = UNet(n_channels=3, n_classes=1, base_channels=base_channels).eval()
+        params = sum(p.numel() for p in model.parameters())
+        for batch_size in args.batch_sizes:
+            for channels_last in (False, True):
+                result = benchmark(model, batch_size, channels_last, args.iterations)
+                result.update({"base_channels": base_channels, "bottleneck_channels": base_channels * 16, "params": params})
+                print(
+                    f"base={base_channels:<3} batch={batch_size:<2} channels_last={channels_last!s:<5} "
+                    f"{result['ms_per_batch']:>8} ms/batch {result['images_per_sec']:>8} img/s"
+                )
+                results.append(result)
+
+    print(json.dumps({"threads": torch.get_num_threads(), "size": SIZE, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""Probability calibration and decision thresholds.
+
+MultimodalModel is trained with ``pos_weight`` = negatives / positives, which
+pushes its sigmoid outputs towards the positive class. A calibrator fitted
+offline on validation logits maps raw logits to calibrated probabilities:
+
+    temperature  sigmoid(logit / T), stored as scale = 1 / T
+    platt        sigmoid(a * logit + b), which also undoes the prior shift
+    isotonic     monotone step function of the logit (pool adjacent violators)
+
+Calibrators are stored per model version as
+``<registry>/<version>/calibration.json``. Thresholds turning a calibrated
+probability into a label and a confidence level are per deployment
+(DECISION_THRESHOLD, CONFIDENCE_LOW, CONFIDENCE_HIGH).
+
+    python calibration.py fit --predictions runs/clinic-1/val_predictions.npz --method platt --version v3
+    python calibration.py recompute --django-project ../backend/multimodal_project
+"""
+import argparse
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+
+METHODS = ("identity", "temperature", "platt", "isotonic")
+CALIBRATION_NAME = "calibration.json"
+
+
+def sigmoid(x):
+    x = np.asarray(x, dtype=np.float64)
+    return 0.5 * (1.0 + np.tanh(0.5 * x))
+
+
+def logit_from_probability(probability, eps=1e-7):
+    probability = np.clip(np.asarray(probability, dtype=np.float64), eps, 1 - eps)
+    return np.log(probability / (1 - probability))
+
+
+def negative_log_likelihood(probs, labels, eps=1e-12):
+    probs = np.clip(probs, eps, 1 - eps)
+    return float(-np.mean(labels * np.log(probs) + (1 - labels) * np.log(1 - probs)))
+
+
+def expected_calibration_error(probs, labels, bins=10):
+    edges = np.linspace(0, 1, bins + 1)
+    which = np.clip(np.digitize(probs, edges[1:-1]), 0, bins - 1)
+    error = 0.0
+    for b in range(bins):
+        mask = which == b
+        if mask.any():
+            error += mask.mean() * abs(probs[mask].mean() - labels[mask].mean())
+    return float(error)
+
+
+def fit_affine(logits, labels, fit_bias, iterations=100):
+    """Damped Newton's method on the logistic NLL of ``a * logit + b`` (b
+    fixed at 0 unless ``fit_bias``). Returns (a, b)."""
+    x = np.asarray(logits, dtype=np.float64)
+    y = np.asarray(labels, dtype=np.float64)
+    features = np.stack([x, np.ones_like(x)], axis=1) if fit_bias else x[:, None]
+
+    def loss(params):
+        z = features @ params
+        return float(np.mean(np.logaddexp(0.0, z) - y * z))
+
+    params = np.zeros(features.shape[1])
+    params[0] = 1.0
+    current = loss(params)
+    for _ in range(iterations):
+        p = sigmoid(features @ params)
+        gradient = features.T @ (p - y) / len(y)
+        hessian = (features * (p * (1 - p))[:, None]).T @ features / len(y) + 1e-9 * np.eye(len(params))
+        step = np.linalg.solve(hessian, gradient)
+        # Halve the step until the loss decreases; plain Newton overshoots
+        # when the starting point is badly calibrated.
+        t = 1.0
+        while t > 1e-8 and loss(params - t * step) > current:
+            t *= 0.5
+        params = params - t * step
+        previous, current = current, loss(params)
+        if previous - current < 1e-12:
+            break
+    return float(params[0]), float(params[1]) if fit_bias else 0.0
+
+
+def fit_isotonic(logits, labels):
+    """Pool adjacent violators on labels sorted by logit. Returns the block
+    boundaries (logits) and their fitted probabilities for np.interp."""
+    order = np.argsort(logits, kind="mergesort")
+    x = np.asarray(logits, dtype=np.float64)[order]
+    y = np.asarray(labels, dtype=np.float64)[order]
+
+    values, weights, starts = [], [], []
+    for i, label in enumerate(y):
+        values.append(label)
+        weights.append(1.0)
+        starts.append(i)
+        while len(values) > 1 and values[-2] >= values[-1]:
+            w = weights[-2] + weights[-1]
+            values[-2] = (values[-2] * weights[-2] + values[-1] * weights[-1]) / w
+            weights[-2] = w
+            values.pop()
+            weights.pop()
+            starts.pop()
+
+    # Each block contributes its lowest and highest logit so interpolation is
+    # flat inside a block and linear between blocks.
+    ends = starts[1:] + [len(x)]
+    xs, ys = [], []
+    for start, end, value in zip(starts, ends, values):
+        xs.extend([x[start], x[end - 1]])
+        ys.extend([value, value])
+    return xs, ys
+
+
+class Calibrator:
+    def __init__(self, method="identity", scale=1.0, bias=0.0, x=None, y=None, metrics=None):
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}")
+        self.method = method
+        self.scale = scale
+        self.bias = bias
+        self.x = np.asarray(x if x is not None else [], dtype=np.float64)
+        self.y = np.asarray(y if y is not None else [], dtype=np.float64)
+        self.metrics = metrics or {}
+
+    @classmethod
+    def fit(cls, logits, labels, method):
+        logits = np.asarray(logits, dtype=np.float64).ravel()
+        labels = np.asarray(labels, dtype=np.float64).ravel()
+        if method == "identity":
+            calibrator = cls()
+        elif method == "temperature":
+            scale, _ = fit_affine(logits, labels, fit_bias=False)
+            calibrator = cls(method, scale=scale)
+        elif method == "platt":
+            scale, bias = fit_affine(logits, labels, fit_bias=True)
+            calibrator = cls(method, scale=scale, bias=bias)
+        elif method == "isotonic":
+            x, y = fit_isotonic(logits, labels)
+            calibrator = cls(method, x=x, y=y)
+        else:
+            raise ValueError(f"method must be one of {METHODS}")
+
+        raw, calibrated = sigmoid(logits), calibrator.probabilities(logits)
+        calibrator.metrics = {
+            "samples": int(len(labels)),
+            "nll_before": negative_log_likelihood(raw, labels),
+            "nll_after": negative_log_likelihood(calibrated, labels),
+            "ece_before": expected_calibration_error(raw, labels),
+            "ece_after": expected_calibration_error(calibrated, labels),
+        }
+        return calibrator
+
+    def probabilities(self, logits):
+        """Calibrated probabilities for an array of raw logits."""
+        logits = np.asarray(logits, dtype=np.float64)
+        if self.method == "isotonic":
+            return np.interp(logits, self.x, self.y)
+        if self.method == "identity":
+            return sigmoid(logits)
+        return sigmoid(self.scale * logits + self.bias)
+
+    def probability(self, logit):
+        return float(self.probabilities([logit])[0])
+
+    def to_dict(self):
+        return {
+            "method": self.method,
+            "scale": self.scale,
+            "bias": self.bias,
+            "x": self.x.tolist(),
+            "y": self.y.tolist(),
+            "metrics": self.metrics,
+            "fitted_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["method"], data.get("scale", 1.0), data.get("bias", 0.0),
+                   data.get("x"), data.get("y"), data.get("metrics"))
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+class Thresholds:
+    """Label and confidence cut-offs on the calibrated probability."""
+
+    def __init__(self, decision=0.5, confidence_low=0.3, confidence_high=0.7):
+        if not 0.0 <= confidence_low <= decision <= confidence_high <= 1.0:
+            raise ValueError("thresholds must satisfy 0 <= confidence_low <= decision <= confidence_high <= 1")
+        self.decision = decision
+        self.confidence_low = confidence_low
+        self.confidence_high = confidence_high
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            float(os.getenv("DECISION_THRESHOLD", "0.5")),
+            float(os.getenv("CONFIDENCE_LOW", "0.3")),
+            float(os.getenv("CONFIDENCE_HIGH", "0.7")),
+        )
+
+    def labels(self, probabilities):
+        """Vectorized (prediction, confidence_level) arrays."""
+        probabilities = np.asarray(probabilities)
+        predictions = np.where(probabilities > self.decision, "Malignant", "Benign")
+        confident = (probabilities > self.confidence_high) | (probabilities < self.confidence_low)
+        return predictions, np.where(confident, "high", "medium")
+
+    def label(self, probability):
+        predictions, confidence = self.labels([probability])
+        return str(predictions[0]), str(confidence[0])
+
+    def to_dict(self):
+        return {"decision": self.decision, "confidence_low": self.confidence_low,
+                "confidence_high": self.confidence_high}
+
+
+class CalibrationStore:
+    """Calibrators of registry versions, loaded once per version."""
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._calibrators = {}
+
+    def path(self, version):
+        return os.path.join(self.root, version, CALIBRATION_NAME)
+
+    def get(self, version):
+        with self._lock:
+            calibrator = self._calibrators.get(version)
+            if calibrator is None:
+                calibrator = self._calibrators[version] = Calibrator.load(self.path(version))
+            return calibrator
+
+    def reload(self, version=None):
+        with self._lock:
+            if version is None:
+                self._calibrators.clear()
+            else:
+                self._calibrators.pop(version, None)
+
+
+def recompute(args):
+    """Relabel stored predictions from their saved logits, in chunks."""
+    from training.incremental import setup_django
+
+    setup_django(args.django_project)
+    from api.models import ImageUpload
+
+    store = CalibrationStore(args.registry)
+    thresholds = Thresholds.from_env()
+    queryset = ImageUpload.objects.filter(logit__isnull=False).only("id", "logit", "model_version").order_by("id")
+    if args.version:
+        queryset = queryset.filter(model_version=args.version)
+
+    updated = 0
+    chunk = []
+
+    def flush():
+        by_version = {}
+        for upload in chunk:
+            by_version.setdefault(upload.model_version, []).append(upload)
+        for version, uploads in by_version.items():
+            calibrator = store.get(version) if version else Calibrator()
+            probabilities = calibrator.probabilities([upload.logit for upload in uploads])
+            predictions, confidence = thresholds.labels(probabilities)
+            for upload, probability, prediction, level in zip(uploads, probabilities, predictions, confidence):
+                upload.probability = round(float(probability), 4)
+                upload.prediction = str(prediction)
+                upload.confidence_level = str(level)
+        if not args.dry_run:
+            ImageUpload.objects.bulk_update(chunk, ["probability", "prediction", "confidence_level"],
+                                            batch_size=args.chunk_size)
+        chunk.clear()
+
+    for upload in queryset.iterator(chunk_size=args.chunk_size):
+        chunk.append(upload)
+        if len(chunk) >= args.chunk_size:
+            updated += len(chunk)
+            flush()
+    if chunk:
+        updated += len(chunk)
+        flush()
+
+    print(json.dumps({"updated": updated, "dry_run": args.dry_run, "thresholds": thresholds.to_dict()}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit calibrators and relabel stored predictions")
+    parser.add_argument("--registry", default=os.getenv("MODEL_REGISTRY_DIR", "models/registry"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    fit_parser = subparsers.add_parser("fit", help="Fit a calibrator on validation logits")
+    fit_parser.add_argument("--predictions", required=True, help=".npz with 'logits' and 'labels' arrays")
+    fit_parser.add_argument("--method", choices=METHODS, default="temperature")
+    fit_parser.add_argument("--version", required=True, help="Registry version the logits come from")
+
+    recompute_parser = subparsers.add_parser("recompute", help="Relabel stored predictions from saved logits")
+    recompute_parser.add_argument("--django-project", default="../backend/multimodal_project")
+    recompute_parser.add_argument("--version", help="Only predictions made by this version")
+    recompute_parser.add_argument("--chunk-size", type=int, default=2000)
+    recompute_parser.add_argument("--dry-run", action="store_true")
+
+    args = parser.parse_args()
+    if args.command == "fit":
+        data = np.load(args.predictions)
+        calibrator = Calibrator.fit(data["logits"], data["labels"], args.method)
+        path = CalibrationStore(args.registry).path(args.version)
+        calibrator.save(path)
+        print(json.dumps({"path": path, "method": calibrator.method, **calibrator.metrics}, indent=2))
+    elif args.command == "recompute":
+        recompute(args)
+
+
+if __name__ == "__main__":
+    main()
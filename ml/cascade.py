@@ -0,0 +1,74 @@
+"""Two-stage inference: a small screening model answers confident cases and
+only images whose screening probability falls inside the uncertain band are
+passed on to the full MultimodalModel."""
+import os
+import threading
+
+import torch
+import torch.nn.functional as F
+
+from networks import ScreeningModel
+from shadow import ModelStats
+
+
+def downscale(images, image_size):
+    if images.shape[-1] == image_size and images.shape[-2] == image_size:
+        return images
+    return F.interpolate(images, size=(image_size, image_size), mode="bilinear", align_corners=False, antialias=True)
+
+
+def load_screening_model(path, device):
+    checkpoint = torch.load(path, map_location=device)
+    model = ScreeningModel(num_metadata_features=checkpoint["num_metadata_features"], pretrained=False)
+    model.load_state_dict(checkpoint["state_dict"])
+    model.to(device)
+    model.eval()
+    return model, checkpoint["image_size"]
+
+
+class Cascade:
+    def __init__(self, model_path, device, enabled=False, low=0.1, high=0.9):
+        self.model_path = model_path
+        self.low = low
+        self.high = high
+        self.model = None
+        self.image_size = None
+        self.version = "screening:" + os.path.splitext(os.path.basename(model_path))[0]
+        if enabled:
+            self.model, self.image_size = load_screening_model(model_path, device)
+
+        self._lock = threading.Lock()
+        self.exited = 0
+        self.latency = ModelStats()
+
+    @property
+    def enabled(self):
+        return self.model is not None
+
+    def screen(self, image_tensor, metadata_tensor):
+        with torch.no_grad():
+            output = self.model(downscale(image_tensor, self.image_size), metadata_tensor)
+            return torch.sigmoid(output).item()
+
+    def exits(self, probability):
+        return probability < self.low or probability > self.high
+
+    def record(self, latency, exited):
+        with self._lock:
+            self.latency.record(latency)
+            self.exited += int(exited)
+
+    def summary(self):
+        with self._lock:
+            latency = self.latency.summary()
+            screened = latency["requests"]
+            return {
+                "enabled": self.enabled,
+                "model_path": self.model_path,
+                "band": [self.low, self.high],
+                "screened": screened,
+                "exited": self.exited,
+                "exit_rate": round(self.exited / screened, 4) if screened else None,
+                "screening_p50_ms": latency["p50_ms"],
+                "screening_p99_ms": latency["p99_ms"],
+            }
@@ -0,0 +1,266 @@
+import json
+import math
+import os
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+from torchvision.transforms import transforms
+
+from featurizer import METADATA_FIELDS, encode_frame
+
+METADATA_COLS = METADATA_FIELDS
+
+FITZ_PATH = "/kaggle/input/fitzpatrick17k-original/finalfitz17k"
+PAD_BASE_PATH = "/kaggle/input/skin-cancer"
+PAD_SUBFOLDER_PATHS = [
+    "imgs_part_1/imgs_part_1",
+    "imgs_part_2/imgs_part_2",
+    "imgs_part_3/imgs_part_3"
+]
+
+
+def build_transforms(image_size=224):
+    train_transform = transforms.Compose([
+        transforms.ToPILImage(),
+        transforms.Resize((image_size, image_size)),
+        transforms.RandomHorizontalFlip(),
+        transforms.RandomRotation(10),
+        transforms.ToTensor(),
+        transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
+    ])
+
+    val_transform = transforms.Compose([
+        transforms.ToPILImage(),
+        transforms.Resize((image_size, image_size)),
+        transforms.ToTensor(),
+        transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
+    ])
+    return train_transform, val_transform
+
+
+def load_metadata(csv_path, pad_base_path=PAD_BASE_PATH):
+    """Read metadata.csv and resolve PAD-UFES image ids to full paths, as in
+    multimodal.ipynb."""
+    import pandas as pd
+
+    metadata = pd.read_csv(csv_path).reset_index(drop=True)
+
+    pad_set = {}
+    for pad_path in PAD_SUBFOLDER_PATHS:
+        image_path = os.path.join(pad_base_path, pad_path)
+        if not os.path.isdir(image_path):
+            continue
+        for f in os.listdir(image_path):
+            if f.endswith(".png"):
+                pad_set[f] = os.path.join(image_path, f)
+
+    metadata["full_path"] = metadata["id"].apply(
+        lambda image_id: pad_set.get(image_id) if image_id.endswith(".png") else image_id
+    )
+    return metadata
+
+
+def resolve_image_path(image_id, full_path, fitz_path=FITZ_PATH):
+    if image_id.endswith(".jpg"):
+        return os.path.join(fitz_path, image_id)
+    if image_id.endswith(".png"):
+        return full_path
+    return os.path.join(fitz_path, image_id + ".jpg")
+
+
+class MultimodalSkinCancerDataset(Dataset):
+
+    def __init__(self, df, metadata_cols, transform=None, fitz_path=FITZ_PATH):
+        self.df = df
+        self.transform = transform
+        self.metadata_cols = metadata_cols
+        self.fitz_path = fitz_path
+        # Encoded once, with the same featurizer the inference API uses.
+        if list(metadata_cols) == METADATA_FIELDS:
+            self.metadata = encode_frame(df)
+        else:
+            self.metadata = df[metadata_cols].to_numpy(dtype=np.float32)
+
+    def __len__(self):
+        return len(self.df)
+
+    def __getitem__(self, idx):
+        row = self.df.iloc[idx]
+        label = row["binary_label"]
+
+        image_path = resolve_image_path(row["id"], row["full_path"], self.fitz_path)
+        image_bgr = cv2.imread(image_path) if image_path else None
+        if image_bgr is None:
+            image_bgr = np.zeros((224, 224, 3), dtype=np.uint8)
+
+        image = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+
+        if self.transform:
+            image = self.transform(image)
+
+        metadata = self.metadata[idx]
+
+        return image, metadata, label
+
+
+class ISICDataset(Dataset):
+    def __init__(self, images_path, masks_path, size, transform=None):
+        self.images_path = images_path
+        self.masks_path = masks_path
+        self.transform = transform
+        self.ids = [image_file[:-4] for image_file in os.listdir(images_path) if image_file.endswith('.jpg')]
+        self.size = size
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, idx):
+        img = cv2.imread(os.path.join(self.images_path, self.ids[idx] + '.jpg'), cv2.IMREAD_COLOR)
+        mask = cv2.imread(os.path.join(self.masks_path, self.ids[idx] + '_segmentation.png'), cv2.IMREAD_GRAYSCALE)
+
+        # Convert to RGB, And convert mask to binary
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        ret, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+
+        if self.transform is not None:
+            augmentations = self.transform(image=img, mask=mask)
+            img = augmentations['image']
+            mask = augmentations['mask']
+
+        img = torch.from_numpy(img).permute(2, 0, 1).float() / 255.
+        mask = torch.from_numpy(mask).unsqueeze(0).float()
+        mask[mask == 255.0] = 1.0
+
+        return img, mask
+
+
+# Packed datasets
+#
+# pack_dataset.py writes images (already resized), masks, metadata vectors and
+# labels into .npy shards plus an index.json. The datasets below memory-map the
+# shards and implement __getitems__, so a DataLoader fetches a whole batch with
+# one gather per array into a tensor allocated once for the batch instead of
+# decoding a JPEG per sample. Use them with ``collate_fn=packed_collate``.
+
+def packed_collate(batch):
+    return batch
+
+
+def random_flip_rotate(images, max_degrees, hflip_p=0.5, vflip_p=0.0, masks=None):
+    """Per-sample random flips and rotations for a whole (B, C, H, W) batch in
+    one grid_sample. Areas rotated in from outside the image are filled with 0."""
+    batch_size = images.shape[0]
+    angles = (torch.rand(batch_size) * 2 - 1) * math.radians(max_degrees)
+    sx = torch.where(torch.rand(batch_size) < hflip_p, -1.0, 1.0)
+    sy = torch.where(torch.rand(batch_size) < vflip_p, -1.0, 1.0)
+    cos, sin = torch.cos(angles), torch.sin(angles)
+
+    theta = torch.zeros(batch_size, 2, 3)
+    theta[:, 0, 0] = cos * sx
+    theta[:, 0, 1] = -sin * sy
+    theta[:, 1, 0] = sin * sx
+    theta[:, 1, 1] = cos * sy
+
+    grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+    images = F.grid_sample(images, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+    if masks is None:
+        return images
+    masks = F.grid_sample(masks, grid, mode="nearest", padding_mode="zeros", align_corners=False)
+    return images, masks
+
+
+class PackedShards:
+    def __init__(self, root):
+        self.root = root
+        with open(os.path.join(root, "index.json")) as f:
+            self.index = json.load(f)
+        self.arrays = {
+            name: [np.load(os.path.join(root, shard[name]), mmap_mode="r") for shard in self.index["shards"]]
+            for name in self.index["arrays"]
+        }
+        self.offsets = np.cumsum([0] + [shard["count"] for shard in self.index["shards"]])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def gather(self, name, indices, out):
+        """Copy rows ``indices`` of array ``name`` into the numpy array ``out``."""
+        indices = np.asarray(indices, dtype=np.int64)
+        shard_ids = np.searchsorted(self.offsets, indices, side="right") - 1
+        for shard_id in np.unique(shard_ids):
+            positions = np.flatnonzero(shard_ids == shard_id)
+            local = indices[positions] - self.offsets[shard_id]
+            out[positions] = self.arrays[name][shard_id][local]
+        return out
+
+
+class PackedMultimodalDataset(Dataset):
+    """Packed counterpart of MultimodalSkinCancerDataset.
+
+    Returns batches of normalized float images (B, 3, S, S), metadata (B, F)
+    and labels (B,). With ``augment=True`` applies the training augmentation
+    (horizontal flip, rotation up to 10 degrees) batch-wise.
+    """
+
+    def __init__(self, root, augment=False):
+        self.shards = PackedShards(root)
+        self.image_size = self.shards.index["image_size"]
+        self.metadata_cols = self.shards.index["metadata_cols"]
+        self.labels = np.concatenate(self.shards.arrays["labels"])
+        self.augment = augment
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __getitems__(self, indices):
+        size = self.image_size
+        images = torch.empty((len(indices), size, size, 3), dtype=torch.uint8)
+        metadata = torch.empty((len(indices), len(self.metadata_cols)), dtype=torch.float32)
+        self.shards.gather("images", indices, images.numpy())
+        self.shards.gather("metadata", indices, metadata.numpy())
+        labels = torch.from_numpy(self.labels[np.asarray(indices)])
+
+        images = images.permute(0, 3, 1, 2).float().div_(255.)
+        if self.augment:
+            images = random_flip_rotate(images, 10)
+        # Same as Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5]).
+        images = images.sub_(0.5).div_(0.5).contiguous()
+        return images, metadata, labels
+
+    def __getitem__(self, idx):
+        images, metadata, labels = self.__getitems__([idx])
+        return images[0], metadata[0], labels[0]
+
+
+class PackedSegmentationDataset(Dataset):
+    """Packed counterpart of ISICDataset: images in [0, 1] (B, 3, S, S) and
+    binary masks (B, 1, S, S). ``augment=True`` applies the notebook's
+    rotation (35 degrees), horizontal flip and 10% vertical flip."""
+
+    def __init__(self, root, augment=False):
+        self.shards = PackedShards(root)
+        self.image_size = self.shards.index["image_size"]
+        self.augment = augment
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __getitems__(self, indices):
+        size = self.image_size
+        images = torch.empty((len(indices), size, size, 3), dtype=torch.uint8)
+        masks = torch.empty((len(indices), size, size), dtype=torch.uint8)
+        self.shards.gather("images", indices, images.numpy())
+        self.shards.gather("masks", indices, masks.numpy())
+
+        images = images.permute(0, 3, 1, 2).float().div_(255.)
+        masks = masks.unsqueeze(1).float()
+        if self.augment:
+            images, masks = random_flip_rotate(images, 35, hflip_p=0.5, vflip_p=0.1, masks=masks)
+        return images.contiguous(), masks
+
+    def __getitem__(self, idx):
+        images, masks = self.__getitems__([idx])
+        return images[0], masks[0]
@@ -0,0 +1,215 @@
+"""Distill MultimodalModel into the ScreeningModel used by the cascade and
+measure what the cascade gains and loses on the held-out split.
+
+    python distill.py --metadata-csv metadata.csv --teacher models/best_multimodal_model.pth
+
+The held-out split is the same stratified 80/20 split (random_state=42) that
+multimodal.ipynb validates on, so the teacher never saw those images.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, WeightedRandomSampler
+
+from cascade import downscale
+from datasets import METADATA_COLS, MultimodalSkinCancerDataset, build_transforms, load_metadata, FITZ_PATH, PAD_BASE_PATH
+from networks import MultimodalModel, ScreeningModel
+
+DEFAULT_BANDS = [(0.05, 0.95), (0.1, 0.9), (0.2, 0.8), (0.3, 0.7)]
+
+
+def distillation_loss(student_logits, teacher_logits, labels, criterion, temperature, alpha):
+    hard = criterion(student_logits, labels)
+    soft_targets = torch.sigmoid(teacher_logits / temperature)
+    soft = nn.functional.binary_cross_entropy_with_logits(student_logits / temperature, soft_targets)
+    return alpha * hard + (1 - alpha) * soft * temperature ** 2
+
+
+def train_one_epoch(student, teacher, loader, optimizer, criterion, args, device):
+    student.train()
+    running_loss = 0
+
+    for images, metadata, labels in loader:
+        images = images.to(device)
+        metadata = metadata.to(device)
+        labels = labels.float().unsqueeze(1).to(device)
+
+        with torch.no_grad():
+            teacher_logits = teacher(images, metadata)
+
+        optimizer.zero_grad()
+        student_logits = student(downscale(images, args.image_size), metadata)
+        loss = distillation_loss(student_logits, teacher_logits, labels, criterion, args.temperature, args.alpha)
+        loss.backward()
+        optimizer.step()
+
+        running_loss += loss.item()
+
+    return running_loss / len(loader)
+
+
+def collect_probabilities(student, teacher, loader, image_size, device):
+    """Score the held-out set with both models, timing only the forwards."""
+    student.eval()
+    teacher.eval()
+    student_probs, teacher_probs, all_labels = [], [], []
+    student_seconds = teacher_seconds = 0.0
+
+    with torch.no_grad():
+        for images, metadata, labels in loader:
+            images = images.to(device)
+            metadata = metadata.to(device)
+
+            start = time.perf_counter()
+            student_out = student(downscale(images, image_size), metadata)
+            student_seconds += time.perf_counter() - start
+
+            start = time.perf_counter()
+            teacher_out = teacher(images, metadata)
+            teacher_seconds += time.perf_counter() - start
+
+            student_probs.append(torch.sigmoid(student_out).flatten())
+            teacher_probs.append(torch.sigmoid(teacher_out).flatten())
+            all_labels.append(labels.flatten())
+
+    return (
+        torch.cat(student_probs).numpy(),
+        torch.cat(teacher_probs).numpy(),
+        torch.cat(all_labels).numpy().astype(int),
+        student_seconds,
+        teacher_seconds,
+    )
+
+
+def binary_metrics(probs, labels, threshold=0.5):
+    preds = probs > threshold
+    positives = labels == 1
+    tp = int(np.sum(preds & positives))
+    fp = int(np.sum(preds & ~positives))
+    fn = int(np.sum(~preds & positives))
+    tn = int(np.sum(~preds & ~positives))
+    sensitivity = tp / (tp + fn) if tp + fn else 0.0
+    specificity = tn / (tn + fp) if tn + fp else 0.0
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    f1 = 2 * precision * sensitivity / (precision + sensitivity) if precision + sensitivity else 0.0
+    return {"sensitivity": sensitivity, "specificity": specificity, "f1": f1}
+
+
+def cascade_report(student_probs, teacher_probs, labels, student_seconds, teacher_seconds, bands):
+    n = len(labels)
+    student_per_image = student_seconds / n
+    teacher_per_image = teacher_seconds / n
+    teacher_metrics = binary_metrics(teacher_probs, labels)
+
+    report = {
+        "images": n,
+        "teacher": {**teacher_metrics, "images_per_sec": round(1 / teacher_per_image, 1)},
+        "student": {**binary_metrics(student_probs, labels), "images_per_sec": round(1 / student_per_image, 1)},
+        "cascade": [],
+    }
+    for low, high in bands:
+        exited = (student_probs < low) | (student_probs > high)
+        cascade_probs = np.where(exited, student_probs, teacher_probs)
+        metrics = binary_metrics(cascade_probs, labels)
+        exit_rate = float(exited.mean())
+        per_image = student_per_image + (1 - exit_rate) * teacher_per_image
+        report["cascade"].append({
+            "band": [low, high],
+            "exit_rate": round(exit_rate, 4),
+            "images_per_sec": round(1 / per_image, 1),
+            "throughput_gain": round(teacher_per_image / per_image, 2),
+            "sensitivity": round(metrics["sensitivity"], 4),
+            "sensitivity_loss": round(teacher_metrics["sensitivity"] - metrics["sensitivity"], 4),
+            "specificity": round(metrics["specificity"], 4),
+        })
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill the screening model for the inference cascade")
+    parser.add_argument("--metadata-csv", required=True)
+    parser.add_argument("--fitz-path", default=FITZ_PATH)
+    parser.add_argument("--pad-base-path", default=PAD_BASE_PATH)
+    parser.add_argument("--teacher", default="models/best_multimodal_model.pth")
+    parser.add_argument("--output", default="models/screening_model.pth")
+    parser.add_argument("--report", default="models/screening_report.json")
+    parser.add_argument("--image-size", type=int, default=128)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--temperature", type=float, default=2.0)
+    parser.add_argument("--alpha", type=float, default=0.5, help="Weight of the hard-label loss")
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--pretrained", action=argparse.BooleanOptionalAction, default=True,
+                        help="Start the student from ImageNet weights")
+    args = parser.parse_args()
+
+    from sklearn.model_selection import train_test_split
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    metadata = load_metadata(args.metadata_csv, args.pad_base_path)
+    train_df, val_df = train_test_split(metadata, test_size=0.2, random_state=42, stratify=metadata['binary_label'])
+    train_df = train_df.reset_index(drop=True)
+    val_df = val_df.reset_index(drop=True)
+
+    train_transform, val_transform = build_transforms(224)
+    train_dataset = MultimodalSkinCancerDataset(train_df, METADATA_COLS, train_transform, args.fitz_path)
+    val_dataset = MultimodalSkinCancerDataset(val_df, METADATA_COLS, val_transform, args.fitz_path)
+
+    train_class_counts = train_df['binary_label'].value_counts().to_dict()
+    train_weights = [1.0 / train_class_counts[label] for label in train_df['binary_label']]
+    sampler = WeightedRandomSampler(train_weights, num_samples=len(train_weights), replacement=True)
+
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, sampler=sampler, num_workers=args.num_workers)
+    val_loader = DataLoader(val_dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+
+    teacher = MultimodalModel(num_metadata_features=len(METADATA_COLS), pretrained=False)
+    teacher.load_state_dict(torch.load(args.teacher, map_location=device))
+    teacher.to(device)
+    teacher.eval()
+
+    student = ScreeningModel(num_metadata_features=len(METADATA_COLS), pretrained=args.pretrained).to(device)
+
+    class_counts = metadata['binary_label'].value_counts()
+    pos_weight = torch.tensor([class_counts[0] / class_counts[1]], dtype=torch.float32).to(device)
+    criterion = nn.BCEWithLogitsLoss(pos_weight=pos_weight)
+    optimizer = torch.optim.Adam(student.parameters(), lr=args.lr)
+
+    best_f1 = -1.0
+    for epoch in range(args.epochs):
+        train_loss = train_one_epoch(student, teacher, train_loader, optimizer, criterion, args, device)
+        student_probs, _, labels, _, _ = collect_probabilities(student, teacher, val_loader, args.image_size, device)
+        f1 = binary_metrics(student_probs, labels)["f1"]
+        print(f"Epoch {epoch+1}/{args.epochs} | Train Loss: {train_loss:.4f} | Student F1: {f1:.4f}")
+
+        if f1 > best_f1:
+            best_f1 = f1
+            torch.save({
+                "state_dict": student.state_dict(),
+                "image_size": args.image_size,
+                "num_metadata_features": len(METADATA_COLS),
+            }, args.output)
+            print("Model saved! F1-score improved.")
+
+    checkpoint = torch.load(args.output, map_location=device)
+    student.load_state_dict(checkpoint["state_dict"])
+
+    # Time on CPU with batch size 1, which is how /predict runs.
+    student.to("cpu")
+    teacher.to("cpu")
+    single_loader = DataLoader(val_dataset, batch_size=1, shuffle=False, num_workers=args.num_workers)
+    results = collect_probabilities(student, teacher, single_loader, args.image_size, "cpu")
+    report = cascade_report(*results, DEFAULT_BANDS)
+
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""Metadata featurization shared by training and serving.
+
+The 17 metadata features are declared once in METADATA_SCHEMA. Each field is
+boolean (the app's Yes/No/Unknown questions), numeric or categorical with a
+fixed vocabulary whose indices follow sklearn's LabelEncoder (sorted
+order), so "MALE" and "FACE" encode the same way at serving time as the
+labels in metadata.csv did at training time.
+
+Numbers are passed through unchanged, which keeps already-encoded columns
+(metadata.csv, the app's 1/0/-1 answers) identical to the old
+``float(value)`` encoding. Strings are mapped through the field's
+vocabulary; missing, null and unrecognized values become -1.
+
+Check that serving encodes the training data exactly as training does:
+
+    python featurizer.py parity --metadata-csv metadata.csv
+
+test_featurizer.py checks the same on inline rows (python -m unittest
+test_featurizer).
+"""
+import argparse
+import json
+import math
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MISSING = -1.0
+SMALL_BATCH = 16
+
+BOOLEAN_VALUES = {
+    "false": 0.0, "no": 0.0, "0": 0.0,
+    "true": 1.0, "yes": 1.0, "1": 1.0,
+}
+UNKNOWN_VALUES = {"", "unk", "unknown", "none", "null", "nan", "-1"}
+
+# PAD-UFES-20 vocabularies.
+GENDERS = ("FEMALE", "MALE")
+REGIONS = (
+    "ABDOMEN", "ARM", "BACK", "CHEST", "EAR", "FACE", "FOOT", "FOREARM",
+    "HAND", "LIP", "NECK", "NOSE", "SCALP", "THIGH",
+)
+
+
+class SchemaError(ValueError):
+    pass
+
+
+class Field:
+    def __init__(self, name, kind, vocabulary=()):
+        self.name = name
+        self.kind = kind
+        self.vocabulary = tuple(vocabulary)
+        if kind == "boolean":
+            self.codes = BOOLEAN_VALUES
+        else:
+            self.codes = {value.lower(): float(i) for i, value in enumerate(self.vocabulary)}
+
+    def encode_string(self, value):
+        """Code for a string value, or None if it is not valid for the field."""
+        key = value.strip().lower()
+        if key in UNKNOWN_VALUES:
+            return MISSING
+        if key in self.codes:
+            return self.codes[key]
+        try:
+            return float(key)
+        except ValueError:
+            return None
+
+
+METADATA_SCHEMA = (
+    Field("smoke", "boolean"),
+    Field("drink", "boolean"),
+    Field("background_father", "boolean"),
+    Field("background_mother", "boolean"),
+    Field("age", "numeric"),
+    Field("gender", "categorical", GENDERS),
+    Field("skin_cancer_history", "boolean"),
+    Field("cancer_history", "boolean"),
+    Field("region", "categorical", REGIONS),
+    Field("itch", "boolean"),
+    Field("grew", "boolean"),
+    Field("hurt", "boolean"),
+    Field("changed", "boolean"),
+    Field("bleed", "boolean"),
+    Field("elevation", "boolean"),
+    Field("biopsed", "boolean"),
+    Field("fitzpatrick", "numeric"),
+)
+
+METADATA_FIELDS = [field.name for field in METADATA_SCHEMA]
+
+
+def loads(data):
+    """Parse a metadata JSON document (str or bytes); orjson when installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode_value(field, value, strict=False):
+    if isinstance(value, str):
+        code = field.encode_string(value)
+    elif value is None:
+        code = MISSING
+    elif isinstance(value, (bool, int, float)):
+        code = float(value)
+    else:
+        code = None
+    if code is None:
+        if strict:
+            raise SchemaError(f"Invalid value for {field.name}: {value!r}")
+        return MISSING
+    return code if math.isfinite(code) else MISSING
+
+
+def encode_column(field, values, strict=False):
+    """Encode one field for N rows into a float32 array of length N."""
+    try:
+        # Fast path: every value is a number, bool, numeric string or None.
+        column = np.array(values, dtype=np.float64)
+        if column.shape != (len(values),):
+            raise ValueError("nested values")
+    except (TypeError, ValueError):
+        return np.array([encode_value(field, value, strict) for value in values], dtype=np.float32)
+    column[~np.isfinite(column)] = MISSING
+    return column.astype(np.float32)
+
+
+def encode_batch(records, strict=False):
+    """Encode N metadata dicts into an (N, 17) float32 array in
+    METADATA_FIELDS order. Non-dict records encode as all missing."""
+    records = [record if isinstance(record, dict) else {} for record in records]
+    if len(records) < SMALL_BATCH:
+        # Per-column numpy calls cost more than they save for a request or two.
+        return np.array([[encode_value(field, record.get(field.name), strict) for field in METADATA_SCHEMA]
+                         for record in records], dtype=np.float32).reshape(len(records), len(METADATA_SCHEMA))
+    out = np.empty((len(records), len(METADATA_SCHEMA)), dtype=np.float32)
+    for j, field in enumerate(METADATA_SCHEMA):
+        out[:, j] = encode_column(field, [record.get(field.name) for record in records], strict)
+    return out
+
+
+def encode_json(documents, strict=False):
+    """Parse and encode N JSON documents at once."""
+    return encode_batch([loads(document) for document in documents], strict)
+
+
+def encode_frame(df, strict=False):
+    """Encode the METADATA_FIELDS columns of a pandas DataFrame."""
+    out = np.empty((len(df), len(METADATA_SCHEMA)), dtype=np.float32)
+    for j, field in enumerate(METADATA_SCHEMA):
+        column = df[field.name]
+        if column.dtype.kind in "biuf":
+            values = column.to_numpy(dtype=np.float64, copy=True)
+            values[~np.isfinite(values)] = MISSING
+            out[:, j] = values
+        else:
+            out[:, j] = encode_column(field, column.tolist(), strict)
+    return out
+
+
+def parity(csv_path):
+    """Compare the serving path (JSON per row) and encode_frame with the
+    notebook's ``row[metadata_cols].values.astype(np.float32)``."""
+    import pandas as pd
+
+    df = pd.read_csv(csv_path)
+    training = encode_frame(df, strict=True)
+    rows = df[METADATA_FIELDS].to_dict(orient="records")
+    documents = [json.dumps({k: (None if isinstance(v, float) and math.isnan(v) else v) for k, v in row.items()})
+                 for row in rows]
+    serving = encode_json(documents, strict=True)
+
+    report = {"rows": len(df), "serving_mismatches": int((serving != training).any(axis=1).sum())}
+    try:
+        legacy = df[METADATA_FIELDS].to_numpy(dtype=np.float32)
+    except ValueError:
+        report["legacy"] = "not numeric; the notebook encoding cannot read this file"
+    else:
+        comparable = np.isfinite(legacy).all(axis=1)
+        report["legacy_comparable_rows"] = int(comparable.sum())
+        report["legacy_mismatches"] = int((legacy[comparable] != training[comparable]).any(axis=1).sum())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Metadata featurizer checks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check = subparsers.add_parser("parity", help="Check serving/training encoding parity on metadata.csv")
+    check.add_argument("--metadata-csv", required=True)
+    args = parser.parse_args()
+
+    report = parity(args.metadata_csv)
+    print(json.dumps(report, indent=2))
+    if report["serving_mismatches"] or report.get("legacy_mismatches"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Grad-CAM heatmaps for MultimodalModel.
+
+The map is taken over the output of ``model.cnn.layer4`` (512 x 7 x 7 for a
+224px input). A forward hook captures that activation during the scoring
+forward pass and ``torch.autograd.grad`` differentiates the logits with
+respect to it only, so the backward pass covers the pooling and classifier
+and never the backbone. The prediction and its explanation therefore cost
+one forward plus a very short partial backward.
+
+Heatmaps are returned as small PNG overlays (data URIs) and cached by image
+digest and model version.
+"""
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from shadow import ModelStats
+
+MODES = ("off", "on")
+
+
+def target_layer(model):
+    return model.cnn.layer4
+
+
+def gradcam(model, images, metadata):
+    """Return (logits (B,), cams (B, h, w) in [0, 1]) for a batch.
+
+    Everything up to layer4 runs without recording autograd history, as a
+    plain inference forward would; the hook turns recording on from the
+    layer4 activation onwards. Each sample's logit depends only on its own
+    activations in eval mode, so one gradient of the summed logits gives
+    every sample's Grad-CAM.
+    """
+    captured = {}
+    owner = threading.get_ident()
+
+    def hook(module, inputs, output):
+        # The model may be shared with other request threads.
+        if threading.get_ident() != owner:
+            return None
+        torch.set_grad_enabled(True)
+        captured["activations"] = output.detach().requires_grad_()
+        return captured["activations"]
+
+    handle = target_layer(model).register_forward_hook(hook)
+    try:
+        # no_grad restores the previous grad mode on exit.
+        with torch.no_grad():
+            logits = model(images, metadata).flatten()
+            activations = captured["activations"]
+            (gradients,) = torch.autograd.grad(logits.sum(), activations)
+    finally:
+        handle.remove()
+
+    with torch.no_grad():
+        weights = gradients.mean(dim=(2, 3), keepdim=True)
+        cams = F.relu((weights * activations).sum(dim=1))
+        peak = cams.flatten(1).amax(dim=1).clamp_min(1e-8)
+        return logits.detach(), cams / peak[:, None, None]
+
+
+def colorize(cam):
+    """Jet-like RGB colormap for an (h, w) array in [0, 1]."""
+    r = np.clip(1.5 - np.abs(4 * cam - 3), 0, 1)
+    g = np.clip(1.5 - np.abs(4 * cam - 2), 0, 1)
+    b = np.clip(1.5 - np.abs(4 * cam - 1), 0, 1)
+    return (np.stack([r, g, b], axis=-1) * 255).astype(np.uint8)
+
+
+def overlay_png(image, cam, size=112, alpha=0.45):
+    """PNG data URI of ``cam`` blended over ``image``, the model's
+    normalized (3, H, W) input, both resized to ``size`` x ``size``."""
+    cam = F.interpolate(cam[None, None].float(), size=(size, size), mode="bilinear", align_corners=False)
+    base = F.interpolate(image[None].float(), size=(size, size), mode="bilinear", align_corners=False)
+    # Undo Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5]).
+    base = ((base[0] * 0.5 + 0.5).clamp(0, 1) * 255).permute(1, 2, 0).cpu().numpy()
+    heat = colorize(cam[0, 0].cpu().numpy())
+    blended = (base * (1 - alpha) + heat * alpha).astype(np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(blended).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class Explainer:
+    """Grad-CAM with an LRU cache of rendered overlays and overhead stats."""
+
+    def __init__(self, mode="off", size=112, cache_size=256):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.mode = mode
+        self.size = size
+        self.cache_size = cache_size
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.latency = ModelStats()
+
+    @property
+    def enabled(self):
+        return self.mode == "on"
+
+    @staticmethod
+    def digest(image_bytes, *variant):
+        """Cache key prefix for an uploaded image; ``variant`` holds anything
+        else the map depends on (metadata, crop)."""
+        digest = hashlib.sha256(image_bytes)
+        for part in variant:
+            digest.update(b"\0" + str(part).encode())
+        return digest.hexdigest()
+
+    def cached(self, key):
+        """Cached overlay for ``(digest, model version)``, or None."""
+        with self._lock:
+            overlay = self._cache.get(key)
+            if overlay is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return overlay
+
+    def store(self, key, overlay):
+        with self._lock:
+            self._cache[key] = overlay
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def explain(self, model, image_tensor, metadata_tensor):
+        """Return (logit, cam) for a single image from one forward pass."""
+        logits, cams = gradcam(model, image_tensor, metadata_tensor)
+        return logits[0].item(), cams[0]
+
+    def render(self, image, cam):
+        return overlay_png(image, cam, self.size)
+
+    def record(self, latency):
+        with self._lock:
+            self.latency.record(latency)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "size": self.size,
+                "cache_entries": len(self._cache),
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "explained": self.latency.summary(),
+            }
@@ -1,12 +1,25 @@
-from fastapi import FastAPI, File, UploadFile, Form
+from fastapi import FastAPI, File, UploadFile, Form, Header, HTTPException, BackgroundTasks
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import torch
-import torch.nn as nn
-from torchvision import models, transforms
+from torchvision import transforms
 from PIL import Image
+import base64
+import hmac
 import io
-import json
+import os
+import time
+
+from registry import ModelRegistry, ModelManager, RegistryError
+from shadow import Experiment
+from tta import TestTimeAugmentation, sigmoid
+from cascade import Cascade
+from segmentation import Segmenter
+from gradcam import Explainer
+from calibration import CalibrationStore, Thresholds, logit_from_probability
+from similarity import SimilarityIndex, capture_embedding, normalize
+import featurizer
 
 app = FastAPI()
 
@@ -20,40 +33,30 @@ app.add_middleware(
 
 device = torch.device("cpu")
 
-class MultimodalModel(nn.Module):
-    def __init__(self, num_metadata_features, pretrained=False):
-        super().__init__()
-        
-        self.cnn = models.resnet18(pretrained=pretrained)
-        self.cnn.fc = nn.Identity()
-        img_features = 512
-        
-        self.metadata_fc = nn.Sequential(
-            nn.Linear(num_metadata_features, 32),
-            nn.ReLU(),
-            nn.BatchNorm1d(32)
-        )
-        
-        self.classifier = nn.Sequential(
-            nn.Linear(img_features + 32, 64),
-            nn.ReLU(),
-            nn.Dropout(0.3),
-            nn.Linear(64, 1)
-        )
-    
-    def forward(self, image, metadata=None):
-        img_out = self.cnn(image)
-        if metadata is not None:
-            meta_out = self.metadata_fc(metadata)
-            combined = torch.cat([img_out, meta_out], dim=1)
-        else:
-            combined = img_out
-        return self.classifier(combined)
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "models/registry")
+LEGACY_MODEL_PATH = "models/best_multimodal_model.pth"
+# /admin/* endpoints are disabled (503) until ADMIN_TOKEN is set.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+TTA_MODE = os.getenv("TTA_MODE", "off")
+TTA_VIEWS = int(os.getenv("TTA_VIEWS", "4"))
+CASCADE_MODE = os.getenv("CASCADE_MODE", "off")
+SCREENING_MODEL_PATH = os.getenv("SCREENING_MODEL_PATH", "models/screening_model.pth")
+CASCADE_LOW = float(os.getenv("CASCADE_LOW", "0.1"))
+CASCADE_HIGH = float(os.getenv("CASCADE_HIGH", "0.9"))
+SEGMENTATION_MODEL_PATH = os.getenv("SEGMENTATION_MODEL_PATH", "models/segmentation_model.pth")
+CROP_TO_LESION = os.getenv("CROP_TO_LESION", "off") == "on"
+GRADCAM_MODE = os.getenv("GRADCAM_MODE", "off")
+GRADCAM_SIZE = int(os.getenv("GRADCAM_SIZE", "112"))
+SIMILARITY_MODE = os.getenv("SIMILARITY_MODE", "off")
+SIMILARITY_INDEX_DIR = os.getenv("SIMILARITY_INDEX_DIR", "models/similarity")
+SIMILARITY_NPROBE = int(os.getenv("SIMILARITY_NPROBE", "16"))
 
-model = MultimodalModel(num_metadata_features=17, pretrained=False)
-model.load_state_dict(torch.load("models/best_multimodal_model.pth", map_location=device))
-model.to(device)
-model.eval()
+registry = ModelRegistry(MODEL_REGISTRY_DIR)
+model_manager = ModelManager(registry, device)
+model_manager.load_initial(LEGACY_MODEL_PATH)
+candidate_manager = ModelManager(registry, device)
+cascade = Cascade(SCREENING_MODEL_PATH, device, enabled=CASCADE_MODE == "on", low=CASCADE_LOW, high=CASCADE_HIGH)
+segmenter = Segmenter(SEGMENTATION_MODEL_PATH, device) if os.path.exists(SEGMENTATION_MODEL_PATH) else None
 
 transform = transforms.Compose([
     transforms.Resize((224, 224)),
@@ -61,23 +64,70 @@ transform = transforms.Compose([
     transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
 ])
 
-METADATA_FIELDS = [
-    'smoke', 'drink', 'background_father', 'background_mother', 
-    'age', 'gender', 'skin_cancer_history', 'cancer_history', 
-    'region', 'itch', 'grew', 'hurt', 'changed', 'bleed', 
-    'elevation', 'biopsed', 'fitzpatrick'
-]
-
 def preprocess_metadata(metadata_json):
-    metadata_dict = json.loads(metadata_json)
-    metadata_values = [float(metadata_dict.get(field, -1)) for field in METADATA_FIELDS]
-    return torch.tensor([metadata_values], dtype=torch.float32).to(device)
+    metadata_values = featurizer.encode_json([metadata_json])
+    return torch.from_numpy(metadata_values).to(device)
 
-def preprocess_image(image_bytes):
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+def decode_image(image_bytes):
+    return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
+def preprocess_image(image):
     image_tensor = transform(image).unsqueeze(0).to(device)
     return image_tensor
 
+def forward_logit(loaded, image_tensor, metadata_tensor):
+    with torch.no_grad():
+        return loaded.model(image_tensor, metadata_tensor).item()
+
+def score(loaded, image_tensor, metadata_tensor):
+    return sigmoid(forward_logit(loaded, image_tensor, metadata_tensor))
+
+experiment = Experiment(candidate_manager, score)
+explainer = Explainer(mode=GRADCAM_MODE, size=GRADCAM_SIZE)
+calibrations = CalibrationStore(MODEL_REGISTRY_DIR)
+thresholds = Thresholds.from_env()
+# The uncertain band is the "medium" confidence band of the calibrated probability.
+tta = TestTimeAugmentation(mode=TTA_MODE, num_views=TTA_VIEWS,
+                           low=thresholds.confidence_low, high=thresholds.confidence_high)
+similar_cases = SimilarityIndex(SIMILARITY_INDEX_DIR, nprobe=SIMILARITY_NPROBE) if SIMILARITY_MODE == "on" else None
+
+def run_full_model(image_tensor, metadata_tensor, explain_digest=None, case_id=None, want_embedding=False):
+    """Score with the routed model. With ``explain_digest`` also returns a
+    Grad-CAM overlay, from the cache or computed in the scoring pass. The
+    backbone embedding of the scoring pass is returned if ``want_embedding``
+    and added to the similar-case index under ``case_id``."""
+    loaded = experiment.route(model_manager.current())
+    heatmap = None
+    key = (explain_digest, loaded.version) if explain_digest else None
+    if key:
+        heatmap = explainer.cached(key)
+
+    index_case = similar_cases is not None and case_id is not None and case_id not in similar_cases
+    start = time.perf_counter()
+    with capture_embedding(loaded.model, enabled=index_case or want_embedding) as captured:
+        if key and heatmap is None:
+            logit, cam = explainer.explain(loaded.model, image_tensor, metadata_tensor)
+            heatmap = explainer.render(image_tensor[0], cam)
+            explainer.store(key, heatmap)
+            explainer.record(time.perf_counter() - start)
+        else:
+            logit = forward_logit(loaded, image_tensor, metadata_tensor)
+            experiment.record(loaded.version, time.perf_counter() - start)
+    if index_case and captured.embedding is not None:
+        similar_cases.add(case_id, captured.embedding)
+    probability = sigmoid(logit)
+
+    tta_applied = tta.should_apply(calibrations.get(loaded.version).probability(logit))
+    if tta_applied:
+        tta_start = time.perf_counter()
+        logit = tta.refine(loaded.model, image_tensor, metadata_tensor, logit)
+        tta.record(time.perf_counter() - tta_start)
+        probability = sigmoid(logit)
+
+    # Scored by the candidate on a background worker, if at all.
+    experiment.maybe_shadow(image_tensor, metadata_tensor, loaded.version, probability)
+    return logit, loaded.version, tta_applied, heatmap, captured.embedding
+
 @app.get("/")
 def root():
     return {"message": "Skin Cancer Classification API", "status": "running"}
@@ -85,29 +135,72 @@ def root():
 @app.post("/predict")
 async def predict(
     image: UploadFile = File(...),
-    metadata: str = Form(...)
+    metadata: str = Form(...),
+    crop_to_lesion: bool = Form(CROP_TO_LESION),
+    explain: bool = Form(False),
+    case_id: Optional[int] = Form(None),
+    features: bool = Form(False)
 ):
     try:
         image_bytes = await image.read()
-        
-        image_tensor = preprocess_image(image_bytes)
+        pil_image = decode_image(image_bytes)
+
+        # Classify the lesion rather than the whole photo when a segmentation
+        # model is available.
+        lesion_box = lesion_area = None
+        if (crop_to_lesion or features) and segmenter is not None:
+            box, lesion_area = segmenter.lesion(pil_image)
+            if crop_to_lesion and box is not None:
+                lesion_box = box
+                pil_image = pil_image.crop(lesion_box)
+
+        image_tensor = preprocess_image(pil_image)
         metadata_tensor = preprocess_metadata(metadata)
-        
-        with torch.no_grad():
-            output = model(image_tensor, metadata_tensor)
-            probability = torch.sigmoid(output).item()
-            prediction = 1 if probability > 0.5 else 0
-        
-        label_mapping = {0: "Benign", 1: "Malignant"}
-        predicted_label = label_mapping[prediction]
-        
-        confidence_level = "high" if probability > 0.7 or probability < 0.3 else "medium"
-        
+
+        # Heatmaps and embeddings come from the full model, so those requests
+        # skip the cascade.
+        explain = explain and explainer.enabled
+        explain_digest = explainer.digest(image_bytes, metadata, lesion_box) if explain else None
+
+        cascade_exit = False
+        if cascade.enabled and not explain and not features:
+            start = time.perf_counter()
+            probability = cascade.screen(image_tensor, metadata_tensor)
+            cascade_exit = cascade.exits(probability)
+            cascade.record(time.perf_counter() - start, cascade_exit)
+
+        heatmap = embedding = None
+        if cascade_exit:
+            logit = float(logit_from_probability(probability))
+            model_version, tta_applied = cascade.version, False
+        else:
+            logit, model_version, tta_applied, heatmap, embedding = run_full_model(
+                image_tensor, metadata_tensor, explain_digest, case_id, want_embedding=features
+            )
+
+        # Labels come from the calibrated probability; the raw logit is
+        # returned so stored predictions can be relabeled later.
+        calibrator = calibrations.get(model_version)
+        probability = calibrator.probability(logit)
+        predicted_label, confidence_level = thresholds.label(probability)
+
         return {
             "success": True,
             "prediction": predicted_label,
             "probability": round(probability, 4),
-            "confidence_level": confidence_level
+            "logit": round(logit, 6),
+            "calibration": calibrator.method,
+            "confidence_level": confidence_level,
+            "model_version": model_version,
+            "tta_applied": tta_applied,
+            "cascade_exit": cascade_exit,
+            "lesion_box": list(lesion_box) if lesion_box else None,
+            "heatmap": heatmap,
+            # Per-image features for lesion change tracking: the normalized
+            # backbone embedding as base64 little-endian float16.
+            "embedding": (base64.b64encode(normalize(embedding).astype("<f2").tobytes()).decode("ascii")
+                          if features and embedding is not None else None),
+            "lesion_area": lesion_area
         }
     
     except Exception as e:
@@ -116,6 +209,288 @@ async def predict(
             "error": str(e)
         }
 
+
+def explaining_model(version):
+    """The loaded model of ``version`` (active or candidate), else the
+    active one; heatmaps never load a version on demand."""
+    active = model_manager.current()
+    for loaded in (active, candidate_manager.current()):
+        if loaded is not None and loaded.version == version:
+            return loaded
+    return active
+
+
+@app.post("/explain")
+async def explain(
+    image: UploadFile = File(...),
+    metadata: str = Form(...),
+    model_version: Optional[str] = Form(None),
+    crop_to_lesion: bool = Form(CROP_TO_LESION)
+):
+    """Grad-CAM overlay for an already scored image. Unlike /predict with
+    ``explain``, this skips A/B routing, TTA, the cascade and shadow
+    scoring, and a cached overlay is returned without running the model.
+    The map comes from ``model_version`` if it is loaded, else from the
+    active version; the response says which."""
+    try:
+        if not explainer.enabled:
+            return {"success": False, "error": "Heatmaps are not enabled"}
+        loaded = explaining_model(model_version)
+        image_bytes = await image.read()
+        key = (explainer.digest(image_bytes, metadata, crop_to_lesion), loaded.version)
+        heatmap = explainer.cached(key)
+        cached = heatmap is not None
+        if not cached:
+            pil_image = decode_image(image_bytes)
+            if crop_to_lesion and segmenter is not None:
+                box, _ = segmenter.lesion(pil_image)
+                if box is not None:
+                    pil_image = pil_image.crop(box)
+            image_tensor = preprocess_image(pil_image)
+            start = time.perf_counter()
+            _, cam = explainer.explain(loaded.model, image_tensor, preprocess_metadata(metadata))
+            heatmap = explainer.render(image_tensor[0], cam)
+            explainer.store(key, heatmap)
+            explainer.record(time.perf_counter() - start)
+        return {
+            "success": True,
+            "heatmap": heatmap,
+            "model_version": loaded.version,
+            "cached": cached
+        }
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+@app.post("/segment")
+async def segment(
+    images: List[UploadFile] = File(...),
+    mode: str = Form("resize")
+):
+    try:
+        if segmenter is None:
+            return {"success": False, "error": "Segmentation model not available"}
+        pil_images = [decode_image(await image.read()) for image in images]
+        return {
+            "success": True,
+            "results": segmenter.segment(pil_images, mode)
+        }
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+@app.post("/similar")
+async def similar(
+    image: UploadFile = File(...),
+    case_id: Optional[int] = Form(None),
+    k: int = Form(10),
+    exclude: str = Form("")
+):
+    """Nearest indexed cases to an image. An indexed ``case_id`` reuses its
+    stored embedding; otherwise the image is embedded (and indexed under
+    ``case_id`` if given)."""
+    try:
+        if similar_cases is None:
+            return {"success": False, "error": "Similar-case index not enabled"}
+        start = time.perf_counter()
+        embedding = similar_cases.get(case_id) if case_id is not None else None
+        if embedding is None:
+            image_tensor = preprocess_image(decode_image(await image.read()))
+            with torch.no_grad():
+                embedding = model_manager.current().model.cnn(image_tensor)[0].numpy()
+            if case_id is not None:
+                similar_cases.add(case_id, embedding)
+        excluded = {int(x) for x in exclude.split(",") if x.strip()}
+        if case_id is not None:
+            excluded.add(case_id)
+        neighbors = similar_cases.search(embedding, k, exclude=excluded)
+        return {
+            "success": True,
+            "neighbors": [{"case_id": neighbor, "similarity": round(score, 4)} for neighbor, score in neighbors],
+            "search_ms": round((time.perf_counter() - start) * 1000, 2)
+        }
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+
+
+def require_admin(x_admin_token):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled; set ADMIN_TOKEN")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/admin/models")
+def list_models(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    loaded = model_manager.current()
+    return {
+        "active_version": loaded.version,
+        "loader": model_manager.status,
+        "registry": registry.read_manifest()
+    }
+
+
+def load_model_version(version):
+    try:
+        model_manager.load_and_swap(version)
+    except Exception:
+        # The failure is recorded in model_manager.status for /admin/models.
+        pass
+
+
+@app.post("/admin/models/load")
+def load_model(
+    background_tasks: BackgroundTasks,
+    version: str = Form(...),
+    x_admin_token: str = Header("")
+):
+    require_admin(x_admin_token)
+    try:
+        registry.entry(version)
+    except RegistryError as e:
+        return {"success": False, "error": str(e)}
+    if model_manager.is_loading():
+        return {"success": False, "error": "Another model version is already being loaded"}
+
+    # Loading, checksum verification and warm-up run after the response is
+    # sent; /predict keeps serving the current version until the swap.
+    background_tasks.add_task(load_model_version, version)
+    return {"success": True, "status": "loading", "version": version}
+
+
+@app.get("/admin/tta")
+def get_tta(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    return tta.summary()
+
+
+@app.get("/admin/cascade")
+def get_cascade(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    return cascade.summary()
+
+
+@app.get("/admin/gradcam")
+def get_gradcam(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    # Explained requests are timed separately from plain scoring, so the two
+    # latency summaries give the Grad-CAM overhead under real traffic.
+    return {**explainer.summary(), "plain_forward": experiment.summary()["models"]}
+
+
+@app.get("/admin/calibration")
+def get_calibration(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    version = model_manager.current().version
+    calibrator = calibrations.get(version)
+    return {
+        "active_version": version,
+        "method": calibrator.method,
+        "metrics": calibrator.metrics,
+        "thresholds": thresholds.to_dict()
+    }
+
+
+@app.post("/admin/calibration/reload")
+def reload_calibration(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    calibrations.reload()
+    return {"success": True}
+
+
+@app.get("/admin/similarity")
+def get_similarity(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    if similar_cases is None:
+        return {"mode": "off"}
+    return {"mode": "on", **similar_cases.summary()}
+
+
+@app.post("/admin/similarity/train")
+def train_similarity(
+    background_tasks: BackgroundTasks,
+    nlist: int = Form(1024),
+    x_admin_token: str = Header("")
+):
+    require_admin(x_admin_token)
+    if similar_cases is None:
+        return {"success": False, "error": "Similar-case index not enabled"}
+    if len(similar_cases) < nlist:
+        return {"success": False, "error": f"Need at least {nlist} indexed cases, have {len(similar_cases)}"}
+    # Searches keep using the current lists until the rebuilt segment is in place.
+    background_tasks.add_task(similar_cases.train, nlist)
+    return {"success": True, "status": "training", "nlist": nlist}
+
+
+@app.post("/admin/similarity/reload")
+def reload_similarity(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    if similar_cases is None:
+        return {"success": False, "error": "Similar-case index not enabled"}
+    similar_cases.load()
+    return {"success": True, **similar_cases.summary()}
+
+
+def load_candidate_version(version):
+    try:
+        candidate_manager.load_and_swap(version, persist=False)
+    except Exception:
+        # Reported through candidate_loader in /admin/experiment.
+        pass
+
+
+@app.post("/admin/candidate/load")
+def load_candidate(
+    background_tasks: BackgroundTasks,
+    version: str = Form(...),
+    x_admin_token: str = Header("")
+):
+    require_admin(x_admin_token)
+    try:
+        registry.entry(version)
+    except RegistryError as e:
+        return {"success": False, "error": str(e)}
+    if candidate_manager.is_loading():
+        return {"success": False, "error": "Another candidate version is already being loaded"}
+
+    background_tasks.add_task(load_candidate_version, version)
+    return {"success": True, "status": "loading", "version": version}
+
+
+@app.get("/admin/experiment")
+def get_experiment(x_admin_token: str = Header("")):
+    require_admin(x_admin_token)
+    return experiment.summary()
+
+
+@app.post("/admin/experiment")
+def configure_experiment(
+    mode: str = Form(...),
+    shadow_fraction: float = Form(0.0),
+    ab_weight: float = Form(0.0),
+    x_admin_token: str = Header("")
+):
+    require_admin(x_admin_token)
+    try:
+        experiment.configure(mode, shadow_fraction, ab_weight)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    return {"success": True, **experiment.summary()}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
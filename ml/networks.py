@@ -0,0 +1,131 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torchvision import models
+
+
+class MultimodalModel(nn.Module):
+    def __init__(self, num_metadata_features, pretrained=False):
+        super().__init__()
+
+        self.cnn = models.resnet18(pretrained=pretrained)
+        self.cnn.fc = nn.Identity()
+        img_features = 512
+
+        self.metadata_fc = nn.Sequential(
+            nn.Linear(num_metadata_features, 32),
+            nn.ReLU(),
+            nn.BatchNorm1d(32)
+        )
+
+        self.classifier = nn.Sequential(
+            nn.Linear(img_features + 32, 64),
+            nn.ReLU(),
+            nn.Dropout(0.3),
+            nn.Linear(64, 1)
+        )
+
+    def forward(self, image, metadata=None):
+        img_out = self.cnn(image)
+        if metadata is not None:
+            meta_out = self.metadata_fc(metadata)
+            combined = torch.cat([img_out, meta_out], dim=1)
+        else:
+            combined = img_out
+        return self.classifier(combined)
+
+
+class ScreeningModel(nn.Module):
+    """Small MobileNetV3 student used as the first stage of the cascade.
+
+    Takes the same inputs as MultimodalModel, usually at a lower resolution.
+    """
+
+    def __init__(self, num_metadata_features, pretrained=False):
+        super().__init__()
+
+        self.cnn = models.mobilenet_v3_small(pretrained=pretrained)
+        self.cnn.classifier = nn.Identity()
+        img_features = 576
+
+        self.metadata_fc = nn.Sequential(
+            nn.Linear(num_metadata_features, 16),
+            nn.ReLU(),
+            nn.BatchNorm1d(16)
+        )
+
+        self.classifier = nn.Sequential(
+            nn.Linear(img_features + 16, 32),
+            nn.ReLU(),
+            nn.Dropout(0.2),
+            nn.Linear(32, 1)
+        )
+
+    def forward(self, image, metadata=None):
+        img_out = self.cnn(image)
+        if metadata is not None:
+            meta_out = self.metadata_fc(metadata)
+            combined = torch.cat([img_out, meta_out], dim=1)
+        else:
+            combined = img_out
+        return self.classifier(combined)
+
+
+class UNet(nn.Module):
+    """UNet from segmentation.ipynb.
+
+    ``base_channels=64`` is the notebook architecture (1024-channel
+    bottleneck) and loads its checkpoints unchanged; smaller values give a
+    proportionally lighter network with the same layer names.
+    """
+
+    def __init__(self, n_channels, n_classes, base_channels=64):
+        super(UNet, self).__init__()
+        self.n_channels = n_channels
+        self.n_classes = n_classes
+        self.base_channels = base_channels
+        c1, c2, c3, c4, c5 = (base_channels * m for m in (1, 2, 4, 8, 16))
+
+        # Contracting path (encoder)
+        self.conv1 = nn.Conv2d(self.n_channels, c1, kernel_size=3, padding=1)
+        self.conv2 = nn.Conv2d(c1, c2, kernel_size=3, padding=1)
+        self.conv3 = nn.Conv2d(c2, c3, kernel_size=3, padding=1)
+        self.conv4 = nn.Conv2d(c3, c4, kernel_size=3, padding=1)
+        self.conv5 = nn.Conv2d(c4, c5, kernel_size=3, padding=1)
+        self.pool = nn.MaxPool2d(kernel_size=2, stride=2)
+
+        # Expansive path (decoder)
+        self.upconv1 = nn.ConvTranspose2d(c5, c4, kernel_size=2, stride=2)
+        self.conv6 = nn.Conv2d(c5, c4, kernel_size=3, padding=1)
+        self.upconv2 = nn.ConvTranspose2d(c4, c3, kernel_size=2, stride=2)
+        self.conv7 = nn.Conv2d(c4, c3, kernel_size=3, padding=1)
+        self.upconv3 = nn.ConvTranspose2d(c3, c2, kernel_size=2, stride=2)
+        self.conv8 = nn.Conv2d(c3, c2, kernel_size=3, padding=1)
+        self.upconv4 = nn.ConvTranspose2d(c2, c1, kernel_size=2, stride=2)
+        self.conv9 = nn.Conv2d(c2, c1, kernel_size=3, padding=1)
+        self.conv10 = nn.Conv2d(c1, self.n_classes, kernel_size=1)
+
+    def forward(self, x):
+        # Contracting path (encoder)
+        x1 = F.relu(self.conv1(x))
+        x2 = F.relu(self.conv2(self.pool(x1)))
+        x3 = F.relu(self.conv3(self.pool(x2)))
+        x4 = F.relu(self.conv4(self.pool(x3)))
+        x5 = F.relu(self.conv5(self.pool(x4)))
+
+        # Expansive path (decoder)
+        x6 = F.relu(self.upconv1(x5))
+        x6 = torch.cat([x4, x6], dim=1)
+        x6 = F.relu(self.conv6(x6))
+        x7 = F.relu(self.upconv2(x6))
+        x7 = torch.cat([x3, x7], dim=1)
+        x7 = F.relu(self.conv7(x7))
+        x8 = F.relu(self.upconv3(x7))
+        x8 = torch.cat([x2, x8], dim=1)
+        x8 = F.relu(self.conv8(x8))
+        x9 = F.relu(self.upconv4(x8))
+        x9 = torch.cat([x1, x9], dim=1)
+        x9 = F.relu(self.conv9(x9))
+        x10 = self.conv10(x9)
+
+        return x10
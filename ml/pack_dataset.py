@@ -0,0 +1,173 @@
+"""Pack training data into memory-mappable shards.
+
+    python pack_dataset.py multimodal --metadata-csv metadata.csv --output data/multimodal
+    python pack_dataset.py isic --images-path ISIC2018_Task1-2_Training_Input \\
+        --masks-path ISIC2018_Task1_Training_GroundTruth --output data/isic
+
+Every image is decoded and resized once, in parallel, and written into fixed
+size .npy shards next to an index.json. PackedMultimodalDataset and
+PackedSegmentationDataset in datasets.py read the result.
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+
+from datasets import METADATA_COLS, FITZ_PATH, PAD_BASE_PATH, load_metadata, resolve_image_path
+from featurizer import encode_frame
+
+FORMAT_VERSION = 1
+
+
+def read_resized(path, size, flags=cv2.IMREAD_COLOR):
+    image = cv2.imread(path, flags) if path else None
+    if image is None:
+        return None
+    interpolation = cv2.INTER_AREA if min(image.shape[:2]) > size else cv2.INTER_LINEAR
+    return cv2.resize(image, (size, size), interpolation=interpolation)
+
+
+def load_multimodal_image(job):
+    path, size = job
+    image = read_resized(path, size)
+    if image is None:
+        return np.zeros((size, size, 3), dtype=np.uint8), False
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), True
+
+
+def load_isic_pair(job):
+    image_path, mask_path, size = job
+    image = cv2.cvtColor(read_resized(image_path, size), cv2.COLOR_BGR2RGB)
+    # Nearest neighbour keeps the mask binary.
+    mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    mask = cv2.resize(mask, (size, size), interpolation=cv2.INTER_NEAREST)
+    return image, (mask > 127).astype(np.uint8)
+
+
+def open_shard(output, name, shard_id, shape, dtype):
+    filename = f"{name}-{shard_id:05d}.npy"
+    array = np.lib.format.open_memmap(os.path.join(output, filename), mode="w+", dtype=dtype, shape=shape)
+    return filename, array
+
+
+def write_index(output, index):
+    tmp_path = os.path.join(output, "index.json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, os.path.join(output, "index.json"))
+
+
+def pack_multimodal(args):
+    metadata = load_metadata(args.metadata_csv, args.pad_base_path)
+    size = args.image_size
+    values = encode_frame(metadata)
+    labels = metadata["binary_label"].to_numpy(dtype=np.int64)
+    paths = [
+        resolve_image_path(image_id, full_path, args.fitz_path)
+        for image_id, full_path in zip(metadata["id"], metadata["full_path"])
+    ]
+
+    shards, missing = [], 0
+    with Pool(args.workers) as pool:
+        for shard_id, start in enumerate(range(0, len(paths), args.shard_size)):
+            stop = min(start + args.shard_size, len(paths))
+            count = stop - start
+            images_file, images = open_shard(args.output, "images", shard_id, (count, size, size, 3), np.uint8)
+            jobs = [(path, size) for path in paths[start:stop]]
+            for i, (image, found) in enumerate(pool.imap(load_multimodal_image, jobs, chunksize=16)):
+                images[i] = image
+                missing += int(not found)
+            images.flush()
+
+            metadata_file = f"metadata-{shard_id:05d}.npy"
+            labels_file = f"labels-{shard_id:05d}.npy"
+            np.save(os.path.join(args.output, metadata_file), values[start:stop])
+            np.save(os.path.join(args.output, labels_file), labels[start:stop])
+            shards.append({"images": images_file, "metadata": metadata_file, "labels": labels_file, "count": count})
+            print(f"shard {shard_id}: {stop}/{len(paths)} images")
+
+    write_index(args.output, {
+        "format": FORMAT_VERSION,
+        "kind": "multimodal",
+        "image_size": size,
+        "metadata_cols": METADATA_COLS,
+        "arrays": ["images", "metadata", "labels"],
+        "shards": shards,
+        "ids": metadata["id"].tolist(),
+        "missing_images": missing,
+    })
+    return len(paths), missing
+
+
+def pack_isic(args):
+    ids = sorted(f[:-4] for f in os.listdir(args.images_path) if f.endswith(".jpg"))
+    size = args.image_size
+
+    shards = []
+    with Pool(args.workers) as pool:
+        for shard_id, start in enumerate(range(0, len(ids), args.shard_size)):
+            stop = min(start + args.shard_size, len(ids))
+            count = stop - start
+            images_file, images = open_shard(args.output, "images", shard_id, (count, size, size, 3), np.uint8)
+            masks_file, masks = open_shard(args.output, "masks", shard_id, (count, size, size), np.uint8)
+            jobs = [
+                (os.path.join(args.images_path, image_id + ".jpg"),
+                 os.path.join(args.masks_path, image_id + "_segmentation.png"),
+                 size)
+                for image_id in ids[start:stop]
+            ]
+            for i, (image, mask) in enumerate(pool.imap(load_isic_pair, jobs, chunksize=16)):
+                images[i] = image
+                masks[i] = mask
+            images.flush()
+            masks.flush()
+            shards.append({"images": images_file, "masks": masks_file, "count": count})
+            print(f"shard {shard_id}: {stop}/{len(ids)} images")
+
+    write_index(args.output, {
+        "format": FORMAT_VERSION,
+        "kind": "isic",
+        "image_size": size,
+        "arrays": ["images", "masks"],
+        "shards": shards,
+        "ids": ids,
+    })
+    return len(ids), 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack a training set into memory-mappable shards")
+    subparsers = parser.add_subparsers(dest="kind", required=True)
+
+    multimodal = subparsers.add_parser("multimodal", help="metadata.csv + images for MultimodalModel")
+    multimodal.add_argument("--metadata-csv", required=True)
+    multimodal.add_argument("--fitz-path", default=FITZ_PATH)
+    multimodal.add_argument("--pad-base-path", default=PAD_BASE_PATH)
+    multimodal.add_argument("--image-size", type=int, default=224)
+
+    isic = subparsers.add_parser("isic", help="ISIC 2018 task 1 images and masks for the UNet")
+    isic.add_argument("--images-path", required=True)
+    isic.add_argument("--masks-path", required=True)
+    isic.add_argument("--image-size", type=int, default=256)
+
+    for subparser in (multimodal, isic):
+        subparser.add_argument("--output", required=True)
+        subparser.add_argument("--shard-size", type=int, default=4096)
+        subparser.add_argument("--workers", type=int, default=os.cpu_count())
+
+    args = parser.parse_args()
+    os.makedirs(args.output, exist_ok=True)
+
+    start = time.perf_counter()
+    pack = pack_multimodal if args.kind == "multimodal" else pack_isic
+    count, missing = pack(args)
+    elapsed = time.perf_counter() - start
+    print(f"Packed {count} samples ({missing} missing images) in {elapsed:.1f}s into {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""Local registry of versioned MultimodalModel checkpoints.
+
+Layout on disk:
+
+    models/registry/
+        manifest.json
+        <version>/model.pth
+
+The manifest records, per version, the checkpoint file, its sha256 and the
+number of metadata features the model was trained with, plus which version
+is active. The service loads the active version at startup and can swap in
+another one at runtime through ``ModelManager.load_and_swap``.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timezone
+
+import torch
+
+from networks import MultimodalModel
+
+MANIFEST_NAME = "manifest.json"
+CHECKPOINT_NAME = "model.pth"
+
+
+class RegistryError(Exception):
+    pass
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_model(state_dict_path, num_metadata_features, device):
+    model = MultimodalModel(num_metadata_features=num_metadata_features, pretrained=False)
+    model.load_state_dict(torch.load(state_dict_path, map_location=device))
+    model.to(device)
+    model.eval()
+    return model
+
+
+class ModelRegistry:
+    def __init__(self, root):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+
+    def read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {"active": None, "versions": {}}
+        with open(self.manifest_path) as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+
+    def entry(self, version):
+        versions = self.read_manifest()["versions"]
+        if version not in versions:
+            raise RegistryError(f"Unknown model version: {version}")
+        return versions[version]
+
+    def active_version(self):
+        return self.read_manifest()["active"]
+
+    def register(self, checkpoint_path, version, num_metadata_features=17, notes=""):
+        manifest = self.read_manifest()
+        if version in manifest["versions"]:
+            raise RegistryError(f"Version already registered: {version}")
+
+        version_dir = os.path.join(self.root, version)
+        os.makedirs(version_dir, exist_ok=True)
+        shutil.copyfile(checkpoint_path, os.path.join(version_dir, CHECKPOINT_NAME))
+
+        entry = {
+            "file": os.path.join(version, CHECKPOINT_NAME),
+            "sha256": file_sha256(os.path.join(version_dir, CHECKPOINT_NAME)),
+            "num_metadata_features": num_metadata_features,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "notes": notes,
+        }
+        manifest["versions"][version] = entry
+        self._write_manifest(manifest)
+        return entry
+
+    def set_active(self, version):
+        manifest = self.read_manifest()
+        if version not in manifest["versions"]:
+            raise RegistryError(f"Unknown model version: {version}")
+        manifest["active"] = version
+        self._write_manifest(manifest)
+
+    def verify(self, version):
+        entry = self.entry(version)
+        path = os.path.join(self.root, entry["file"])
+        if not os.path.exists(path):
+            raise RegistryError(f"Checkpoint missing for {version}: {path}")
+        checksum = file_sha256(path)
+        if checksum != entry["sha256"]:
+            raise RegistryError(f"Checksum mismatch for {version}: expected {entry['sha256']}, got {checksum}")
+        return path
+
+    def load(self, version, device):
+        path = self.verify(version)
+        return build_model(path, self.entry(version)["num_metadata_features"], device)
+
+
+class LoadedModel:
+    __slots__ = ("version", "model", "num_metadata_features")
+
+    def __init__(self, version, model, num_metadata_features):
+        self.version = version
+        self.model = model
+        self.num_metadata_features = num_metadata_features
+
+
+def warm_up(model, num_metadata_features, device, image_size=224, iterations=3):
+    image = torch.zeros(1, 3, image_size, image_size, device=device)
+    metadata = torch.zeros(1, num_metadata_features, device=device)
+    with torch.no_grad():
+        for _ in range(iterations):
+            model(image, metadata)
+
+
+class ModelManager:
+    """Holds the model currently used for serving.
+
+    Request handlers call ``current()`` once and use the returned
+    ``LoadedModel`` for the whole request, so a swap never affects a request
+    that is already running: it keeps its reference to the old model, which
+    is released once the last such request finishes.
+    """
+
+    def __init__(self, registry, device):
+        self.registry = registry
+        self.device = device
+        self._current = None
+        self._load_lock = threading.Lock()
+        self.status = {"state": "idle", "version": None, "error": None, "load_seconds": None}
+
+    def current(self):
+        return self._current
+
+    def is_loading(self):
+        return self._load_lock.locked()
+
+    def load_initial(self, legacy_path):
+        active = self.registry.active_version()
+        if active:
+            self.load_and_swap(active, persist=False)
+        elif os.path.exists(legacy_path):
+            model = build_model(legacy_path, 17, self.device)
+            self._current = LoadedModel("legacy", model, 17)
+        else:
+            raise RegistryError(f"No active model in {self.registry.root} and no checkpoint at {legacy_path}")
+
+    def load_and_swap(self, version, persist=True):
+        if not self._load_lock.acquire(blocking=False):
+            raise RegistryError("Another model version is already being loaded")
+        try:
+            self.status = {"state": "loading", "version": version, "error": None, "load_seconds": None}
+            start = time.perf_counter()
+            try:
+                num_features = self.registry.entry(version)["num_metadata_features"]
+                model = self.registry.load(version, self.device)
+                warm_up(model, num_features, self.device)
+            except Exception as e:
+                self.status = {"state": "failed", "version": version, "error": str(e), "load_seconds": None}
+                raise
+
+            self._current = LoadedModel(version, model, num_features)
+            if persist:
+                self.registry.set_active(version)
+            self.status = {
+                "state": "ready",
+                "version": version,
+                "error": None,
+                "load_seconds": round(time.perf_counter() - start, 3),
+            }
+        finally:
+            self._load_lock.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the local model registry")
+    parser.add_argument("--root", default=os.getenv("MODEL_REGISTRY_DIR", "models/registry"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    register_parser = subparsers.add_parser("register", help="Add a checkpoint as a new version")
+    register_parser.add_argument("checkpoint")
+    register_parser.add_argument("--version", required=True)
+    register_parser.add_argument("--num-metadata-features", type=int, default=17)
+    register_parser.add_argument("--notes", default="")
+    register_parser.add_argument("--activate", action="store_true")
+
+    subparsers.add_parser("list", help="Show registered versions")
+
+    verify_parser = subparsers.add_parser("verify", help="Check stored checksums")
+    verify_parser.add_argument("version", nargs="?")
+
+    args = parser.parse_args()
+    registry = ModelRegistry(args.root)
+
+    if args.command == "register":
+        entry = registry.register(args.checkpoint, args.version, args.num_metadata_features, args.notes)
+        if args.activate:
+            registry.set_active(args.version)
+        print(json.dumps({args.version: entry}, indent=2))
+    elif args.command == "list":
+        print(json.dumps(registry.read_manifest(), indent=2))
+    elif args.command == "verify":
+        versions = [args.version] if args.version else list(registry.read_manifest()["versions"])
+        for version in versions:
+            registry.verify(version)
+            print(f"{version}: ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Lesion segmentation with the UNet from segmentation.ipynb.
+
+Images are either resized to the 256x256 training resolution as a whole
+(``resize``) or, for large photos, split into overlapping 256x256 tiles at a
+capped working resolution whose logits are averaged where tiles overlap
+(``tiled``). Masks are returned at the original image size as row-major
+run-length encodings together with the lesion bounding box.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from networks import UNet
+
+SIZE = 256
+MODES = ("resize", "tiled", "auto")
+
+
+def load_unet(path, device):
+    checkpoint = torch.load(path, map_location=device)
+    # The notebook saves both bare state dicts and {'state_dict': ...} checkpoints.
+    state_dict = checkpoint.get("state_dict", checkpoint)
+    base_channels = state_dict["conv1.weight"].shape[0]
+    model = UNet(n_channels=3, n_classes=1, base_channels=base_channels)
+    model.load_state_dict(state_dict)
+    model.to(device, memory_format=torch.channels_last)
+    model.eval()
+    return model
+
+
+def image_to_tensor(image):
+    """PIL RGB image -> (1, 3, H, W) float tensor in [0, 1], as in ISICDataset."""
+    array = np.array(image, dtype=np.uint8)
+    return torch.from_numpy(array).permute(2, 0, 1).unsqueeze(0).float() / 255.
+
+
+def rle_encode(mask):
+    """Row-major run lengths, starting with a (possibly empty) run of zeros."""
+    flat = mask.ravel()
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat.size and flat[0]:
+        counts = np.concatenate(([0], counts))
+    return {"size": list(mask.shape), "counts": counts.tolist()}
+
+
+def rle_decode(rle):
+    height, width = rle["size"]
+    values = np.arange(len(rle["counts"])) % 2 == 1
+    return np.repeat(values, rle["counts"]).reshape(height, width)
+
+
+def bounding_box(mask):
+    """[x0, y0, x1, y1] with exclusive x1/y1, or None for an empty mask."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return [int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1]
+
+
+def expand_box(box, width, height, margin=0.1):
+    x0, y0, x1, y1 = box
+    dx = int((x1 - x0) * margin)
+    dy = int((y1 - y0) * margin)
+    return (max(0, x0 - dx), max(0, y0 - dy), min(width, x1 + dx), min(height, y1 + dy))
+
+
+def tile_origins(length, tile, stride):
+    if length <= tile:
+        return [0]
+    origins = list(range(0, length - tile, stride))
+    origins.append(length - tile)
+    return origins
+
+
+class Segmenter:
+    def __init__(self, model_path, device, max_batch=8, tile_overlap=32, max_working_side=1024):
+        self.device = device
+        self.model = load_unet(model_path, device)
+        self.max_batch = max_batch
+        self.tile_overlap = tile_overlap
+        self.max_working_side = max_working_side
+
+    def _forward(self, batch):
+        outputs = []
+        with torch.inference_mode():
+            for chunk in torch.split(batch, self.max_batch):
+                chunk = chunk.to(self.device).contiguous(memory_format=torch.channels_last)
+                outputs.append(self.model(chunk))
+        return torch.cat(outputs)
+
+    def _resize_logits(self, tensors):
+        batch = torch.cat([
+            F.interpolate(t, size=(SIZE, SIZE), mode="bilinear", align_corners=False) for t in tensors
+        ])
+        logits = self._forward(batch)
+        return [logits[i:i + 1] for i in range(len(tensors))]
+
+    def _tiled_logits(self, tensor):
+        _, _, height, width = tensor.shape
+        scale = min(1.0, self.max_working_side / max(height, width))
+        if scale < 1.0:
+            tensor = F.interpolate(tensor, scale_factor=scale, mode="bilinear", align_corners=False, antialias=True)
+        _, _, height, width = tensor.shape
+
+        pad_h, pad_w = max(0, SIZE - height), max(0, SIZE - width)
+        if pad_h or pad_w:
+            tensor = F.pad(tensor, (0, pad_w, 0, pad_h))
+        _, _, padded_h, padded_w = tensor.shape
+
+        stride = SIZE - self.tile_overlap
+        origins = [(y, x) for y in tile_origins(padded_h, SIZE, stride) for x in tile_origins(padded_w, SIZE, stride)]
+        tiles = torch.cat([tensor[:, :, y:y + SIZE, x:x + SIZE] for y, x in origins])
+        tile_logits = self._forward(tiles)
+
+        logits = torch.zeros(1, 1, padded_h, padded_w)
+        weights = torch.zeros(1, 1, padded_h, padded_w)
+        for (y, x), tile in zip(origins, tile_logits):
+            logits[:, :, y:y + SIZE, x:x + SIZE] += tile
+            weights[:, :, y:y + SIZE, x:x + SIZE] += 1
+        return (logits / weights)[:, :, :height, :width]
+
+    def masks(self, images, mode="resize"):
+        """Boolean lesion masks at each image's original size."""
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        tensors = [image_to_tensor(image) for image in images]
+
+        if mode == "auto":
+            tiled = [max(t.shape[-2:]) > 2 * SIZE for t in tensors]
+        else:
+            tiled = [mode == "tiled"] * len(tensors)
+
+        logits = [None] * len(tensors)
+        resize_indices = [i for i, use_tiles in enumerate(tiled) if not use_tiles]
+        if resize_indices:
+            for i, out in zip(resize_indices, self._resize_logits([tensors[i] for i in resize_indices])):
+                logits[i] = out
+        for i, use_tiles in enumerate(tiled):
+            if use_tiles:
+                logits[i] = self._tiled_logits(tensors[i])
+
+        masks = []
+        for tensor, out in zip(tensors, logits):
+            out = F.interpolate(out, size=tensor.shape[-2:], mode="bilinear", align_corners=False)
+            masks.append((out[0, 0] > 0).numpy())
+        return masks
+
+    def segment(self, images, mode="resize"):
+        results = []
+        for mask in self.masks(images, mode):
+            results.append({
+                "bbox": bounding_box(mask),
+                "area_fraction": round(float(mask.mean()), 4),
+                "rle": rle_encode(mask),
+            })
+        return results
+
+    def lesion(self, image, margin=0.1):
+        """(crop box or None, lesion area as a fraction of the photo) from one
+        segmentation pass."""
+        mask = self.masks([image])[0]
+        box = bounding_box(mask)
+        if box is not None:
+            box = expand_box(box, image.width, image.height, margin)
+        return box, round(float(mask.mean()), 4)
+
+    def lesion_box(self, image, margin=0.1):
+        return self.lesion(image, margin)[0]
@@ -0,0 +1,148 @@
+"""Shadow and A/B comparison of a candidate model against the active one.
+
+In ``shadow`` mode a fraction of /predict requests is scored a second time by
+the candidate on a background worker after the primary response has been
+computed. The worker has a bounded queue and a CPU-time budget, so shadow
+scoring is dropped rather than delayed when the service is busy.
+
+In ``ab`` mode a weighted share of requests is answered by the candidate
+instead of the active model.
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+MODES = ("off", "shadow", "ab")
+
+
+class ModelStats:
+    def __init__(self, max_samples=2048):
+        self.requests = 0
+        self.latencies = deque(maxlen=max_samples)
+
+    def record(self, latency):
+        self.requests += 1
+        self.latencies.append(latency)
+
+    def summary(self):
+        if not self.latencies:
+            return {"requests": self.requests, "p50_ms": None, "p99_ms": None}
+        ordered = sorted(self.latencies)
+        return {
+            "requests": self.requests,
+            "p50_ms": round(ordered[len(ordered) // 2] * 1000, 2),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+        }
+
+
+class Experiment:
+    def __init__(self, candidate_manager, score_fn, max_pending=8, cpu_budget=0.25, budget_window=10.0):
+        self.candidate_manager = candidate_manager
+        self.score_fn = score_fn
+        self.mode = "off"
+        self.shadow_fraction = 0.0
+        self.ab_weight = 0.0
+        self.max_pending = max_pending
+        self.cpu_budget = cpu_budget
+        self.budget_window = budget_window
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._busy = deque()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {}
+            self.compared = 0
+            self.agreed = 0
+            self.abs_diff_sum = 0.0
+            self.dropped = 0
+
+    def configure(self, mode, shadow_fraction=0.0, ab_weight=0.0):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        if mode != "off" and self.candidate_manager.current() is None:
+            raise ValueError("No candidate model loaded")
+        self.mode = mode
+        self.shadow_fraction = min(max(shadow_fraction, 0.0), 1.0)
+        self.ab_weight = min(max(ab_weight, 0.0), 1.0)
+        self.reset_stats()
+
+    def route(self, primary):
+        """Return the model that should answer this request."""
+        candidate = self.candidate_manager.current()
+        if self.mode == "ab" and candidate is not None and random.random() < self.ab_weight:
+            return candidate
+        return primary
+
+    def record(self, version, latency):
+        with self._lock:
+            self.stats.setdefault(version, ModelStats()).record(latency)
+
+    def _within_budget(self, now):
+        while self._busy and self._busy[0][0] < now - self.budget_window:
+            self._busy.popleft()
+        spent = sum(duration for _, duration in self._busy)
+        return spent < self.cpu_budget * self.budget_window
+
+    def maybe_shadow(self, image_tensor, metadata_tensor, primary_version, primary_probability, threshold=0.5):
+        candidate = self.candidate_manager.current()
+        if self.mode != "shadow" or candidate is None or candidate.version == primary_version:
+            return
+        if random.random() >= self.shadow_fraction:
+            return
+
+        with self._lock:
+            if self._pending >= self.max_pending or not self._within_budget(time.monotonic()):
+                self.dropped += 1
+                return
+            self._pending += 1
+
+        self._executor.submit(
+            self._run_shadow, candidate, image_tensor, metadata_tensor, primary_probability, threshold
+        )
+
+    def _run_shadow(self, candidate, image_tensor, metadata_tensor, primary_probability, threshold):
+        start = time.perf_counter()
+        try:
+            with torch.no_grad():
+                probability = self.score_fn(candidate, image_tensor, metadata_tensor)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+                self.dropped += 1
+            return
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self._pending -= 1
+            self._busy.append((time.monotonic(), latency))
+            self.stats.setdefault(candidate.version, ModelStats()).record(latency)
+            self.compared += 1
+            self.agreed += int((probability > threshold) == (primary_probability > threshold))
+            self.abs_diff_sum += abs(probability - primary_probability)
+
+    def summary(self):
+        candidate = self.candidate_manager.current()
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "candidate_version": candidate.version if candidate else None,
+                "candidate_loader": self.candidate_manager.status,
+                "shadow_fraction": self.shadow_fraction,
+                "ab_weight": self.ab_weight,
+                "models": {version: stats.summary() for version, stats in self.stats.items()},
+                "shadow": {
+                    "compared": self.compared,
+                    "agreement_rate": round(self.agreed / self.compared, 4) if self.compared else None,
+                    "mean_abs_probability_diff": round(self.abs_diff_sum / self.compared, 4) if self.compared else None,
+                    "dropped": self.dropped,
+                    "pending": self._pending,
+                },
+            }
@@ -0,0 +1,525 @@
+"""Similar-case retrieval over ResNet18 image embeddings.
+
+Each scored upload's 512-d ``model.cnn`` feature vector is L2-normalized and
+appended to an on-disk index keyed by the Django ImageUpload id. All files
+are memory-mapped at startup:
+
+    <index dir>/log.f32, log_ids.i64        rows added since the last train, append-only
+    <index dir>/packed.f32, packed_ids.i64  rows ordered by inverted list
+    <index dir>/offsets.npy                 start of each list in packed.f32
+    <index dir>/centroids.npy               IVF coarse quantizer (spherical k-means)
+
+Search is IVF-Flat: the query is compared with the centroids, the rows of
+the ``nprobe`` closest lists (one contiguous slice each, plus their log
+rows) are scored exactly by cosine similarity and the top k are returned.
+Until ``train`` has been run the log is scanned in full. ``train`` folds the
+log into a freshly clustered packed segment; rerun it as the log grows.
+
+The API server, ``train`` and ``backfill`` may run in separate processes
+at the same time: every change to the files is made under an exclusive
+lock on ``<index dir>/index.lock``, and a process that finds the files
+changed by another reloads them before appending. Searches in the server
+see another process's ``train`` after its next append or
+/admin/similarity/reload.
+
+Only the classifier head changes in incremental fine-tuning, so embeddings
+stay comparable across ``-ft`` versions of one backbone; retrain and
+backfill into a fresh directory when the backbone itself changes.
+
+    python similarity.py train --index-dir models/similarity --nlist 1024
+    python similarity.py backfill --django-project ../backend/multimodal_project
+    python similarity.py bench --vectors 1000000 --queries 200
+"""
+import argparse
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+import numpy as np
+
+DIM = 512
+MODES = ("off", "on")
+# float32 rather than float16: converting float16 rows costs more than
+# reading twice the bytes.
+VECTOR_DTYPE = np.float32
+# Log rows kept in memory after an append before the file is mapped again.
+REMAP_ROWS = 4096
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def nearest_centroids(centroids, vectors, batch_size=8192):
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        block = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+def kmeans(vectors, k, iterations=15, seed=0):
+    """Spherical k-means (cosine) on normalized ``vectors``."""
+    rng = np.random.default_rng(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(centroids, vectors)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+        # Re-seed empty lists from random points rather than leaving dead centroids.
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class capture_embedding:
+    """Records the ``model.cnn`` output of the next forward pass made by this
+    thread, so the scoring forward also yields the embedding."""
+
+    def __init__(self, model, enabled=True):
+        self.model = model
+        self.enabled = enabled
+        self.embedding = None
+        self._handle = None
+
+    def __enter__(self):
+        if self.enabled:
+            owner = threading.get_ident()
+
+            def hook(module, inputs, output):
+                # The model may be shared with other request threads.
+                if threading.get_ident() == owner and self.embedding is None:
+                    self.embedding = output[0].detach().float().cpu().numpy()
+
+            self._handle = self.model.cnn.register_forward_hook(hook)
+        return self
+
+    def __exit__(self, *exc):
+        if self._handle is not None:
+            self._handle.remove()
+        return False
+
+
+def _write_tmp(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    return tmp_path
+
+
+def _replace(path, write):
+    os.replace(_write_tmp(path, write), path)
+
+
+class SimilarityIndex:
+    """IVF-Flat index split into a packed segment, whose rows are stored
+    contiguously list by list so a probe reads one slice per list, and an
+    append-only log of rows added since the last ``train``."""
+
+    def __init__(self, root, dim=DIM, nprobe=16):
+        self.root = root
+        self.dim = dim
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def _locked(self, name="index.lock", blocking=True):
+        """Exclusive lock on a file in the index directory, across processes."""
+        with open(self.path(name), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self):
+        with self._lock, self._locked():
+            self._load()
+
+    def _sync(self):
+        """Reload if another process has appended to or rewritten the log
+        since this one last read it."""
+        stat = os.stat(self.path("log_ids.i64"))
+        if stat.st_ino != self._log_inode or stat.st_size != len(self._log_ids) * 8:
+            self._load()
+
+    def _load(self):
+        self._centroids = None
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._packed = np.empty((0, self.dim), dtype=VECTOR_DTYPE)
+        self._packed_ids = np.empty(0, dtype=np.int64)
+        if os.path.exists(self.path("centroids.npy")):
+            self._centroids = np.load(self.path("centroids.npy"))
+            self._offsets = np.load(self.path("offsets.npy"))
+            self._packed_ids = np.fromfile(self.path("packed_ids.i64"), dtype=np.int64)
+            if len(self._packed_ids):
+                self._packed = np.memmap(self.path("packed.f32"), dtype=VECTOR_DTYPE, mode="r",
+                                         shape=(len(self._packed_ids), self.dim))
+        self._packed_sorted = np.sort(self._packed_ids)
+
+        for name in ("log.f32", "log_ids.i64"):
+            open(self.path(name), "ab").close()
+        row_bytes = self.dim * np.dtype(VECTOR_DTYPE).itemsize
+        ids = np.fromfile(self.path("log_ids.i64"), dtype=np.int64)
+        count = min(os.path.getsize(self.path("log.f32")) // row_bytes, len(ids))
+        # A writer stopped between the two files; later appends must line
+        # up row for row.
+        os.truncate(self.path("log.f32"), count * row_bytes)
+        os.truncate(self.path("log_ids.i64"), count * 8)
+        self._log_ids = array("q", ids[:count].tobytes())
+        self._log_inode = os.stat(self.path("log_ids.i64")).st_ino
+        self._remap_log()
+
+        self._log_lists = []
+        if self.trained:
+            assignment = nearest_centroids(self._centroids, self._log)
+            self._log_lists = [array("q") for _ in range(len(self._centroids))]
+            for row, c in enumerate(assignment):
+                self._log_lists[c].append(row)
+
+    def _remap_log(self):
+        """Memory-map every log row written so far and drop the in-memory tail."""
+        count = len(self._log_ids)
+        self._log = (np.memmap(self.path("log.f32"), dtype=VECTOR_DTYPE, mode="r", shape=(count, self.dim))
+                     if count else np.empty((0, self.dim), dtype=VECTOR_DTYPE))
+        self._log_count = count
+        self._tail = []
+        self._tail_ids = set()
+        self._log_sorted = np.sort(np.frombuffer(self._log_ids, dtype=np.int64))
+
+    def __len__(self):
+        return len(self._packed_ids) + len(self._log_ids)
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    @staticmethod
+    def _in_sorted(sorted_ids, case_id):
+        i = np.searchsorted(sorted_ids, case_id)
+        return i < len(sorted_ids) and sorted_ids[i] == case_id
+
+    def __contains__(self, case_id):
+        with self._lock:
+            return self._contains(case_id)
+
+    def _contains(self, case_id):
+        return (case_id in self._tail_ids or self._in_sorted(self._log_sorted, case_id)
+                or self._in_sorted(self._packed_sorted, case_id))
+
+    def get(self, case_id):
+        """Stored (normalized) embedding of ``case_id``, or None."""
+        with self._lock:
+            packed = np.flatnonzero(self._packed_ids == case_id) if self._in_sorted(self._packed_sorted, case_id) else []
+            if len(packed):
+                return np.array(self._packed[packed[0]])
+            log = np.flatnonzero(np.frombuffer(self._log_ids, dtype=np.int64) == case_id)
+            return self._log_vectors(log[:1])[0] if len(log) else None
+
+    def _log_vectors(self, rows):
+        """Vectors of sorted log ``rows``, from the memory map or the tail
+        appended since it was last mapped."""
+        mapped = rows[rows < self._log_count]
+        out = np.asarray(self._log[mapped])
+        if len(mapped) < len(rows):
+            tail = np.stack([self._tail[r - self._log_count] for r in rows[len(mapped):]])
+            out = np.concatenate([out, tail])
+        return out
+
+    def add(self, case_id, embedding):
+        """Append one embedding; a case already indexed is left unchanged."""
+        return self.add_many([case_id], [embedding])
+
+    def add_many(self, case_ids, embeddings):
+        vectors = normalize(np.asarray(embeddings).reshape(-1, self.dim)).astype(VECTOR_DTYPE)
+        with self._lock, self._locked():
+            self._sync()
+            keep, seen = [], set()
+            for i, case_id in enumerate(case_ids):
+                case_id = int(case_id)
+                if case_id not in seen and not self._contains(case_id):
+                    keep.append(i)
+                    seen.add(case_id)
+            if not keep:
+                return 0
+            vectors = vectors[keep]
+            ids = np.asarray([int(case_ids[i]) for i in keep], dtype=np.int64)
+            # Vectors before ids: a row counts only once its id is written.
+            with open(self.path("log.f32"), "ab") as f:
+                vectors.tofile(f)
+            with open(self.path("log_ids.i64"), "ab") as f:
+                ids.tofile(f)
+
+            assignment = nearest_centroids(self._centroids, vectors) if self.trained else None
+            for i, (case_id, vector) in enumerate(zip(ids, vectors)):
+                row = len(self._log_ids)
+                self._log_ids.append(int(case_id))
+                self._tail.append(vector)
+                self._tail_ids.add(int(case_id))
+                if assignment is not None:
+                    self._log_lists[assignment[i]].append(row)
+            if len(self._tail) >= REMAP_ROWS:
+                self._remap_log()
+            return len(ids)
+
+    def search(self, embedding, k=10, exclude=(), nprobe=None):
+        """Top-k (case id, cosine similarity), most similar first."""
+        query = normalize(np.asarray(embedding).reshape(self.dim))
+        exclude = set(exclude)
+        scores, ids = [], []
+        with self._lock:
+            if self.trained:
+                probes = np.argsort(-(self._centroids @ query))[:nprobe or self.nprobe]
+                for c in probes:
+                    start, end = self._offsets[c], self._offsets[c + 1]
+                    if end > start:
+                        scores.append(np.asarray(self._packed[start:end]) @ query)
+                        ids.append(self._packed_ids[start:end])
+                log_rows = np.sort(np.concatenate([np.frombuffer(self._log_lists[c], dtype=np.int64)
+                                                   for c in probes]))
+            else:
+                log_rows = np.arange(len(self._log_ids))
+            if len(log_rows):
+                scores.append(self._log_vectors(log_rows) @ query)
+                ids.append(np.frombuffer(self._log_ids, dtype=np.int64)[log_rows])
+        if not scores:
+            return []
+        scores, ids = np.concatenate(scores), np.concatenate(ids)
+
+        top = np.argsort(-scores)[:k + len(exclude)]
+        results = [(int(ids[i]), float(scores[i])) for i in top if int(ids[i]) not in exclude]
+        return results[:k]
+
+    def train(self, nlist, sample_size=100_000, seed=0, batch_size=50_000):
+        """Fit the coarse quantizer on a sample, then rewrite every row into
+        a packed segment ordered by list. Rows added while this runs, by
+        this process or another, stay in the log. One train at a time per
+        index directory."""
+        try:
+            with self._locked("train.lock", blocking=False):
+                self._train(nlist, sample_size, seed, batch_size)
+        except BlockingIOError:
+            raise RuntimeError(f"{self.root} is already being trained") from None
+
+    def _train(self, nlist, sample_size, seed, batch_size):
+        with self._lock, self._locked():
+            self._sync()
+            log_count = len(self._log_ids)
+            if log_count > self._log_count:
+                self._remap_log()
+            packed, packed_ids, log = self._packed, self._packed_ids, self._log
+            ids = np.concatenate([packed_ids, np.frombuffer(self._log_ids, dtype=np.int64)[:log_count]])
+        total = len(ids)
+        if total < nlist:
+            raise ValueError(f"need at least {nlist} vectors to train {nlist} lists, have {total}")
+
+        def rows(selection):
+            selection = np.asarray(selection)
+            in_packed = selection < len(packed)
+            out = np.empty((len(selection), self.dim), dtype=VECTOR_DTYPE)
+            out[in_packed] = packed[selection[in_packed]]
+            out[~in_packed] = log[selection[~in_packed] - len(packed)]
+            return out
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(total, size=min(sample_size, total), replace=False))
+        centroids = kmeans(rows(sample), nlist, seed=seed)
+        # A crash between replacing the packed segment and trimming the log
+        # leaves rows in both; keep one copy of each id.
+        _, first = np.unique(ids, return_index=True)
+        first.sort()
+        assignment = np.concatenate([nearest_centroids(centroids, rows(first[i:i + batch_size]))
+                                     for i in range(0, len(first), batch_size)])
+        order = first[np.argsort(assignment, kind="stable")]
+        offsets = np.searchsorted(np.sort(assignment), np.arange(nlist + 1)).astype(np.int64)
+
+        def write_vectors(f):
+            for i in range(0, len(order), batch_size):
+                block = order[i:i + batch_size]
+                # Gather in row order, then restore list order.
+                within = np.argsort(block, kind="stable")
+                gathered = np.empty((len(block), self.dim), dtype=VECTOR_DTYPE)
+                gathered[within] = rows(block[within])
+                gathered.tofile(f)
+
+        # Written beside the index without the lock; only the renames below
+        # need it.
+        segment = [
+            ("packed.f32", _write_tmp(self.path("packed.f32"), write_vectors)),
+            ("packed_ids.i64", _write_tmp(self.path("packed_ids.i64"), lambda f: ids[order].tofile(f))),
+            ("offsets.npy", _write_tmp(self.path("offsets.npy"), lambda f: np.save(f, offsets))),
+            ("centroids.npy", _write_tmp(self.path("centroids.npy"), lambda f: np.save(f, centroids))),
+        ]
+
+        with self._lock, self._locked():
+            # Keep only the rows appended after the snapshot, from any process.
+            self._sync()
+            if len(self._log_ids) > self._log_count:
+                self._remap_log()
+            remaining = np.frombuffer(self._log_ids, dtype=np.int64)[log_count:].copy()
+            remaining_vectors = np.array(self._log[log_count:])
+            for name, tmp_path in segment:
+                os.replace(tmp_path, self.path(name))
+            _replace(self.path("log.f32"), lambda f: remaining_vectors.tofile(f))
+            _replace(self.path("log_ids.i64"), lambda f: remaining.tofile(f))
+            self._load()
+
+    def summary(self):
+        with self._lock:
+            sizes = np.diff(self._offsets)
+            return {
+                "vectors": len(self),
+                "packed": len(self._packed_ids),
+                "log": len(self._log_ids),
+                "trained": self.trained,
+                "nlist": len(sizes) if self.trained else 0,
+                "nprobe": self.nprobe,
+                "largest_list": int(sizes.max()) if self.trained and len(sizes) else None,
+            }
+
+
+def backfill(args):
+    """Embed stored uploads that are not in the index yet."""
+    import torch
+
+    from registry import ModelRegistry
+    from training.incremental import read_image, setup_django, transform
+
+    setup_django(args.django_project)
+    from api.models import ImageUpload
+
+    index = SimilarityIndex(args.index_dir)
+    registry = ModelRegistry(args.registry)
+    model = registry.load(args.version or registry.active_version(), torch.device("cpu")).eval()
+
+    added = missing = 0
+    batch_ids, batch_images = [], []
+
+    def flush():
+        nonlocal added
+        with torch.no_grad():
+            embeddings = model.cnn(torch.stack(batch_images)).numpy()
+        added += index.add_many(batch_ids, embeddings)
+        batch_ids.clear()
+        batch_images.clear()
+
+    uploads = ImageUpload.objects.only("id", "image", "tier", "original").order_by("id")
+    for upload in uploads.iterator(chunk_size=500):
+        if upload.id in index:
+            continue
+        try:
+            image = read_image(upload)
+        except OSError:
+            missing += 1
+            continue
+        batch_ids.append(upload.id)
+        batch_images.append(transform(image))
+        if len(batch_ids) >= args.batch_size:
+            flush()
+    if batch_ids:
+        flush()
+    print(json.dumps({"added": added, "missing_files": missing, **index.summary()}))
+
+
+def bench(args):
+    """Recall@k and latency of IVF search against an exact scan, on
+    clustered synthetic embeddings."""
+    rng = np.random.default_rng(args.seed)
+    centers = normalize(rng.standard_normal((args.clusters, DIM)))
+    with tempfile.TemporaryDirectory() as root:
+        index = SimilarityIndex(root, nprobe=args.nprobe)
+        start = time.perf_counter()
+        for offset in range(0, args.vectors, 50_000):
+            n = min(50_000, args.vectors - offset)
+            vectors = centers[rng.integers(0, args.clusters, n)] + args.spread * rng.standard_normal((n, DIM))
+            index.add_many(np.arange(offset, offset + n), vectors)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        index.train(args.nlist, sample_size=args.sample_size)
+        trained = time.perf_counter() - start
+
+        # Exact scan over every vector already in RAM, as a flat index would.
+        base = np.array(index._packed)
+        base_ids = index._packed_ids
+        queries = normalize(centers[rng.integers(0, args.clusters, args.queries)]
+                            + args.spread * rng.standard_normal((args.queries, DIM)))
+        ann_times, exact_times, recall = [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            found = {case_id for case_id, _ in index.search(query, args.k)}
+            ann_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            exact = base_ids[np.argpartition(-(base @ query), args.k)[:args.k]]
+            exact_times.append(time.perf_counter() - start)
+            recall.append(len(found & set(exact.tolist())) / args.k)
+
+    def ms(samples, q):
+        return round(float(np.percentile(samples, q)) * 1000, 2)
+
+    print(json.dumps({
+        "vectors": args.vectors,
+        "nlist": args.nlist,
+        "nprobe": args.nprobe,
+        "k": args.k,
+        "append_seconds": round(built, 1),
+        "train_seconds": round(trained, 1),
+        f"recall_at_{args.k}": round(float(np.mean(recall)), 4),
+        "ivf": {"p50_ms": ms(ann_times, 50), "p99_ms": ms(ann_times, 99)},
+        "brute_force": {"p50_ms": ms(exact_times, 50), "p99_ms": ms(exact_times, 99)},
+    }, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similar-case embedding index")
+    parser.add_argument("--index-dir", default=os.getenv("SIMILARITY_INDEX_DIR", "models/similarity"))
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="Fit the IVF lists over the stored embeddings")
+    train_parser.add_argument("--nlist", type=int, default=1024)
+    train_parser.add_argument("--sample-size", type=int, default=100_000)
+
+    backfill_parser = subparsers.add_parser("backfill", help="Embed uploads missing from the index")
+    backfill_parser.add_argument("--django-project", default="../backend/multimodal_project")
+    backfill_parser.add_argument("--registry", default=os.getenv("MODEL_REGISTRY_DIR", "models/registry"))
+    backfill_parser.add_argument("--version", help="Registry version; defaults to the active one")
+    backfill_parser.add_argument("--batch-size", type=int, default=32)
+
+    bench_parser = subparsers.add_parser("bench", help="Recall/latency against brute force")
+    bench_parser.add_argument("--vectors", type=int, default=200_000)
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--clusters", type=int, default=2000)
+    bench_parser.add_argument("--spread", type=float, default=0.07)
+    bench_parser.add_argument("--nlist", type=int, default=1024)
+    bench_parser.add_argument("--nprobe", type=int, default=16)
+    bench_parser.add_argument("--sample-size", type=int, default=100_000)
+    bench_parser.add_argument("--k", type=int, default=10)
+    bench_parser.add_argument("--seed", type=int, default=0)
+
+    args = parser.parse_args()
+    if args.command == "train":
+        index = SimilarityIndex(args.index_dir)
+        index.train(args.nlist, sample_size=args.sample_size)
+        print(json.dumps(index.summary()))
+    elif args.command == "backfill":
+        backfill(args)
+    elif args.command == "bench":
+        bench(args)
+
+
+if __name__ == "__main__":
+    main()
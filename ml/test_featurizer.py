@@ -0,0 +1,78 @@
+"""Training/serving parity of the metadata featurizer.
+
+    python -m unittest test_featurizer      (from ml/)
+"""
+import json
+import math
+import unittest
+
+import numpy as np
+import pandas as pd
+
+import featurizer
+from featurizer import METADATA_FIELDS, MISSING, SMALL_BATCH, encode_batch, encode_frame, encode_json
+
+NUMERIC_ROW = {
+    "smoke": 1, "drink": 0, "background_father": 0, "background_mother": 1, "age": 55,
+    "gender": 1, "skin_cancer_history": 1, "cancer_history": 0, "region": 5, "itch": 1,
+    "grew": 0, "hurt": 0, "changed": 1, "bleed": 0, "elevation": 1, "biopsed": 1, "fitzpatrick": 2,
+}
+STRING_ROW = {**NUMERIC_ROW, "gender": "male", "region": "FACE", "smoke": "yes", "age": "61"}
+MIXED_ROW = {
+    **NUMERIC_ROW, "smoke": True, "drink": False, "age": None, "gender": "FEMALE", "region": "unknown",
+    "itch": None, "fitzpatrick": float("nan"), "changed": "-1",
+}
+
+
+def json_document(record):
+    # JSON has no NaN; the app sends null.
+    return json.dumps({k: (None if isinstance(v, float) and math.isnan(v) else v) for k, v in record.items()})
+
+
+class ParityTest(unittest.TestCase):
+    def assert_parity(self, records):
+        frame = encode_frame(pd.DataFrame(records, columns=METADATA_FIELDS))
+        batch = encode_batch(records)
+        served = encode_json([json_document(record) for record in records])
+        self.assertEqual(batch.shape, (len(records), len(METADATA_FIELDS)))
+        np.testing.assert_array_equal(frame, batch)
+        np.testing.assert_array_equal(batch, served)
+        # One request at a time, as /predict encodes it.
+        np.testing.assert_array_equal(np.vstack([encode_json([json_document(r)]) for r in records]), served)
+        return batch
+
+    def test_numeric_rows(self):
+        for n in (3, SMALL_BATCH, SMALL_BATCH * 3):
+            with self.subTest(rows=n):
+                batch = self.assert_parity([NUMERIC_ROW] * n)
+                np.testing.assert_array_equal(batch[0], [float(NUMERIC_ROW[f]) for f in METADATA_FIELDS])
+
+    def test_string_rows(self):
+        for n in (2, SMALL_BATCH + 1):
+            with self.subTest(rows=n):
+                batch = self.assert_parity([STRING_ROW, NUMERIC_ROW] * (n // 2) + [STRING_ROW] * (n % 2))
+                # LabelEncoder order: FEMALE=0, MALE=1; FACE is the sixth region.
+                self.assertEqual(batch[0, METADATA_FIELDS.index("gender")], 1.0)
+                self.assertEqual(batch[0, METADATA_FIELDS.index("region")], featurizer.REGIONS.index("FACE"))
+                self.assertEqual(batch[0, METADATA_FIELDS.index("smoke")], 1.0)
+                self.assertEqual(batch[0, METADATA_FIELDS.index("age")], 61.0)
+
+    def test_booleans_and_missing_values(self):
+        for n in (1, SMALL_BATCH, SMALL_BATCH * 2 + 1):
+            with self.subTest(rows=n):
+                batch = self.assert_parity([MIXED_ROW, NUMERIC_ROW] * (n // 2) + [MIXED_ROW] * (n % 2))
+                row = dict(zip(METADATA_FIELDS, batch[0]))
+                self.assertEqual((row["smoke"], row["drink"]), (1.0, 0.0))
+                self.assertEqual(row["gender"], 0.0)
+                for name in ("age", "region", "itch", "fitzpatrick", "changed"):
+                    self.assertEqual(row[name], MISSING, name)
+
+    def test_small_and_large_batches_agree(self):
+        records = [NUMERIC_ROW, STRING_ROW, MIXED_ROW] * SMALL_BATCH
+        large = encode_batch(records)
+        small = np.vstack([encode_batch(records[i:i + 2]) for i in range(0, len(records), 2)])
+        np.testing.assert_array_equal(large, small)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""DDP scaling benchmark on synthetic data with the gloo backend.
+
+    python -m training.bench_scaling --world-sizes 1 2 4 8 --model multimodal
+
+Spawns each world size on this machine, splitting the CPU cores evenly
+between processes, and reports training samples/sec and scaling efficiency
+relative to one process.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+
+from networks import MultimodalModel, UNet
+
+
+def build(model_name, batch_size):
+    if model_name == "unet":
+        model = UNet(n_channels=3, n_classes=1, base_channels=16)
+        inputs = (torch.rand(batch_size, 3, 256, 256),)
+        targets = (torch.rand(batch_size, 1, 256, 256) > 0.5).float()
+    else:
+        model = MultimodalModel(num_metadata_features=17, pretrained=False)
+        inputs = (torch.rand(batch_size, 3, 224, 224), torch.rand(batch_size, 17))
+        targets = (torch.rand(batch_size, 1) > 0.5).float()
+    return model, inputs, targets
+
+
+def worker(rank, world_size, args, port, results):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+
+    torch.manual_seed(0)
+    model, inputs, targets = build(args.model, args.batch_size)
+    model = model.to(memory_format=torch.channels_last)
+    inputs = (inputs[0].contiguous(memory_format=torch.channels_last),) + inputs[1:]
+    model = DistributedDataParallel(model)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    criterion = nn.BCEWithLogitsLoss()
+
+    def step():
+        optimizer.zero_grad(set_to_none=True)
+        loss = criterion(model(*inputs), targets)
+        loss.backward()
+        optimizer.step()
+
+    for _ in range(args.warmup):
+        step()
+    dist.barrier()
+    start = time.perf_counter()
+    for _ in range(args.steps):
+        step()
+    dist.barrier()
+    elapsed = torch.tensor([time.perf_counter() - start])
+    dist.all_reduce(elapsed, op=dist.ReduceOp.MAX)
+
+    if rank == 0:
+        samples = world_size * args.batch_size * args.steps
+        results.put({
+            "processes": world_size,
+            "threads_per_process": torch.get_num_threads(),
+            "seconds": round(elapsed.item(), 2),
+            "samples_per_sec": round(samples / elapsed.item(), 2),
+        })
+    dist.destroy_process_group()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DDP training throughput on CPU")
+    parser.add_argument("--world-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--model", choices=["multimodal", "unet"], default="multimodal")
+    parser.add_argument("--batch-size", type=int, default=16, help="Per-process batch size")
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--port", type=int, default=29517)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    rows = []
+    for i, world_size in enumerate(args.world_sizes):
+        results = ctx.SimpleQueue()
+        mp.start_processes(worker, args=(world_size, args, args.port + i, results), nprocs=world_size,
+                           join=True, start_method="spawn")
+        row = results.get()
+        base = rows[0]["samples_per_sec"] / rows[0]["processes"] if rows else row["samples_per_sec"] / world_size
+        row["efficiency"] = round(row["samples_per_sec"] / (base * world_size), 2)
+        rows.append(row)
+        print(f"{world_size} processes: {row['samples_per_sec']} samples/s (efficiency {row['efficiency']})")
+
+    print(json.dumps({"model": args.model, "batch_size": args.batch_size, "results": rows}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Command line entry point, run from the ml/ directory:
+
+    python -m training multimodal --packed data/multimodal --output-dir runs/clinic-1
+    python -m training multimodal --metadata-csv metadata.csv --fitz-path ... --output-dir runs/clinic-1
+    python -m training unet --packed data/isic --output-dir runs/unet-1
+
+Under torchrun the same commands train with DistributedDataParallel (see
+training/distributed.py). Writes the best weights as a bare state dict
+(best_multimodal_model.pth is loadable by inference_api.py and registry.py),
+val_predictions.npz with its validation logits for calibration.py, last.pt
+for --resume and history.jsonl with per-epoch metrics and throughput.
+"""
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.parallel import DistributedDataParallel
+
+from datasets import FITZ_PATH, METADATA_COLS, PAD_BASE_PATH
+from networks import MultimodalModel, UNet
+from training import distributed
+from training.checkpoint import load_checkpoint, save_checkpoint, save_weights
+from training.data import build_datasets, build_loaders, build_segmentation_datasets, build_segmentation_loaders
+from training.engine import (
+    prepare_multimodal_batch, prepare_segmentation_batch, train_one_epoch, validate, validate_segmentation,
+)
+from training.metrics import compute_metrics
+
+
+def add_common_arguments(parser):
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=32, help="Per-process batch size")
+    parser.add_argument("--accumulation-steps", type=int, default=1,
+                        help="Batches per optimizer step; the effective batch is batch-size x accumulation-steps x processes")
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--patience", type=int, default=5)
+    parser.add_argument("--num-workers", type=int, default=4)
+    parser.add_argument("--prefetch-factor", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--channels-last", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--bf16", action="store_true", help="bfloat16 autocast (CPU or GPU)")
+    parser.add_argument("--resume", action="store_true", help="Continue from output-dir/last.pt if present")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", default="gloo", help="torch.distributed backend when launched with torchrun")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m training", description="Train skin cancer models")
+    subparsers = parser.add_subparsers(dest="task", required=True)
+
+    multimodal = subparsers.add_parser("multimodal", help="Train MultimodalModel")
+    source = multimodal.add_mutually_exclusive_group(required=True)
+    source.add_argument("--packed", help="Directory written by pack_dataset.py multimodal")
+    source.add_argument("--metadata-csv")
+    multimodal.add_argument("--fitz-path", default=FITZ_PATH)
+    multimodal.add_argument("--pad-base-path", default=PAD_BASE_PATH)
+    multimodal.add_argument("--image-size", type=int, default=224)
+    multimodal.add_argument("--pretrained", action=argparse.BooleanOptionalAction, default=True)
+    add_common_arguments(multimodal)
+
+    unet = subparsers.add_parser("unet", help="Train the segmentation UNet")
+    source = unet.add_mutually_exclusive_group(required=True)
+    source.add_argument("--packed", help="Directory written by pack_dataset.py isic")
+    source.add_argument("--images-path")
+    unet.add_argument("--masks-path")
+    unet.add_argument("--image-size", type=int, default=256)
+    unet.add_argument("--base-channels", type=int, default=64)
+    add_common_arguments(unet)
+    unet.set_defaults(lr=3e-4, epochs=30)
+    return parser
+
+
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def log_epoch(history_path, record):
+    if not distributed.is_main_process():
+        return
+    with open(history_path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def log(message):
+    if distributed.is_main_process():
+        print(message)
+
+
+def wrap_model(model, device):
+    if distributed.is_distributed():
+        device_ids = [device] if torch.device(device).type == "cuda" else None
+        return DistributedDataParallel(model, device_ids=device_ids)
+    return model
+
+
+def device_for_rank():
+    if torch.cuda.is_available():
+        local_rank = int(os.environ.get("LOCAL_RANK", "0"))
+        torch.cuda.set_device(local_rank)
+        return f"cuda:{local_rank}"
+    return "cpu"
+
+
+def run_epochs(args, model, optimizer, train_loader, run_epoch, weights_name):
+    """Shared epoch loop: early stopping on the score returned by
+    ``run_epoch``, best-weights export and resumable checkpoints."""
+    last_path = os.path.join(args.output_dir, "last.pt")
+    best_path = os.path.join(args.output_dir, weights_name)
+    history_path = os.path.join(args.output_dir, "history.jsonl")
+    module = model.module if isinstance(model, DistributedDataParallel) else model
+
+    state = {"epoch": 0, "best_score": -1.0, "epochs_no_improve": 0}
+    if args.resume and os.path.exists(last_path):
+        state = load_checkpoint(last_path, module, optimizer)
+        log(f"Resumed from {last_path} after epoch {state['epoch']}")
+
+    for epoch in range(state["epoch"], args.epochs):
+        if state["epochs_no_improve"] >= args.patience:
+            break
+
+        train_loader.sampler.set_epoch(epoch)
+        record = run_epoch(epoch)
+        predictions = record.pop("predictions", None)
+        score = record["score"]
+
+        if score > state["best_score"]:
+            state["best_score"] = score
+            state["epochs_no_improve"] = 0
+            if distributed.is_main_process():
+                save_weights(best_path, module)
+                if predictions is not None:
+                    # Validation logits of the best weights, for calibration.py fit.
+                    np.savez(os.path.join(args.output_dir, "val_predictions.npz"), **predictions)
+            log("Model saved! Score improved.")
+        else:
+            state["epochs_no_improve"] += 1
+            log(f"Score did not improve for {state['epochs_no_improve']} epochs.")
+
+        state["epoch"] = epoch + 1
+        if distributed.is_main_process():
+            save_checkpoint(last_path, module, optimizer, state)
+        log_epoch(history_path, {"epoch": epoch + 1, **record})
+        distributed.barrier()
+
+        if state["epochs_no_improve"] == args.patience:
+            log(f"Early stopping triggered after {args.patience} epochs with no improvement.")
+
+
+def train_multimodal(args):
+    device = device_for_rank()
+
+    train_dataset, val_dataset, labels, train_labels, batched = build_datasets(args)
+    train_loader, val_loader = build_loaders(args, train_dataset, val_dataset, train_labels, batched)
+
+    model = MultimodalModel(num_metadata_features=len(METADATA_COLS), pretrained=args.pretrained).to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    model = wrap_model(model, device)
+
+    neg_count, pos_count = np.bincount(labels, minlength=2)
+    pos_weight = torch.tensor([neg_count / pos_count], dtype=torch.float32).to(device)
+    criterion = nn.BCEWithLogitsLoss(pos_weight=pos_weight)
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+
+    def run_epoch(epoch):
+        train_stats = train_one_epoch(model, train_loader, optimizer, criterion, device, prepare_multimodal_batch,
+                                      args.bf16, args.channels_last, args.accumulation_steps)
+        val_loss, val_logits, val_labels = validate(model, val_loader, criterion, device, args.bf16, args.channels_last)
+        metrics = compute_metrics(torch.sigmoid(torch.from_numpy(val_logits)).numpy(), val_labels)
+
+        log(f"Epoch {epoch+1}/{args.epochs} | Train Loss: {train_stats['loss']:.4f} | Val Loss: {val_loss:.4f} | "
+            f"{train_stats['samples_per_sec']} samples/s (data wait {train_stats['data_wait_seconds']}s)")
+        log(f"Metrics: {metrics}")
+        return {"train": train_stats, "val_loss": val_loss, "metrics": metrics, "score": metrics['f1'],
+                "predictions": {"logits": val_logits, "labels": val_labels}}
+
+    run_epochs(args, model, optimizer, train_loader, run_epoch, "best_multimodal_model.pth")
+
+
+def train_unet(args):
+    device = device_for_rank()
+
+    train_dataset, test_dataset, batched = build_segmentation_datasets(args)
+    train_loader, test_loader = build_segmentation_loaders(args, train_dataset, test_dataset, batched)
+
+    model = UNet(n_channels=3, n_classes=1, base_channels=args.base_channels).to(device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    model = wrap_model(model, device)
+
+    criterion = nn.BCEWithLogitsLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+
+    def run_epoch(epoch):
+        train_stats = train_one_epoch(model, train_loader, optimizer, criterion, device, prepare_segmentation_batch,
+                                      args.bf16, args.channels_last, args.accumulation_steps)
+        test_loss, dice = validate_segmentation(model, test_loader, criterion, device, args.bf16, args.channels_last)
+
+        log(f"Epoch {epoch+1}/{args.epochs} | Train Loss: {train_stats['loss']:.4f} | Test Loss: {test_loss:.4f} | "
+            f"Dice: {dice:.4f} | {train_stats['samples_per_sec']} samples/s")
+        return {"train": train_stats, "test_loss": test_loss, "dice": dice, "score": dice}
+
+    run_epochs(args, model, optimizer, train_loader, run_epoch, "segmentation_model.pth")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    distributed.init_distributed(args.backend)
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # Same seed on every rank: DDP needs identical initial weights.
+    seed_everything(args.seed)
+
+    try:
+        if args.task == "multimodal":
+            train_multimodal(args)
+        elif args.task == "unet":
+            train_unet(args)
+    finally:
+        distributed.cleanup()
@@ -0,0 +1,103 @@
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, DistributedSampler, Subset
+
+from datasets import (
+    METADATA_COLS, ISICDataset, MultimodalSkinCancerDataset, PackedMultimodalDataset,
+    PackedSegmentationDataset, build_transforms, load_metadata, packed_collate,
+)
+from training.distributed import DistributedWeightedSampler, ShardSampler, get_rank, get_world_size
+
+
+def stratified_split(labels, test_size=0.2, random_state=42):
+    """Indices of the notebook's train/val split (train_test_split with
+    stratify on binary_label and random_state=42)."""
+    from sklearn.model_selection import train_test_split
+
+    indices = np.arange(len(labels))
+    return train_test_split(indices, test_size=test_size, random_state=random_state, stratify=labels)
+
+
+def class_balanced_weights(labels):
+    counts = np.bincount(labels)
+    return (1.0 / counts)[labels]
+
+
+def build_datasets(args):
+    """Return (train_dataset, val_dataset, all_labels, train_labels, batched)."""
+    if args.packed:
+        train_full = PackedMultimodalDataset(args.packed, augment=True)
+        val_full = PackedMultimodalDataset(args.packed, augment=False)
+        labels = train_full.labels
+        train_idx, val_idx = stratified_split(labels)
+        return Subset(train_full, train_idx), Subset(val_full, val_idx), labels, labels[train_idx], True
+
+    metadata = load_metadata(args.metadata_csv, args.pad_base_path)
+    labels = metadata["binary_label"].to_numpy(dtype=np.int64)
+    train_idx, val_idx = stratified_split(labels)
+    train_df = metadata.iloc[train_idx].reset_index(drop=True)
+    val_df = metadata.iloc[val_idx].reset_index(drop=True)
+
+    train_transform, val_transform = build_transforms(args.image_size)
+    train_dataset = MultimodalSkinCancerDataset(train_df, METADATA_COLS, train_transform, args.fitz_path)
+    val_dataset = MultimodalSkinCancerDataset(val_df, METADATA_COLS, val_transform, args.fitz_path)
+    return train_dataset, val_dataset, labels, labels[train_idx], False
+
+
+def build_segmentation_datasets(args):
+    """Return (train_dataset, test_dataset, batched), split 80/20 in order as
+    in segmentation.ipynb."""
+    if args.packed:
+        train_full = PackedSegmentationDataset(args.packed, augment=True)
+        test_full = PackedSegmentationDataset(args.packed, augment=False)
+        batched = True
+    else:
+        import albumentations as A
+
+        transform = A.Compose([
+            A.Resize(height=args.image_size, width=args.image_size),
+            A.Rotate(limit=35, p=1.0),
+            A.HorizontalFlip(p=0.5),
+            A.VerticalFlip(p=0.1)
+        ])
+        test_transform = A.Resize(height=args.image_size, width=args.image_size)
+        train_full = ISICDataset(args.images_path, args.masks_path, args.image_size, transform=transform)
+        test_full = ISICDataset(args.images_path, args.masks_path, args.image_size, transform=test_transform)
+        batched = False
+
+    train_size = int(0.8 * len(train_full))
+    return Subset(train_full, range(train_size)), Subset(test_full, range(train_size, len(test_full))), batched
+
+
+def loader_options(args, batched):
+    options = {
+        "batch_size": args.batch_size,
+        "num_workers": args.num_workers,
+        "pin_memory": torch.cuda.is_available(),
+    }
+    if args.num_workers > 0:
+        options["persistent_workers"] = True
+        options["prefetch_factor"] = args.prefetch_factor
+    if batched:
+        options["collate_fn"] = packed_collate
+    return options
+
+
+def build_loaders(args, train_dataset, val_dataset, train_labels, batched):
+    """Class-balanced training loader and evaluation loader, each sharded
+    across the ranks of the process group (if any)."""
+    train_sampler = DistributedWeightedSampler(class_balanced_weights(train_labels), seed=args.seed)
+    options = loader_options(args, batched)
+    train_loader = DataLoader(train_dataset, sampler=train_sampler, **options)
+    val_loader = DataLoader(val_dataset, sampler=ShardSampler(len(val_dataset)), **options)
+    return train_loader, val_loader
+
+
+def build_segmentation_loaders(args, train_dataset, test_dataset, batched):
+    train_sampler = DistributedSampler(
+        train_dataset, num_replicas=get_world_size(), rank=get_rank(), shuffle=True, seed=args.seed
+    )
+    options = loader_options(args, batched)
+    train_loader = DataLoader(train_dataset, sampler=train_sampler, **options)
+    test_loader = DataLoader(test_dataset, sampler=ShardSampler(len(test_dataset)), **options)
+    return train_loader, test_loader
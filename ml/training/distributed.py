@@ -0,0 +1,137 @@
+"""torch.distributed helpers.
+
+Launch one process per worker with torchrun, on one or several nodes:
+
+    torchrun --nproc-per-node 4 -m training multimodal --packed data/multimodal --output-dir runs/ddp
+    torchrun --nnodes 2 --node-rank 0 --master-addr 10.0.0.1 --nproc-per-node 8 -m training ...
+
+Without torchrun's environment variables everything runs as a single process.
+"""
+import math
+import os
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import Sampler
+
+
+def init_distributed(backend="gloo"):
+    """Join the process group described by torchrun's environment, if any.
+    Returns (rank, world_size)."""
+    world_size = int(os.environ.get("WORLD_SIZE", "1"))
+    if world_size > 1 and not dist.is_initialized():
+        dist.init_process_group(backend=backend)
+    return get_rank(), get_world_size()
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def all_reduce_sum(tensor):
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return tensor
+
+
+def cleanup():
+    if is_distributed():
+        dist.destroy_process_group()
+
+
+class DistributedWeightedSampler(Sampler):
+    """WeightedRandomSampler split across ranks.
+
+    Every rank draws the same ``num_samples`` indices from a generator seeded
+    with ``seed + epoch`` and keeps every ``world_size``-th one, so together
+    the ranks cover exactly one class-balanced epoch. Call ``set_epoch``
+    before each epoch, as with DistributedSampler.
+    """
+
+    def __init__(self, weights, num_samples=None, rank=None, world_size=None, replacement=True, seed=0):
+        self.weights = torch.as_tensor(weights, dtype=torch.double)
+        self.num_samples = num_samples or len(self.weights)
+        self.rank = get_rank() if rank is None else rank
+        self.world_size = get_world_size() if world_size is None else world_size
+        self.replacement = replacement
+        self.seed = seed
+        self.epoch = 0
+        self.samples_per_rank = math.ceil(self.num_samples / self.world_size)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        total = self.samples_per_rank * self.world_size
+        indices = torch.multinomial(self.weights, total, self.replacement, generator=generator)
+        return iter(indices[self.rank:total:self.world_size].tolist())
+
+    def __len__(self):
+        return self.samples_per_rank
+
+
+class ShardSampler(Sampler):
+    """Deterministic, non-overlapping split of ``range(length)`` across ranks
+    for evaluation; the last ranks may get one item fewer."""
+
+    def __init__(self, length, rank=None, world_size=None):
+        rank = get_rank() if rank is None else rank
+        world_size = get_world_size() if world_size is None else world_size
+        self.indices = np.arange(rank, length, world_size)
+
+    def __iter__(self):
+        return iter(self.indices.tolist())
+
+    def __len__(self):
+        return len(self.indices)
+
+
+def gather_by_index(values, indices, length):
+    """Reassemble per-rank evaluation outputs into dataset order.
+
+    ``values`` and ``indices`` are this rank's 1-d tensors; returns the full
+    ``length``-long tensor on every rank.
+    """
+    if not is_distributed():
+        out = torch.empty(length, dtype=values.dtype)
+        out[indices] = values
+        return out
+
+    world_size = get_world_size()
+    max_len = math.ceil(length / world_size)
+    padded_values = torch.zeros(max_len, dtype=values.dtype)
+    padded_indices = torch.full((max_len,), -1, dtype=torch.int64)
+    padded_values[:len(values)] = values
+    padded_indices[:len(indices)] = indices
+
+    all_values = [torch.empty_like(padded_values) for _ in range(world_size)]
+    all_indices = [torch.empty_like(padded_indices) for _ in range(world_size)]
+    dist.all_gather(all_values, padded_values)
+    dist.all_gather(all_indices, padded_indices)
+
+    all_values = torch.cat(all_values)
+    all_indices = torch.cat(all_indices)
+    keep = all_indices >= 0
+    out = torch.empty(length, dtype=values.dtype)
+    out[all_indices[keep]] = all_values[keep]
+    return out
@@ -0,0 +1,151 @@
+import contextlib
+import time
+
+import torch
+from torch.nn.parallel import DistributedDataParallel
+
+from training.distributed import all_reduce_sum, gather_by_index
+
+
+def autocast_context(device, bf16):
+    if not bf16:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=torch.device(device).type, dtype=torch.bfloat16)
+
+
+def prepare_multimodal_batch(batch, device, channels_last):
+    images, metadata, labels = batch
+    images = images.to(device, non_blocking=True)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    metadata = torch.as_tensor(metadata).to(device, non_blocking=True)
+    labels = torch.as_tensor(labels).float().unsqueeze(1).to(device, non_blocking=True)
+    return (images, metadata), labels
+
+
+def prepare_segmentation_batch(batch, device, channels_last):
+    images, masks = batch
+    images = images.to(device, non_blocking=True)
+    if channels_last:
+        images = images.contiguous(memory_format=torch.channels_last)
+    return (images,), masks.to(device, non_blocking=True)
+
+
+def train_one_epoch(model, loader, optimizer, criterion, device, prepare_batch,
+                    bf16=False, channels_last=False, accumulation_steps=1):
+    """One pass over ``loader``, stepping the optimizer every
+    ``accumulation_steps`` batches. Under DDP gradients are only all-reduced
+    on the batch that steps."""
+    model.train()
+    # Accumulated on-device so the loop does not synchronize on loss.item().
+    running_loss = torch.zeros((), device=device)
+    samples = 0
+    data_seconds = 0.0
+    num_batches = len(loader)
+    optimizer.zero_grad(set_to_none=True)
+    start = end = time.perf_counter()
+
+    for step, batch in enumerate(loader):
+        data_seconds += time.perf_counter() - end
+        inputs, targets = prepare_batch(batch, device, channels_last)
+
+        sync = (step + 1) % accumulation_steps == 0 or step + 1 == num_batches
+        if not sync and isinstance(model, DistributedDataParallel):
+            context = model.no_sync()
+        else:
+            context = contextlib.nullcontext()
+
+        with context:
+            with autocast_context(device, bf16):
+                outputs = model(*inputs)
+            loss = criterion(outputs.float(), targets)
+            (loss / accumulation_steps).backward()
+
+        if sync:
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+
+        running_loss += loss.detach() * targets.shape[0]
+        samples += targets.shape[0]
+        end = time.perf_counter()
+
+    seconds = time.perf_counter() - start
+    totals = all_reduce_sum(torch.tensor([running_loss.item(), float(samples)], dtype=torch.float64))
+    total_loss, total_samples = totals.tolist()
+    return {
+        "loss": total_loss / max(total_samples, 1),
+        "samples": int(total_samples),
+        "seconds": round(seconds, 2),
+        "data_wait_seconds": round(data_seconds, 2),
+        "samples_per_sec": round(total_samples / seconds, 2) if seconds else None,
+    }
+
+
+def sampler_indices(loader):
+    indices = getattr(loader.sampler, "indices", None)
+    if indices is None:
+        indices = range(len(loader.dataset))
+    return torch.as_tensor(indices, dtype=torch.int64)
+
+
+def validate(model, loader, criterion, device, bf16=False, channels_last=False):
+    """Return (mean loss, logits, labels) for the whole validation set.
+
+    Each rank scores its shard into tensors allocated once; under DDP the
+    shards are gathered back into dataset order on every rank.
+    """
+    model.eval()
+    indices = sampler_indices(loader)
+    all_logits = torch.empty(len(indices))
+    all_labels = torch.empty(len(indices), dtype=torch.int64)
+    running_loss = torch.zeros((), device=device)
+    offset = 0
+
+    with torch.no_grad():
+        for batch in loader:
+            (images, metadata), labels = prepare_multimodal_batch(batch, device, channels_last)
+            with autocast_context(device, bf16):
+                outputs = model(images, metadata)
+            outputs = outputs.float()
+            running_loss += criterion(outputs, labels) * labels.shape[0]
+
+            n = labels.shape[0]
+            all_logits[offset:offset + n] = outputs.flatten().cpu()
+            all_labels[offset:offset + n] = labels.flatten().cpu()
+            offset += n
+
+    total = len(loader.dataset)
+    loss = all_reduce_sum(torch.tensor([running_loss.item()], dtype=torch.float64)).item() / max(total, 1)
+    logits = gather_by_index(all_logits[:offset], indices[:offset], total)
+    labels = gather_by_index(all_labels[:offset], indices[:offset], total)
+    return loss, logits.numpy(), labels.numpy()
+
+
+def validate_segmentation(model, loader, criterion, device, bf16=False, channels_last=False):
+    """Return (mean loss, mean per-image Dice) as in check_accuracy in
+    segmentation.ipynb with a batch size of 1."""
+    model.eval()
+    indices = sampler_indices(loader)
+    dice = torch.empty(len(indices))
+    running_loss = torch.zeros((), device=device)
+    offset = 0
+
+    with torch.no_grad():
+        for batch in loader:
+            (images,), masks = prepare_segmentation_batch(batch, device, channels_last)
+            with autocast_context(device, bf16):
+                outputs = model(images)
+            outputs = outputs.float()
+            running_loss += criterion(outputs, masks) * masks.shape[0]
+
+            preds = (outputs > 0).float()
+            intersection = (preds * masks).flatten(1).sum(1)
+            totals = (preds + masks).flatten(1).sum(1)
+            n = masks.shape[0]
+            dice[offset:offset + n] = (2 * intersection / totals.clamp_min(1e-8)).cpu()
+            offset += n
+
+    total = len(loader.dataset)
+    loss = all_reduce_sum(torch.tensor([running_loss.item()], dtype=torch.float64)).item() / max(total, 1)
+    dice = gather_by_index(dice[:offset], indices[:offset], total)
+    return loss, float(dice.mean())
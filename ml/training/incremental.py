@@ -0,0 +1,375 @@
+"""Incremental fine-tuning from doctor-labeled escalations, run from ml/:
+
+    python -m training.incremental --registry models/registry --holdout data/holdout \\
+        --django-project ../backend/multimodal_project --state-dir runs/incremental
+
+Each run pulls the escalations labeled 'cancer positive' / 'cancer negative'
+since the previous run (Escalation.labeled_at), adds them to the labeled
+samples kept in --state-dir and fine-tunes only ``metadata_fc`` and
+``classifier`` of the active registry version on cached ResNet18
+embeddings. The backbone is frozen, so embeddings are computed once per
+image and reused across runs until the backbone itself changes.
+
+The epoch to keep is picked on a stratified --val-fraction of the labeled
+samples. Only that candidate is scored on the fixed holdout (a directory
+written by pack_dataset.py multimodal), so the accept decision is not the
+best of many noisy holdout scores; it is registered as
+``<base>-ft<timestamp>`` only if it beats the base model by
+--min-improvement, and --activate also makes it the active version.
+"""
+import argparse
+import ast
+import copy
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+import torch.nn as nn
+from PIL import Image
+from torchvision import transforms
+
+from datasets import METADATA_COLS, PackedMultimodalDataset
+from featurizer import encode_batch
+from registry import ModelRegistry
+from training.metrics import compute_metrics
+
+LABELS = {"cancer positive": 1, "cancer negative": 0}
+
+transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize([0.5, 0.5, 0.5], [0.5, 0.5, 0.5])
+])
+
+
+class Head(nn.Module):
+    """The trainable part of MultimodalModel, fed precomputed image features."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.metadata_fc = model.metadata_fc
+        self.classifier = model.classifier
+
+    def forward(self, embeddings, metadata):
+        return self.classifier(torch.cat([embeddings, self.metadata_fc(metadata)], dim=1))
+
+
+def setup_django(project_dir):
+    sys.path.insert(0, os.path.abspath(project_dir))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "multimodal_project.settings")
+    import django
+
+    django.setup()
+
+
+def parse_metadata(raw):
+    """ImageUpload.metadata holds JSON, or the repr of a dict for uploads
+    stored before it was serialized."""
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError:
+        try:
+            value = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            return {}
+        return value if isinstance(value, dict) else {}
+
+
+def iter_labeled_escalations(since, chunk_size=500):
+    """Stream escalations labeled after ``since`` (oldest first) as plain
+    dicts, without loading the whole table."""
+    from api.models import Escalation
+
+    queryset = Escalation.objects.filter(status__in=LABELS, labeled_at__isnull=False)
+    if since is not None:
+        queryset = queryset.filter(labeled_at__gt=since)
+    queryset = queryset.select_related("image").order_by("labeled_at", "id").only(
+        "id", "status", "labeled_at", "image__id", "image__metadata"
+    )
+    for escalation in queryset.iterator(chunk_size=chunk_size):
+        yield {
+            "escalation_id": escalation.id,
+            "image_id": escalation.image.id,
+            "metadata": encode_batch([parse_metadata(escalation.image.metadata)])[0].tolist(),
+            "label": LABELS[escalation.status],
+            "labeled_at": escalation.labeled_at.isoformat(),
+        }
+
+
+def backbone_fingerprint(model):
+    """Digest of the frozen backbone's weights; cached embeddings are only
+    valid for the backbone that produced them."""
+    digest = hashlib.sha256()
+    for name, tensor in model.cnn.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def load_state(state_dir):
+    path = os.path.join(state_dir, "state.json")
+    if not os.path.exists(path):
+        return {"last_labeled_at": None, "runs": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_json(path, value):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(value, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def save_torch(path, value):
+    tmp_path = path + ".tmp"
+    torch.save(value, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def load_torch(path, default):
+    return torch.load(path, map_location="cpu") if os.path.exists(path) else default
+
+
+def read_image(upload):
+    """The RGB original of an ImageUpload, hot or cold (api/storage.py)."""
+    from api.storage import open_original
+
+    with open_original(upload) as f:
+        return Image.open(f).convert("RGB")
+
+
+@torch.inference_mode()
+def embed_uploads(model, image_ids, device, batch_size):
+    """ResNet18 features (512,) by upload id. Uploads that are gone or
+    whose original cannot be read are left out."""
+    from api.models import ImageUpload
+
+    uploads = ImageUpload.objects.only("id", "image", "tier", "original").in_bulk(image_ids)
+    out = {}
+    for start in range(0, len(image_ids), batch_size):
+        batch_ids, batch = [], []
+        for image_id in image_ids[start:start + batch_size]:
+            try:
+                image = read_image(uploads[image_id])
+            except (KeyError, OSError):
+                continue
+            batch_ids.append(image_id)
+            batch.append(transform(image))
+        if batch:
+            features = model.cnn(torch.stack(batch).to(device)).float().cpu()
+            out.update(zip(batch_ids, features))
+    return out
+
+
+@torch.inference_mode()
+def embed_holdout(model, root, device, batch_size):
+    dataset = PackedMultimodalDataset(root, augment=False)
+    embeddings, metadata, labels = [], [], []
+    for start in range(0, len(dataset), batch_size):
+        images, meta, label = dataset.__getitems__(list(range(start, min(start + batch_size, len(dataset)))))
+        embeddings.append(model.cnn(images.to(device)).float().cpu())
+        metadata.append(meta)
+        labels.append(label)
+    return {"embeddings": torch.cat(embeddings), "metadata": torch.cat(metadata), "labels": torch.cat(labels)}
+
+
+@torch.inference_mode()
+def evaluate_head(head, holdout, device):
+    head.eval()
+    logits = head(holdout["embeddings"].to(device), holdout["metadata"].to(device))
+    probs = torch.sigmoid(logits).flatten().cpu().numpy()
+    return compute_metrics(probs, holdout["labels"].numpy())
+
+
+def validation_split(labels, fraction, seed):
+    """(train, val) index tensors, stratified by label."""
+    generator = torch.Generator().manual_seed(seed)
+    train, val = [], []
+    for label in labels.unique():
+        indices = (labels == label).nonzero().flatten()
+        indices = indices[torch.randperm(len(indices), generator=generator)]
+        n_val = int(round(len(indices) * fraction))
+        val.append(indices[:n_val])
+        train.append(indices[n_val:])
+    return torch.cat(train).sort().values, torch.cat(val).sort().values
+
+
+def fine_tune(head, embeddings, metadata, labels, validation, device, args):
+    """Train ``head`` on the labeled samples; returns (state dict of the
+    epoch best on ``validation``, per-epoch history). Without both classes
+    in ``validation`` there is nothing to select on and the last epoch is
+    kept."""
+    selectable = validation is not None and len(validation["labels"].unique()) == 2
+    neg_count, pos_count = np.bincount(labels.numpy(), minlength=2)
+    pos_weight = torch.tensor([neg_count / max(pos_count, 1)], dtype=torch.float32).to(device)
+    criterion = nn.BCEWithLogitsLoss(pos_weight=pos_weight)
+    optimizer = torch.optim.Adam(head.parameters(), lr=args.lr)
+
+    embeddings, metadata = embeddings.to(device), metadata.to(device)
+    targets = labels.float().unsqueeze(1).to(device)
+    best_state, best_metrics, history = None, None, []
+
+    for epoch in range(args.epochs):
+        head.train()
+        order = torch.randperm(len(targets))
+        # BatchNorm1d in metadata_fc cannot train on a single sample.
+        batches = [order[i:i + args.batch_size] for i in range(0, len(order), args.batch_size)]
+        batches = [batch for batch in batches if len(batch) > 1]
+        running_loss = 0.0
+        for batch in batches:
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(head(embeddings[batch], metadata[batch]), targets[batch])
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * len(batch)
+
+        metrics = evaluate_head(head, validation, device) if selectable else None
+        history.append({"epoch": epoch + 1, "loss": running_loss / max(len(targets), 1), "metrics": metrics})
+        print(f"Epoch {epoch+1}/{args.epochs} | Loss: {history[-1]['loss']:.4f} | Validation: {metrics}")
+        if not selectable or best_metrics is None or metrics[args.metric] > best_metrics[args.metric]:
+            best_metrics = metrics
+            best_state = copy.deepcopy(head.state_dict())
+
+    return best_state, history
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Fine-tune the model head on doctor-labeled escalations")
+    parser.add_argument("--registry", default=os.getenv("MODEL_REGISTRY_DIR", "models/registry"))
+    parser.add_argument("--base-version", help="Registry version to fine-tune; defaults to the active one")
+    parser.add_argument("--holdout", required=True, help="Directory written by pack_dataset.py multimodal")
+    parser.add_argument("--django-project", default="../backend/multimodal_project")
+    parser.add_argument("--state-dir", default="runs/incremental",
+                        help="Keeps the labeled samples, embedding caches and the last run's position")
+    parser.add_argument("--min-new-labels", type=int, default=1, help="Skip the run below this many new labels")
+    parser.add_argument("--epochs", type=int, default=20)
+    parser.add_argument("--val-fraction", type=float, default=0.2,
+                        help="Share of the labeled samples held out to pick the epoch")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--embed-batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--metric", choices=["f1", "roc_auc"], default="f1")
+    parser.add_argument("--min-improvement", type=float, default=0.0)
+    parser.add_argument("--activate", action="store_true", help="Make the new version active")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.epochs < 1:
+        parser.error("--epochs must be at least 1")
+    if not 0 <= args.val_fraction < 1:
+        parser.error("--val-fraction must be in [0, 1)")
+    torch.manual_seed(args.seed)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    os.makedirs(args.state_dir, exist_ok=True)
+
+    state = load_state(args.state_dir)
+    samples_path = os.path.join(args.state_dir, "samples.pt")
+    samples = load_torch(samples_path, {})
+
+    setup_django(args.django_project)
+    since = datetime.fromisoformat(state["last_labeled_at"]) if state["last_labeled_at"] else None
+    new_labels = 0
+    for sample in iter_labeled_escalations(since):
+        # A relabeled escalation replaces its earlier label.
+        samples[sample["escalation_id"]] = sample
+        state["last_labeled_at"] = sample["labeled_at"]
+        new_labels += 1
+    print(f"{new_labels} new labels, {len(samples)} labeled escalations in total")
+    if new_labels < args.min_new_labels:
+        print(f"Fewer than {args.min_new_labels} new labels; nothing to do.")
+        return
+    save_torch(samples_path, samples)
+
+    registry = ModelRegistry(args.registry)
+    base_version = args.base_version or registry.active_version()
+    if base_version is None:
+        raise SystemExit(f"No active version in {args.registry}; pass --base-version")
+    model = registry.load(base_version, device)
+    fingerprint = backbone_fingerprint(model)
+
+    cache_path = os.path.join(args.state_dir, f"embeddings-{fingerprint}.pt")
+    cache = load_torch(cache_path, {})
+    missing = sorted({s["image_id"] for s in samples.values() if s["image_id"] not in cache})
+    if missing:
+        print(f"Embedding {len(missing)} images")
+        embedded = embed_uploads(model, missing, device, args.embed_batch_size)
+        if len(embedded) < len(missing):
+            print(f"Skipping {len(missing) - len(embedded)} escalations whose image is missing")
+        cache.update(embedded)
+        save_torch(cache_path, cache)
+
+    holdout_path = os.path.join(args.state_dir, f"holdout-{fingerprint}.pt")
+    holdout = load_torch(holdout_path, None)
+    if holdout is None or holdout.get("root") != os.path.abspath(args.holdout):
+        holdout = embed_holdout(model, args.holdout, device, args.embed_batch_size)
+        holdout["root"] = os.path.abspath(args.holdout)
+        save_torch(holdout_path, holdout)
+
+    ordered = [s for s in samples.values() if s["image_id"] in cache]
+    if not ordered:
+        print("No labeled escalation has a readable image; nothing to do.")
+        return
+    embeddings = torch.stack([cache[s["image_id"]] for s in ordered])
+    metadata = torch.tensor([s["metadata"] for s in ordered], dtype=torch.float32)
+    labels = torch.tensor([s["label"] for s in ordered], dtype=torch.int64)
+    train_idx, val_idx = validation_split(labels, args.val_fraction, args.seed)
+    validation = {"embeddings": embeddings[val_idx], "metadata": metadata[val_idx], "labels": labels[val_idx]}
+    print(f"{len(train_idx)} training and {len(val_idx)} validation samples")
+
+    head = Head(copy.deepcopy(model)).to(device)
+    base_metrics = evaluate_head(head, holdout, device)
+    print(f"Base {base_version} holdout: {base_metrics}")
+    best_state, history = fine_tune(
+        head, embeddings[train_idx], metadata[train_idx], labels[train_idx], validation, device, args
+    )
+    head.load_state_dict(best_state)
+    best_metrics = evaluate_head(head, holdout, device)
+    print(f"Candidate holdout: {best_metrics}")
+
+    improved = best_metrics[args.metric] > base_metrics[args.metric] + args.min_improvement
+    run = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "base_version": base_version,
+        "new_labels": new_labels,
+        "samples": len(ordered),
+        "base_metrics": base_metrics,
+        "metrics": best_metrics,
+        "version": None,
+    }
+
+    if improved:
+        model.metadata_fc, model.classifier = head.metadata_fc, head.classifier
+        version = f"{base_version}-ft{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint_path = os.path.join(tmp_dir, "model.pth")
+            torch.save(model.state_dict(), checkpoint_path)
+            notes = (f"Head fine-tuned from {base_version} on {len(ordered)} labeled escalations; "
+                     f"holdout {args.metric} {base_metrics[args.metric]:.4f} -> {best_metrics[args.metric]:.4f}")
+            registry.register(checkpoint_path, version, len(METADATA_COLS), notes)
+        if args.activate:
+            registry.set_active(version)
+        run["version"] = version
+        print(f"Registered {version}" + (" (active)" if args.activate else ""))
+    else:
+        print(f"Holdout {args.metric} did not improve on {base_version}; nothing registered.")
+
+    with open(os.path.join(args.state_dir, "history.jsonl"), "a") as f:
+        f.write(json.dumps({**run, "epochs": history}) + "\n")
+    state["runs"].append(run)
+    save_json(os.path.join(args.state_dir, "state.json"), state)
+
+
+if __name__ == "__main__":
+    main()
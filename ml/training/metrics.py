@@ -0,0 +1,40 @@
+import numpy as np
+
+
+def roc_auc(probs, labels):
+    """Rank-based ROC AUC with tied scores given their average rank."""
+    positives = labels == 1
+    n_pos = int(positives.sum())
+    n_neg = len(labels) - n_pos
+    if n_pos == 0 or n_neg == 0:
+        return float("nan")
+
+    order = np.argsort(probs, kind="mergesort")
+    _, inverse, counts = np.unique(probs[order], return_inverse=True, return_counts=True)
+    average_rank = np.cumsum(counts) - (counts - 1) / 2
+    ranks = np.empty(len(probs))
+    ranks[order] = average_rank[inverse]
+    return float((ranks[positives].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg))
+
+
+def compute_metrics(probs, labels, threshold=0.5):
+    """Same metrics as compute_metrics in multimodal.ipynb, on whole arrays."""
+    probs = np.asarray(probs, dtype=np.float64).ravel()
+    labels = np.asarray(labels).ravel().astype(np.int64)
+    preds = probs > threshold
+    positives = labels == 1
+
+    tp = int(np.sum(preds & positives))
+    fp = int(np.sum(preds & ~positives))
+    fn = int(np.sum(~preds & positives))
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    return {
+        'accuracy': float(np.mean(preds == positives)),
+        'precision': precision,
+        'recall': recall,
+        'f1': f1,
+        'roc_auc': roc_auc(probs, labels),
+    }
@@ -0,0 +1,90 @@
+"""Adaptive test-time augmentation.
+
+Requests whose calibrated first-pass probability falls in the uncertain band
+(the "medium" confidence band, CONFIDENCE_LOW..CONFIDENCE_HIGH) are scored
+again on flipped/rotated variants of the same image, mirroring the
+RandomHorizontalFlip/RandomRotation(10) augmentation used in training. All
+extra views go through the model as one batch and their logits are averaged
+with the first-pass logit.
+"""
+import math
+import threading
+
+import torch
+import torchvision.transforms.functional as TF
+
+from shadow import ModelStats
+
+MODES = ("off", "adaptive", "always")
+
+# Pixel value of black after Normalize([0.5]*3, [0.5]*3); RandomRotation on the
+# PIL image fills the corners with black during training.
+ROTATION_FILL = -1.0
+
+
+def augmented_views(image_tensor, num_views):
+    """Return up to ``num_views`` augmented copies of a (1, C, H, W) batch,
+    excluding the unmodified image."""
+    flipped = TF.hflip(image_tensor)
+    candidates = [
+        flipped,
+        TF.rotate(image_tensor, 10, fill=ROTATION_FILL),
+        TF.rotate(image_tensor, -10, fill=ROTATION_FILL),
+        TF.rotate(flipped, 10, fill=ROTATION_FILL),
+        TF.rotate(flipped, -10, fill=ROTATION_FILL),
+    ]
+    return torch.cat(candidates[:num_views], dim=0)
+
+
+class TestTimeAugmentation:
+    MAX_VIEWS = 6
+
+    def __init__(self, mode="adaptive", num_views=4, low=0.3, high=0.7):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.mode = mode
+        self.num_views = max(2, min(num_views, self.MAX_VIEWS))
+        self.low = low
+        self.high = high
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.added_latency = ModelStats()
+
+    def should_apply(self, probability):
+        with self._lock:
+            self.requests += 1
+        if self.mode == "always":
+            return True
+        return self.mode == "adaptive" and self.low <= probability <= self.high
+
+    def refine(self, model, image_tensor, metadata_tensor, first_logit):
+        """Average ``first_logit`` with the logits of the augmented views."""
+        views = augmented_views(image_tensor, self.num_views - 1)
+        metadata = metadata_tensor.expand(views.shape[0], -1)
+        with torch.no_grad():
+            logits = model(views, metadata).flatten()
+        return (first_logit + logits.sum().item()) / (logits.numel() + 1)
+
+    def record(self, latency):
+        with self._lock:
+            self.added_latency.record(latency)
+
+    def summary(self):
+        with self._lock:
+            escalated = self.added_latency.requests
+            latency = self.added_latency.summary()
+            return {
+                "mode": self.mode,
+                "num_views": self.num_views,
+                "band": [self.low, self.high],
+                "requests": self.requests,
+                "escalated": escalated,
+                "escalation_rate": round(escalated / self.requests, 4) if self.requests else None,
+                "added_p50_ms": latency["p50_ms"],
+                "added_p99_ms": latency["p99_ms"],
+            }
+
+
+def sigmoid(logit):
+    return 1.0 / (1.0 + math.exp(-logit))